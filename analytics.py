@@ -0,0 +1,98 @@
+"""Read-side queries over the structured action_logs columns.
+
+Every query here is an index range scan (idx_action_logs_event_action,
+idx_action_logs_reg, idx_action_logs_user), so they stay cheap however much
+history piles up. Entries of archived events (see log_archive.py) only count
+towards funnel_counts, through action_log_rollup. All functions take a cursor
+and return sqlite3 rows or plain dicts; payload is decoded from JSON.
+"""
+import json
+
+# Statuses a registration leaves the event with; the dashboard's "unregistered" panel
+FINAL_STATUSES = ('UNREGISTERED', 'EXPIRED')
+
+
+def decode_payload(row):
+    """Return the row as a dict with payload parsed from JSON."""
+    entry = dict(row)
+    if entry.get('payload'):
+        entry['payload'] = json.loads(entry['payload'])
+    return entry
+
+
+def event_timeline(cursor, event_id, actions=None, before_id=None, limit=100):
+    """Newest-first log entries of an event, optionally only the given actions.
+
+    Pass the smallest id seen as before_id to page further back."""
+    sql = "SELECT * FROM action_logs WHERE event_id = ?"
+    params = [event_id]
+    if actions:
+        sql += f" AND action IN ({', '.join('?' * len(actions))})"
+        params.extend(actions)
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    cursor.execute(sql, params)
+    return [decode_payload(row) for row in cursor.fetchall()]
+
+
+def funnel_counts(cursor, event_id):
+    """{action: number of entries} for an event, including entries already archived."""
+    cursor.execute(
+        """
+        SELECT action, SUM(n) AS n FROM (
+            SELECT action, COUNT(*) AS n FROM action_logs WHERE event_id = ? GROUP BY action
+            UNION ALL
+            SELECT action, entries FROM action_log_rollup WHERE event_id = ?
+        ) GROUP BY action
+        """,
+        (event_id, event_id)
+    )
+    return {row['action']: row['n'] for row in cursor.fetchall()}
+
+
+def status_transitions(cursor, event_id):
+    """{(old_status, new_status): count} over every logged status change of an event."""
+    cursor.execute(
+        "SELECT old_status, new_status, COUNT(*) AS n FROM action_logs "
+        "WHERE event_id = ? AND new_status IS NOT NULL GROUP BY old_status, new_status",
+        (event_id,)
+    )
+    return {(row['old_status'], row['new_status']): row['n'] for row in cursor.fetchall()}
+
+
+def user_history(cursor, user_id, event_id=None, limit=100):
+    """Newest-first log entries of one user, across events unless event_id is given."""
+    if event_id is None:
+        cursor.execute(
+            "SELECT * FROM action_logs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit)
+        )
+    else:
+        cursor.execute(
+            "SELECT * FROM action_logs WHERE user_id = ? AND event_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, event_id, limit)
+        )
+    return [decode_payload(row) for row in cursor.fetchall()]
+
+
+def registration_history(cursor, reg_id):
+    """Oldest-first status changes and other entries logged for one registration."""
+    cursor.execute("SELECT * FROM action_logs WHERE reg_id = ? ORDER BY id", (reg_id,))
+    return [decode_payload(row) for row in cursor.fetchall()]
+
+
+def unregistered_with_times(cursor, event_id):
+    """Registrations that left the event, each with unreg_time: when it reached its status."""
+    cursor.execute(f"""
+        SELECT r.*,
+               (SELECT timestamp FROM action_logs
+                WHERE reg_id = r.id AND new_status = r.status
+                ORDER BY id DESC LIMIT 1) AS unreg_time
+        FROM registrations r
+        WHERE r.event_id = ? AND r.status IN ({', '.join('?' * len(FINAL_STATUSES))})
+        ORDER BY unreg_time DESC
+    """, (event_id, *FINAL_STATUSES))
+    return cursor.fetchall()
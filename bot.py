@@ -1,18 +1,28 @@
 import html
+import json
 import logging
-import random
 import os
 import asyncio
 import secrets
+import sys
 import string
 import re
+import sqlite3
+import time
+import weakref
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, BotCommandScopeDefault, BotCommandScopeChat
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, ChatMemberHandler, MessageHandler, SimpleUpdateProcessor, filters
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from models import init_db, get_db
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from models import init_db, get_db, close_pool, DB_PATH
+from broadcast import Recipient, send_bulk, resume_outbox, throttle
+from speaker_import import SpeakerImporter, ImportNotConfigured
+import analytics
+import log_archive
+import lottery
 import messages
 
 load_dotenv()
@@ -39,6 +49,23 @@ if not BOT_TOKEN:
 ADMIN_IDS = {int(i.strip()) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
 ORGANIZER_USERNAMES = {"ejania", "crassirostris", "awarehouse"}
 
+# Max concurrent get_chat_member calls when resolving speakers for the lottery.
+# Keeps bursts well under Telegram's ~30 requests/second bot limit.
+SPEAKER_CHECK_CONCURRENCY = int(os.getenv("SPEAKER_CHECK_CONCURRENCY", "20"))
+
+# Webhook mode: set WEBHOOK_URL (public base URL, e.g. https://conf.example.org)
+# to receive updates over HTTP instead of long polling. Telegram sends
+# WEBHOOK_SECRET in a header on every request; requests without it are rejected.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Bot API server, e.g. a local Bot API server or load_test.py's fake one
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
 # Timezone configuration
 TZ = ZoneInfo("Europe/Berlin")
 
@@ -83,6 +110,223 @@ def calculate_expiration_with_night_pause(now_utc: datetime, timeout_hours: int)
 scheduler = None
 application = None
 
+# Longest the cached current event is served without a re-read, as a backstop
+# for databases without the events_version counter (see models.py).
+EVENT_CACHE_MAX_AGE_SECONDS = 30
+# The events_version counter is read at most this often, so a burst of updates
+# costs one tiny query per second rather than one each.
+EVENT_CACHE_VERSION_CHECK_SECONDS = 1.0
+
+class EventCache:
+    """The current (most recently created) event row, kept in memory.
+
+    At most every EVENT_CACHE_VERSION_CHECK_SECONDS get() reads the events_version
+    counter, which triggers bump on any change to events from any process
+    (dashboard, import_speakers.py, manual fixes), and re-reads the event when it
+    moved; other processes' changes are thus seen within about a second. Handlers
+    that change the events table also write through with update()/invalidate()
+    after their commit, so the bot's own changes are seen at once.
+    Disabled until main() turns it on, in which case get() always reads the DB."""
+
+    def __init__(self):
+        self.enabled = False
+        self._event = None
+        self._loaded_at = None
+        self._version = None
+        self._checked_at = None
+
+    @staticmethod
+    def _read_version(cursor):
+        try:
+            cursor.execute("SELECT version FROM events_version")
+        except sqlite3.OperationalError:
+            return None
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get(self, cursor):
+        now = time.monotonic()
+        if self.enabled and self._loaded_at is not None and now - self._loaded_at < EVENT_CACHE_MAX_AGE_SECONDS:
+            if now - self._checked_at < EVENT_CACHE_VERSION_CHECK_SECONDS:
+                return self._event
+            version = self._read_version(cursor)
+            self._checked_at = now
+            if version == self._version:
+                return self._event
+        version = self._read_version(cursor) if self.enabled else None
+        cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
+        row = cursor.fetchone()
+        event = dict(row) if row else None
+        if self.enabled:
+            self._event = event
+            self._loaded_at = self._checked_at = now
+            self._version = version
+        return event
+
+    def update(self, event_id, **fields):
+        """Apply committed column changes to the cached event, if it is the one cached."""
+        if self._event is not None and self._event['id'] == event_id:
+            self._event = {**self._event, **fields}
+
+    def invalidate(self):
+        self._event = None
+        self._loaded_at = None
+
+event_cache = EventCache()
+
+SPEAKER_STATUSES = ("member", "administrator", "creator")
+# Membership answers are reused for this long. "Not a member" expires sooner so
+# a speaker who joins the group late is recognised quickly.
+SPEAKER_CACHE_TTL_SECONDS = 600
+SPEAKER_CACHE_NEGATIVE_TTL_SECONDS = 60
+SPEAKER_CACHE_MAX_ENTRIES = 20000
+
+class SpeakerMembershipCache:
+    """Speakers-group membership keyed by (group_id, user_id), with a TTL.
+
+    chat_member updates for the group call set() so joins and leaves take effect
+    immediately. Failed lookups are not cached. Disabled until main() turns it on,
+    in which case every check goes to Telegram."""
+
+    def __init__(self):
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    async def is_member(self, bot, group_id, user_id):
+        key = (group_id, user_id)
+        entry = self._entries.get(key)
+        if self.enabled and entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        try:
+            member = await bot.get_chat_member(group_id, user_id)
+        except Exception as e:
+            logging.error(f"Error checking speaker group membership: {e}")
+            return False
+        is_member = member.status in SPEAKER_STATUSES
+        self.set(group_id, user_id, is_member)
+        return is_member
+
+    def set(self, group_id, user_id, is_member):
+        if not self.enabled:
+            return
+        if len(self._entries) >= SPEAKER_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+            if len(self._entries) >= SPEAKER_CACHE_MAX_ENTRIES:
+                self._entries.clear()
+        ttl = SPEAKER_CACHE_TTL_SECONDS if is_member else SPEAKER_CACHE_NEGATIVE_TTL_SECONDS
+        self._entries[(group_id, user_id)] = (is_member, time.monotonic() + ttl)
+
+    def invalidate(self, group_id=None, user_id=None):
+        if group_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop((group_id, user_id), None)
+
+speaker_cache = SpeakerMembershipCache()
+speaker_importer = SpeakerImporter()
+
+def _speakers_mirror_synced(event):
+    """True once the event's speakers table came from a complete group import.
+
+    From then on chat_member updates keep it current, so it can answer
+    "is this user a speaker?" without asking Telegram."""
+    return 'speakers_synced_at' in event.keys() and event['speakers_synced_at'] is not None
+
+async def _bot_is_group_admin(bot, group_id):
+    """True if the bot administers group_id, so Telegram sends it the group's chat_member updates."""
+    try:
+        member = await bot.get_chat_member(group_id, bot.id)
+    except Exception as e:
+        logging.error(f"Could not check the bot's rights in group {group_id}: {e}")
+        return False
+    return member.status in ("administrator", "creator")
+
+async def _is_group_speaker(bot, event, user_id, cursor):
+    """True if user_id is in the event's speakers group. Lookup errors count as "no".
+
+    A synced mirror answers "yes" on its own; "no" is confirmed with the (cached)
+    membership check, since the mirror misses joins once the bot loses its admin rights."""
+    if not event['speakers_group_id']:
+        return False
+    if _speakers_mirror_synced(event):
+        cursor.execute("SELECT 1 FROM speakers WHERE event_id = ? AND user_id = ?", (event['id'], user_id))
+        if cursor.fetchone() is not None:
+            return True
+    return await speaker_cache.is_member(bot, _get_group_id(event['speakers_group_id']), user_id)
+
+# Updates processed at once. Updates from the same user still run one at a time.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+class LockManager:
+    """asyncio locks keyed by user and by event.
+
+    Per-user locks keep one person's updates in order; per-event locks guard the
+    capacity check-then-write paths (invites, accepts, declines, guest bumps).
+    Locks are not reentrant: never call invite_next while holding an event lock.
+    Entries disappear once no coroutine holds or waits on them."""
+
+    def __init__(self):
+        self._users = weakref.WeakValueDictionary()
+        self._events = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def _get(table, key):
+        lock = table.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            table[key] = lock
+        return lock
+
+    def user(self, user_id):
+        return self._get(self._users, user_id)
+
+    def event(self, event_id):
+        return self._get(self._events, event_id)
+
+locks = LockManager()
+
+class PerUserUpdateProcessor(SimpleUpdateProcessor):
+    """Runs updates concurrently, but serializes those coming from the same user.
+
+    The user lock is taken before one of the max_concurrent_updates slots, so a
+    user's queued updates wait without a slot and cannot starve everyone else.
+    PTB's own semaphore (taken in the final process_update, before the user lock)
+    is therefore given a limit that never binds; the slots are our own."""
+
+    __slots__ = ("_slots", "_active")
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._active = 0
+
+    @property
+    def current_concurrent_updates(self):
+        return self._active
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await self._run(coroutine)
+            return
+        async with locks.user(user.id):
+            await self._run(coroutine)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         token = context.args[0]
@@ -140,27 +384,49 @@ async def ensure_private(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 def reoder_waitlist(event_id, cursor):
-    """Compact waitlist priorities. Pair members keep a shared slot priority."""
+    """Compact waitlist priorities. Pair members keep a shared slot priority.
+
+    One set-based UPDATE: each row is ranked by (priority, id), a pair collapses onto
+    whichever member ranks first, and units get dense slots from 1. Only rows whose
+    slot actually changes (those behind a removed unit) are written."""
     cursor.execute(
-        "SELECT id, partner_reg_id FROM registrations WHERE event_id = ? AND status = 'WAITLIST' "
-        "ORDER BY priority ASC, id ASC",
+        """
+        WITH w AS (
+            SELECT id, partner_reg_id, ROW_NUMBER() OVER (ORDER BY priority ASC, id ASC) AS ord
+            FROM registrations
+            WHERE event_id = ? AND status = 'WAITLIST'
+        ),
+        slots AS (
+            SELECT w.id, DENSE_RANK() OVER (ORDER BY MIN(w.ord, COALESCE(p.ord, w.ord))) AS slot
+            FROM w LEFT JOIN w AS p ON p.id = w.partner_reg_id
+        )
+        UPDATE registrations SET priority = slots.slot
+        FROM slots
+        WHERE registrations.id = slots.id AND registrations.priority IS NOT slots.slot
+        """,
         (event_id,)
     )
-    rows = cursor.fetchall()
-    seen = set()
-    slot = 1
-    for r in rows:
-        if r['id'] in seen:
-            continue
-        cursor.execute("UPDATE registrations SET priority = ? WHERE id = ?", (slot, r['id']))
-        seen.add(r['id'])
-        if r['partner_reg_id']:
-            cursor.execute(
-                "UPDATE registrations SET priority = ? WHERE id = ? AND status = 'WAITLIST'",
-                (slot, r['partner_reg_id'])
-            )
-            seen.add(r['partner_reg_id'])
-        slot += 1
+
+
+def _waitlist_positions(event_id, cursor):
+    """Map registration id -> 1-based waitlist position for the whole waitlist in one
+    ordered pass. Position counts people strictly ahead, so pair members share one."""
+    cursor.execute(
+        "SELECT id, RANK() OVER (ORDER BY priority) AS pos FROM registrations "
+        "WHERE event_id = ? AND status = 'WAITLIST'",
+        (event_id,)
+    )
+    return {row['id']: row['pos'] for row in cursor.fetchall()}
+
+
+def _waitlist_position(event_id, priority, cursor):
+    """1-based waitlist position for a single priority. Served as a range count on
+    idx_registrations_event_status, which covers (event_id, status, priority)."""
+    cursor.execute(
+        "SELECT COUNT(*) as pos FROM registrations WHERE event_id = ? AND status = 'WAITLIST' AND priority < ?",
+        (event_id, priority)
+    )
+    return cursor.fetchone()['pos'] + 1
 
 
 def _next_waitlist_unit(event_id, cursor, seats_available):
@@ -189,34 +455,140 @@ def _next_waitlist_unit(event_id, cursor, seats_available):
         return [head]
     return None
 
-async def _unlink_partner(reg, cursor, bot):
-    """If reg has a partner, clear the link on both sides and DM the partner.
-    Used when reg is unregistering — we never auto-vacate the partner, just notify."""
+def _unlink_partner(reg, cursor):
+    """If reg has a partner, clear the link on both sides and return the partner row.
+    Used when reg is unregistering — we never auto-vacate the partner, just notify
+    them with _notify_unlinked_partner once the transaction is committed."""
     partner_reg_id = reg['partner_reg_id'] if 'partner_reg_id' in reg.keys() else None
     if not partner_reg_id:
-        return
+        return None
     cursor.execute("SELECT * FROM registrations WHERE id = ?", (partner_reg_id,))
     partner = cursor.fetchone()
     cursor.execute("UPDATE registrations SET partner_reg_id = NULL WHERE id = ?", (reg['id'],))
     if not partner:
-        return
+        return None
     cursor.execute("UPDATE registrations SET partner_reg_id = NULL WHERE id = ?", (partner['id'],))
-    if partner['user_id']:
-        leaver = reg['username'] or reg['first_name'] or '—'
+    return partner
+
+async def _notify_unlinked_partner(reg, partner, bot):
+    if not partner or not partner['user_id']:
+        return
+    leaver = reg['username'] or reg['first_name'] or '—'
+    try:
+        await bot.send_message(partner['user_id'], messages.PAIR_PARTNER_UNREGISTERED.format(partner=leaver))
+    except Exception as e:
+        logging.error(f"Failed to notify pair partner of unregister: {e}")
+
+
+# Write-behind action log: entries are flushed in one transaction every
+# LOG_FLUSH_INTERVAL_SECONDS or once LOG_FLUSH_MAX_ENTRIES are queued.
+LOG_FLUSH_INTERVAL_SECONDS = 0.2
+LOG_FLUSH_MAX_ENTRIES = 100
+# Beyond this (e.g. the DB is unwritable for a long time) the oldest entries are dropped.
+LOG_QUEUE_LIMIT = 10000
+# Event lifecycle changes are written out immediately.
+CRITICAL_ACTIONS = {'CREATE_EVENT', 'OPEN_EVENT', 'CLOSE_REGISTRATION', 'RESET_EVENT', 'LOTTERY_COMPLETE'}
+# Local hour of the nightly action_logs archival (see log_archive.py)
+COMPACT_LOGS_HOUR = int(os.getenv("COMPACT_LOGS_HOUR", "4"))
+
+LOG_COLUMNS = ('event_id', 'user_id', 'username', 'first_name', 'action', 'details')
+# Typed fields for analytics (see analytics.py); appended after LOG_COLUMNS in every row
+STRUCTURED_LOG_COLUMNS = ('reg_id', 'old_status', 'new_status', 'count', 'payload')
+
+def _insert_action_logs(cursor, columns, rows):
+    """Insert rows of (*columns, *STRUCTURED_LOG_COLUMNS) into action_logs."""
+    cols = columns + STRUCTURED_LOG_COLUMNS
+    cursor.executemany(
+        f"INSERT INTO action_logs ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+        rows
+    )
+
+class ActionLogWriter:
+    """Batches action_logs inserts off the handlers' hot path.
+
+    Until start() is called (from post_init) every entry is written synchronously,
+    as before. stop() flushes whatever is still queued."""
+
+    def __init__(self):
+        self._queue = []
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
         try:
-            await bot.send_message(partner['user_id'], messages.PAIR_PARTNER_UNREGISTERED.format(partner=leaver))
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.flush()
+
+    def enqueue(self, row, critical=False):
+        self._queue.append(row)
+        if len(self._queue) > LOG_QUEUE_LIMIT:
+            dropped = len(self._queue) - LOG_QUEUE_LIMIT
+            del self._queue[:dropped]
+            logging.error(f"Action log queue full, dropped {dropped} oldest entries")
+        if critical:
+            self.flush()
+        elif len(self._queue) >= LOG_FLUSH_MAX_ENTRIES:
+            self._wakeup.set()
+
+    def flush(self):
+        if not self._queue:
+            return
+        rows, self._queue = self._queue, []
+        try:
+            conn = get_db()
+            try:
+                _insert_action_logs(conn.cursor(), LOG_COLUMNS + ('timestamp',), rows)
+                conn.commit()
+            finally:
+                conn.close()
         except Exception as e:
-            logging.error(f"Failed to notify pair partner of unregister: {e}")
-
+            logging.error(f"Failed to flush {len(rows)} action log entries, will retry: {e}")
+            self._queue[:0] = rows
 
-def log_action(event_id, user_id, username, first_name, action, details=""):
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LOG_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.flush()
+
+action_log_writer = ActionLogWriter()
+
+def log_action(event_id, user_id, username, first_name, action, details="",
+               reg_id=None, old_status=None, new_status=None, count=None, payload=None):
+    """Record an action. details is free text for people; reg_id, the status
+    transition, count and payload (a dict, stored as JSON) are for queries."""
+    if payload is not None:
+        payload = json.dumps(payload, ensure_ascii=False)
+    structured = (reg_id, old_status, new_status, count, payload)
+    if action_log_writer.running:
+        # Stamp now, not at flush time, so the log keeps the real order of events
+        timestamp = datetime.now(ZoneInfo("UTC")).strftime("%Y-%m-%d %H:%M:%S")
+        action_log_writer.enqueue(
+            (event_id, user_id, username, first_name, action, details, timestamp) + structured,
+            critical=action in CRITICAL_ACTIONS
+        )
+        return
     try:
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO action_logs (event_id, user_id, username, first_name, action, details) VALUES (?, ?, ?, ?, ?, ?)",
-            (event_id, user_id, username, first_name, action, details)
-        )
+        _insert_action_logs(cursor, LOG_COLUMNS, [(event_id, user_id, username, first_name, action, details) + structured])
         conn.commit()
         conn.close()
     except Exception as e:
@@ -307,38 +679,46 @@ async def create_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
         event_id = next_test_id
 
     conn.commit()
+    event_cache.invalidate()
     log_action(event_id, update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'CREATE_EVENT', f'group={actual_group_id}{" (TEST)" if is_test else ""}')
     conn.close()
 
     await update.message.reply_text(f"Событие создано! (ID: {event_id}) {'[ТЕСТ]' if is_test else ''}")
     
-    # Run userbot script to import speakers
-    # We do this asynchronously so we don't block the bot
+    # Import speakers with the userbot on its own thread, so the bot's loop keeps serving updates
     await update.message.reply_text("Fetching speakers from group... This might take a few seconds.")
+    loop = asyncio.get_running_loop()
+
+    def report_progress(count):
+        # Called on the importer thread
+        asyncio.run_coroutine_threadsafe(update.message.reply_text(f"... {count} speakers imported"), loop)
+
+    # Without admin rights the bot gets no join/leave updates, so the imported list
+    # must not be trusted as complete later on
+    mark_synced = await _bot_is_group_admin(context.bot, actual_group_id)
+    if not mark_synced:
+        logging.warning(f"Bot is not an admin of speakers group {actual_group_id}; speakers will be checked with Telegram")
+        await update.message.reply_text("⚠️ The bot is not an admin of the speakers group, so it won't see people joining or leaving it. Speakers will be checked with Telegram instead; make the bot an admin and run the import again to speed this up.")
+
     try:
-        import asyncio
-        import subprocess
-        # Execute it via CLI because Telethon runs its own asyncio loop 
-        # which can conflict with the main bot application loop if run in the same process
-        process = await asyncio.create_subprocess_exec(
-            'python', 'import_speakers.py', str(actual_group_id),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
-            count = len(stdout.decode().splitlines()) # Estimate count or parse output
-            log_action(event_id, None, "System", None, "SPEAKERS_IMPORTED", f"Result: {stdout.decode().strip()}")
-            logging.info(f"Imported speakers: {stdout.decode()}")
-            await update.message.reply_text(f"✅ Speakers automatically imported!")
-        else:
-            log_action(event_id, None, "System", None, "SPEAKERS_IMPORT_FAIL", f"Error: {stderr.decode().strip()}")
-            logging.error(f"Error importing speakers: {stderr.decode()}")
-            await update.message.reply_text("⚠️ There was an issue importing speakers. Are you sure you logged in to the userbot via SSH?")
+        result = await speaker_importer.run(actual_group_id, event_id, progress=report_progress, mark_synced=mark_synced)
+    except ImportNotConfigured as e:
+        log_action(event_id, None, "System", None, "SPEAKERS_IMPORT_FAIL", f"Error: {e}")
+        logging.error(f"Speaker import not available: {e}")
+        await update.message.reply_text("⚠️ There was an issue importing speakers. Are you sure you logged in to the userbot via SSH?")
+        return
     except Exception as e:
-        logging.error(f"Exception running import_speakers.py: {e}")
-        await update.message.reply_text("⚠️ Could not run the speaker import script.")
+        log_action(event_id, None, "System", None, "SPEAKERS_IMPORT_FAIL", f"Error: {e}")
+        logging.error(f"Error importing speakers: {e}")
+        await update.message.reply_text("⚠️ Could not import speakers from the group.")
+        return
+
+    # speakers_synced_at was set by the importer
+    event_cache.invalidate()
+    log_action(event_id, None, "System", None, "SPEAKERS_IMPORTED", f"Result: {result.imported} speakers, {result.skipped_bots} bots skipped",
+               count=result.imported, payload={'skipped_bots': result.skipped_bots})
+    logging.info(f"Imported {result.imported} speakers for event {event_id}")
+    await update.message.reply_text(f"✅ Speakers automatically imported! ({result.imported})")
 
 async def open_event_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context):
@@ -379,6 +759,7 @@ async def open_event_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         (end_time, places, timeout_hours, hours, event_start_time, event['id'])
     )
     conn.commit()
+    event_cache.invalidate()
     log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'OPEN_EVENT', f'places={places}, end_time={end_time}')
     conn.close()
 
@@ -456,38 +837,38 @@ async def send_invites(update: Update, context: ContextTypes.DEFAULT_TYPE):
     event_id = event['id']
     total_places = event['total_places']
 
+    async def report_progress(done, total, eta):
+        await throttle(update.effective_chat.id)
+        await update.message.reply_text(messages.BROADCAST_PROGRESS.format(done=done, total=total, eta=eta))
+
     # Notify winners
     cursor.execute("SELECT * FROM registrations WHERE event_id = ? AND status = 'ACCEPTED' AND notified_at IS NULL", (event_id,))
-    winners = cursor.fetchall()
-    winner_failures = []
-    for reg in winners:
-        try:
-            if reg['user_id']:
-                await context.bot.send_message(reg['user_id'], messages.LOTTERY_WINNER)
-                cursor.execute("UPDATE registrations SET notified_at = ? WHERE id = ?", (get_now(), reg['id']))
-        except Exception as e:
-            logging.error(f"Failed to notify winner {reg['user_id']}: {e}")
-            winner_failures.append((reg['username'], reg['user_id'], str(e)))
-    await _report_send_failures(winner_failures, "победители лотереи")
+    winners = [
+        Recipient(chat_id=reg['user_id'], text=messages.LOTTERY_WINNER, username=reg['username'], reg_id=reg['id'])
+        for reg in cursor.fetchall()
+    ]
+    result = await send_bulk(context.bot, conn, f"winners:{event_id}", winners, progress=report_progress, clock=get_now)
+    await _report_send_failures(result.failures, "победители лотереи")
 
     # Notify waitlist
     cursor.execute("SELECT * FROM registrations WHERE event_id = ? AND status = 'WAITLIST' AND notified_at IS NULL", (event_id,))
     losers = cursor.fetchall()
-    waitlist_failures = []
-    for reg in losers:
-        try:
-            if reg['user_id']:
-                cursor.execute("SELECT COUNT(*) as pos FROM registrations WHERE event_id = ? AND status = 'WAITLIST' AND priority < ?", (event_id, reg['priority']))
-                pos = cursor.fetchone()['pos']
-                await context.bot.send_message(reg['user_id'], messages.WAITLIST_NOTIFICATION.format(position=pos + 1))
-                cursor.execute("UPDATE registrations SET notified_at = ? WHERE id = ?", (get_now(), reg['id']))
-        except Exception as e:
-            logging.error(f"Failed to notify waitlist user {reg['user_id']}: {e}")
-            waitlist_failures.append((reg['username'], reg['user_id'], str(e)))
-    await _report_send_failures(waitlist_failures, "вейтлист")
+    positions = _waitlist_positions(event_id, cursor)
+    waitlisted = [
+        Recipient(
+            chat_id=reg['user_id'],
+            text=messages.WAITLIST_NOTIFICATION.format(position=positions[reg['id']]),
+            username=reg['username'],
+            reg_id=reg['id'],
+        )
+        for reg in losers
+    ]
+    result = await send_bulk(context.bot, conn, f"waitlist:{event_id}", waitlisted, progress=report_progress, clock=get_now)
+    await _report_send_failures(result.failures, "вейтлист")
 
     cursor.execute("UPDATE events SET status = 'CLOSED' WHERE id = ?", (event_id,))
     conn.commit()
+    event_cache.update(event_id, status='CLOSED')
 
     # After notifications, check if there are still free spots (e.g. if someone unregistered during review)
     cursor.execute("SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status IN ('ACCEPTED', 'INVITED')", (event_id,))
@@ -517,8 +898,7 @@ async def reset_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
     
     if not event:
         await update.message.reply_text(messages.NO_EVENT_FOUND)
@@ -538,11 +918,113 @@ async def reset_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cursor.execute("UPDATE events SET status = 'CANCELLED', end_time = NULL WHERE id = ?", (event_id,))
     
     conn.commit()
+    event_cache.update(event_id, status='CANCELLED', end_time=None)
     log_action(event_id, update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'RESET_EVENT', '')
     conn.close()
     
     await update.message.reply_text(messages.RESET_SUCCESS)
 
+async def compact_logs(retention_days=None):
+    """Archive the action_logs of finished events (see log_archive) off the event loop."""
+    if retention_days is None:
+        retention_days = log_archive.RETENTION_DAYS
+    conn = get_db()
+    try:
+        result = await asyncio.to_thread(log_archive.compact, conn, get_now(), retention_days)
+    finally:
+        conn.close()
+    if result.event_ids:
+        logging.info(f"Archived {result.entries} action log entries of events {result.event_ids}")
+        log_action(None, None, "System", None, 'COMPACT_LOGS', f"Archived {result.entries} entries",
+                   count=result.entries, payload={'event_ids': result.event_ids})
+    return result
+
+async def compact_logs_job():
+    try:
+        await compact_logs()
+    except Exception as e:
+        logging.error(f"Nightly log compaction failed: {e}")
+
+async def compact_logs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context):
+        await update.message.reply_text(messages.ONLY_ADMIN_COMPACT)
+        return
+
+    retention_days = log_archive.RETENTION_DAYS
+    if context.args:
+        try:
+            retention_days = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text(messages.USAGE_COMPACT)
+            return
+        if retention_days < 0:
+            await update.message.reply_text(messages.USAGE_COMPACT)
+            return
+
+    try:
+        result = await compact_logs(retention_days)
+    except Exception as e:
+        logging.error(f"Log compaction failed: {e}")
+        await update.message.reply_text(messages.COMPACT_FAILED.format(error=e))
+        return
+
+    if not result.event_ids:
+        await update.message.reply_text(messages.COMPACT_NOTHING.format(days=retention_days))
+    else:
+        await update.message.reply_text(messages.COMPACT_DONE.format(entries=result.entries, events=len(result.event_ids)))
+
+def _lottery_audit(cursor, event):
+    """The event's lottery audit record: from the events row, else from its
+    LOTTERY_COMPLETE log entry (for draws made before events kept it), live or archived."""
+    if 'lottery_audit' in event.keys() and event['lottery_audit']:
+        return json.loads(event['lottery_audit'])
+    entries = analytics.event_timeline(cursor, event['id'], actions=['LOTTERY_COMPLETE'], limit=1)
+    if not entries:
+        entries = log_archive.archived_entries(event['id'], ['LOTTERY_COMPLETE'], limit=1)
+    return (entries[0].get('payload') or {}).get('draw') if entries else None
+
+async def replay_lottery_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Re-derive an event's lottery from its recorded seed and pool and compare with the recorded outcome."""
+    if not await is_admin(update, context):
+        await update.message.reply_text(messages.ONLY_ADMIN_REPLAY_LOTTERY)
+        return
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if context.args:
+            try:
+                event_id = int(context.args[0])
+            except ValueError:
+                await update.message.reply_text(messages.USAGE_REPLAY_LOTTERY)
+                return
+            cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
+            event = cursor.fetchone()
+        else:
+            event = event_cache.get(cursor)
+            event_id = event['id'] if event else None
+        audit = _lottery_audit(cursor, event) if event else None
+    finally:
+        conn.close()
+
+    if not audit:
+        await update.message.reply_text(messages.REPLAY_LOTTERY_NO_RECORD.format(event_id=event_id))
+        return
+
+    result, matches = lottery.replay(audit)
+    stored_seed = event['lottery_seed'] if 'lottery_seed' in event.keys() else None
+    if stored_seed is not None and stored_seed != audit['seed']:
+        matches = False
+    log_action(event_id, update.effective_user.id, update.effective_user.username, update.effective_user.first_name,
+               'REPLAY_LOTTERY', f"Seed: {audit['seed']}, {'match' if matches else 'MISMATCH'}",
+               payload={'seed': audit['seed'], 'matches': matches})
+    if matches:
+        await update.message.reply_text(messages.REPLAY_LOTTERY_MATCH.format(
+            event_id=event_id, seed=audit['seed'], winners=len(result.winners),
+            waitlist=sum(len(unit) for unit in result.loser_units)))
+    else:
+        await update.message.reply_text(messages.REPLAY_LOTTERY_MISMATCH.format(event_id=event_id, seed=audit['seed']))
+
 async def _report_send_failures(failures, label):
     """Send a summary of failed message deliveries to all admins."""
     if not failures or not ADMIN_IDS:
@@ -552,11 +1034,23 @@ async def _report_send_failures(failures, label):
         name = f"@{username}" if username else f"id:{user_id}"
         lines.append(f"• {name} — {err}")
     text = "\n".join(lines)
+    conn = get_db()
+    result = await send_bulk(
+        application.bot, conn, "admin_report", [Recipient(chat_id=admin_id, text=text) for admin_id in ADMIN_IDS],
+        dedupe=False
+    )
+    conn.close()
+    # Not reported again: admins are the ones we failed to reach.
+    for _, admin_id, err in result.failures:
+        logging.error(f"Failed to notify admin {admin_id} of send failures: {err}")
+
+async def _report_progress_to_admins(done, total, eta):
     for admin_id in ADMIN_IDS:
         try:
-            await application.bot.send_message(admin_id, text)
+            await throttle(admin_id)
+            await application.bot.send_message(admin_id, messages.BROADCAST_PROGRESS.format(done=done, total=total, eta=eta))
         except Exception as e:
-            logging.error(f"Failed to notify admin {admin_id} of send failures: {e}")
+            logging.error(f"Failed to send broadcast progress to admin {admin_id}: {e}")
 
 
 async def send_reminder_job(event_id, days_left):
@@ -565,18 +1059,16 @@ async def send_reminder_job(event_id, days_left):
     cursor = conn.cursor()
     cursor.execute("SELECT user_id, username FROM registrations WHERE event_id = ? AND status IN ('ACCEPTED', 'INVITED') AND user_id IS NOT NULL", (event_id,))
     users = cursor.fetchall()
-    conn.close()
     
     msg = messages.REMINDER_5_DAYS if days_left == 5 else messages.REMINDER_2_DAYS
 
-    failures = []
-    for row in users:
-        try:
-            await application.bot.send_message(row['user_id'], msg)
-        except Exception as e:
-            logging.error(f"Failed to send {days_left}-day reminder to user {row['user_id']}: {e}")
-            failures.append((row['username'], row['user_id'], str(e)))
-    await _report_send_failures(failures, f"напоминание за {days_left} дн.")
+    recipients = [Recipient(chat_id=row['user_id'], text=msg, username=row['username']) for row in users]
+    result = await send_bulk(
+        application.bot, conn, f"reminder_{days_left}:{event_id}", recipients,
+        progress=_report_progress_to_admins, clock=get_now
+    )
+    conn.close()
+    await _report_send_failures(result.failures, f"напоминание за {days_left} дн.")
 
 def schedule_reminders(event_id, event_start_time):
     if not event_start_time:
@@ -615,20 +1107,120 @@ def schedule_reminders(event_id, event_start_time):
         )
         logging.info(f"Scheduled 2-day reminder for event {event_id} at {reminder_2_time}")
 
+async def _resolve_speaker_reg_ids(event_id, speakers_group_id, regs, cursor, bot, mirror_synced=False):
+    """Return the ids of registrations in regs that belong to speakers.
+
+    The manual speakers list is loaded with a single query. If it is a synced mirror
+    of the group it is the whole answer; otherwise everyone not on it is checked
+    against the speakers group with concurrent get_chat_member calls, at most
+    SPEAKER_CHECK_CONCURRENCY in flight at a time."""
+    if mirror_synced:
+        cursor.execute("SELECT username, user_id FROM speakers WHERE event_id = ?", (event_id,))
+    else:
+        cursor.execute("SELECT username FROM speakers WHERE event_id = ?", (event_id,))
+    rows = cursor.fetchall()
+    speaker_usernames = {row['username'] for row in rows if row['username']}
+    speaker_reg_ids = {
+        reg['id'] for reg in regs
+        if reg['username'] and reg['username'].lower() in speaker_usernames
+    }
+    if mirror_synced:
+        speaker_user_ids = {row['user_id'] for row in rows if row['user_id']}
+        speaker_reg_ids.update(reg['id'] for reg in regs if reg['user_id'] in speaker_user_ids)
+        return speaker_reg_ids
+    if not speakers_group_id:
+        return speaker_reg_ids
+
+    group_id = _get_group_id(speakers_group_id)
+    semaphore = asyncio.Semaphore(SPEAKER_CHECK_CONCURRENCY)
+
+    async def check(reg):
+        async with semaphore:
+            is_member = await speaker_cache.is_member(bot, group_id, reg['user_id'])
+        return reg['id'] if is_member else None
+
+    pending = [reg for reg in regs if reg['id'] not in speaker_reg_ids]
+    results = await asyncio.gather(*(check(reg) for reg in pending))
+    speaker_reg_ids.update(reg_id for reg_id in results if reg_id is not None)
+    return speaker_reg_ids
+
+def _write_lottery_result(cursor, event_id, result):
+    """Apply a lottery draw over registration ids: winners ACCEPTED, losers WAITLIST in draw order.
+
+    The draw goes into a temp table and is applied with one UPDATE ... FROM,
+    then read back: returns True only if every drawn registration now has its
+    drawn status and priority. Existing waitlist entries (e.g. earlier
+    expirations) move behind the new ones. Commit is left to the caller, so a
+    mismatch can be discarded with the rest of the transaction."""
+    rows = [(reg_id, 'ACCEPTED', None) for reg_id in result.winners]
+    rows += [(reg_id, 'WAITLIST', position) for position, unit in enumerate(result.loser_units) for reg_id in unit]
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS lottery_result (reg_id INTEGER PRIMARY KEY, status TEXT NOT NULL, priority INTEGER)"
+    )
+    cursor.execute("DELETE FROM temp.lottery_result")
+    cursor.executemany("INSERT INTO temp.lottery_result (reg_id, status, priority) VALUES (?, ?, ?)", rows)
+    if result.loser_units:
+        cursor.execute(
+            "UPDATE registrations SET priority = priority + ? WHERE event_id = ? AND status = 'WAITLIST'",
+            (len(result.loser_units), event_id)
+        )
+    cursor.execute("""
+        UPDATE registrations
+        SET status = r.status, priority = COALESCE(r.priority, registrations.priority)
+        FROM temp.lottery_result r
+        WHERE registrations.id = r.reg_id AND registrations.event_id = ?
+    """, (event_id,))
+    cursor.execute("""
+        SELECT COUNT(*) FROM temp.lottery_result r
+        JOIN registrations g ON g.id = r.reg_id
+        WHERE g.event_id = ? AND g.status = r.status AND (r.priority IS NULL OR g.priority = r.priority)
+    """, (event_id,))
+    matched = cursor.fetchone()[0]
+    cursor.execute("DELETE FROM temp.lottery_result")
+    return matched == len(rows)
+
+# After a failed lottery write-out registration reopens and closes again this much later
+LOTTERY_RETRY_MINUTES = 10
+
 async def close_registration_job(event_id, chat_id):
     logging.info(f"Closing registration for event {event_id}")
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT total_places, speakers_group_id FROM events WHERE id = ?", (event_id,))
+    cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
     event = cursor.fetchone()
     if not event:
         conn.close()
         return
-    
-    total_places = event['total_places']
+
+    # Stop new registrations right away, in a transaction of its own: nothing may
+    # stay uncommitted across the speaker checks below, which can take a while.
     cursor.execute("UPDATE events SET status = 'REVIEW' WHERE id = ?", (event_id,))
-    log_action(event_id, None, None, None, 'CLOSE_REGISTRATION', 'Lottery started, awaiting review')
+    conn.commit()
+    event_cache.update(event_id, status='REVIEW')
+
+    cursor.execute(
+        "SELECT * FROM registrations WHERE event_id = ? AND status = 'REGISTERED'",
+        (event_id,)
+    )
+    regs = [dict(row) for row in cursor.fetchall()]
     
+    if not regs:
+        conn.close()
+        log_action(event_id, None, None, None, 'CLOSE_REGISTRATION', 'Lottery started, awaiting review')
+        await application.bot.send_message(chat_id, messages.REGISTRATION_CLOSED_NO_REG)
+        return
+
+    # Filter out speakers from the lottery pool to prevent double-dipping
+    speaker_reg_ids = await _resolve_speaker_reg_ids(
+        event_id, event['speakers_group_id'], regs, cursor, application.bot,
+        mirror_synced=_speakers_mirror_synced(event)
+    )
+
+    # Re-read the counts and the pool: people may have unregistered or been
+    # invited as guests while the speakers were checked. From here to the
+    # commit nothing awaits, so the write transaction stays short.
+    total_places = event['total_places']
+
     # Count already accepted (e.g. guests)
     cursor.execute("SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status = 'ACCEPTED'", (event_id,))
     accepted_count = cursor.fetchone()['count']
@@ -648,129 +1240,92 @@ async def close_registration_job(event_id, chat_id):
         "SELECT * FROM registrations WHERE event_id = ? AND status = 'REGISTERED'",
         (event_id,)
     )
-    regs = [dict(row) for row in cursor.fetchall()]
-    
-    if not regs:
-        await application.bot.send_message(chat_id, messages.REGISTRATION_CLOSED_NO_REG)
-        conn.commit()
-        conn.close()
-        return
-
-    # Filter out speakers from the lottery pool to prevent double-dipping
     valid_regs = []
-    for reg in regs:
-        is_speaker = False
-        # Check manual list
-        if reg['username']:
-            cursor.execute("SELECT id FROM speakers WHERE event_id = ? AND username = ?", (event_id, reg['username'].lower()))
-            if cursor.fetchone():
-                is_speaker = True
-            
-        # Check group membership
-        if not is_speaker and event['speakers_group_id']:
-             try:
-                 member = await application.bot.get_chat_member(_get_group_id(event['speakers_group_id']), reg['user_id'])
-                 if member.status in ["member", "administrator", "creator"]:
-                     is_speaker = True
-             except Exception:
-                 pass
-        
-        if is_speaker:
-             logging.info(f"User {reg['user_id']} is a speaker, skipping lottery.")
-             # We mark them as accepted (or just leave them as registered but ignored? 
-             # If we leave them as REGISTERED, they might get confused. 
-             # Let's just ignore them for the lottery. They are speakers.)
+    for reg in cursor.fetchall():
+        if reg['id'] in speaker_reg_ids:
+            logging.info(f"User {reg['user_id']} is a speaker, skipping lottery.")
         else:
-             valid_regs.append(reg)
+            valid_regs.append(dict(reg))
     
     regs = valid_regs
-    N = len(regs)
     M = places_available
 
-    # Group into pairs (atomic units) and singles. A pair only counts if both members
-    # are in the lottery pool (e.g. neither got filtered as a speaker).
+    # Group into pool units: pairs (atomic) and singles, by registration id. A pair
+    # only counts if both members are in the lottery pool (e.g. neither got
+    # filtered as a speaker).
     valid_ids = {r['id'] for r in regs}
-    by_id = {r['id']: r for r in regs}
     processed = set()
-    pairs = []
-    singles = []
+    units = []
     for reg in regs:
         if reg['id'] in processed:
             continue
         processed.add(reg['id'])
         partner_id = reg['partner_reg_id']
         if partner_id and partner_id in valid_ids:
-            partner = by_id[partner_id]
             processed.add(partner_id)
-            pairs.append((reg, partner))
+            units.append((reg['id'], partner_id))
         else:
-            singles.append(reg)
-
-    # Stage 1: each pair flips an independent (M/N)-biased coin.
-    # Re-roll if we accidentally picked more pair seats than seats available.
-    # See TODO.md for the fairness derivation. With realistic configs (small P, generous M)
-    # the rejection branch almost never fires.
-    pair_winners = []
-    if N > 0 and M > 0:
-        p_win = M / N
-        attempts = 0
-        while True:
-            attempts += 1
-            pair_winners = [pair for pair in pairs if random.random() < p_win]
-            if 2 * len(pair_winners) <= M:
-                break
-            if attempts >= 1000:
-                # Pathological config (e.g. lots of pairs, few seats). Fall back to
-                # uniformly downsampling pair winners to fit.
-                random.shuffle(pair_winners)
-                pair_winners = pair_winners[: M // 2]
-                break
-
-    # Stage 2: fill remaining seats with random singles.
-    seats_left = M - 2 * len(pair_winners)
-    seats_left = max(0, seats_left)
-    single_winners = random.sample(singles, min(seats_left, len(singles))) if singles else []
-
-    winner_regs = []
-    for a, b in pair_winners:
-        winner_regs.append(a)
-        winner_regs.append(b)
-    winner_regs.extend(single_winners)
-
-    pair_winners_set = {id(p) for p in pair_winners}
-    loser_pairs = [p for p in pairs if id(p) not in pair_winners_set]
-    single_winner_ids = {s['id'] for s in single_winners}
-    loser_singles = [s for s in singles if s['id'] not in single_winner_ids]
-
-    # Stage 3: shuffle loser units (pair = one slot, both members share priority).
-    loser_units = [list(p) for p in loser_pairs] + [[s] for s in loser_singles]
-    random.shuffle(loser_units)
-
-    for reg in winner_regs:
-        cursor.execute("UPDATE registrations SET status = 'ACCEPTED' WHERE id = ?", (reg['id'],))
-
-    if loser_units:
-        cursor.execute(
-            "UPDATE registrations SET priority = priority + ? WHERE event_id = ? AND status = 'WAITLIST'",
-            (len(loser_units), event_id)
+            units.append((reg['id'],))
+
+    seed = lottery.new_seed()
+    started = time.perf_counter()
+    result = lottery.run(units, M, seed)
+    draw_ms = (time.perf_counter() - started) * 1000
+    if result.truncated:
+        logging.warning(f"Lottery for event {event_id} fell back to truncating pair winners after {result.attempts} attempts")
+
+    # The seed, the audit record and the results land in one transaction
+    audit = lottery.record(units, M, seed, result)
+    started = time.perf_counter()
+    if 'lottery_seed' in event.keys():
+        cursor.execute("UPDATE events SET lottery_seed = ? WHERE id = ?", (seed, event_id))
+    if 'lottery_audit' in event.keys():
+        cursor.execute("UPDATE events SET lottery_audit = ? WHERE id = ?", (json.dumps(audit), event_id))
+    if not _write_lottery_result(cursor, event_id, result):
+        conn.close()  # rolls back the draw
+        # Reopen registration, as it was before the close
+        conn = get_db()
+        conn.cursor().execute("UPDATE events SET status = ? WHERE id = ?", (event['status'], event_id))
+        conn.commit()
+        conn.close()
+        event_cache.update(event_id, status=event['status'])
+        # This run consumed the close_ job: schedule another, or registration would stay open
+        retry_at = get_now() + timedelta(minutes=LOTTERY_RETRY_MINUTES)
+        scheduler.add_job(
+            close_registration_job,
+            'date',
+            run_date=retry_at,
+            args=[event_id, chat_id],
+            id=f"close_{event_id}",
+            replace_existing=True
         )
-    for i, unit in enumerate(loser_units):
-        for reg in unit:
-            cursor.execute(
-                "UPDATE registrations SET status = 'WAITLIST', priority = ? WHERE id = ?",
-                (i, reg['id'])
-            )
-
+        logging.error(f"Lottery for event {event_id}: stored result does not match the draw, rolled back; retrying at {retry_at}")
+        log_action(event_id, None, "System", None, 'LOTTERY_WRITE_FAILED', f"Seed: {seed}, retry at {retry_at}")
+        retry_local = retry_at.astimezone(ZoneInfo("Europe/Zurich"))
+        await application.bot.send_message(chat_id, messages.LOTTERY_WRITE_FAILED.format(retry_time=retry_local.strftime('%H:%M')))
+        return
     conn.commit()
+    write_ms = (time.perf_counter() - started) * 1000
     conn.close()
 
-    waitlist_people = sum(len(u) for u in loser_units)
+    # Log after commit to avoid DB lock
+    log_action(event_id, None, None, None, 'CLOSE_REGISTRATION', 'Lottery started, awaiting review')
+    winners = len(result.winners)
+    waitlist_people = sum(len(u) for u in result.loser_units)
     log_action(
         event_id, None, "System", None, "LOTTERY_COMPLETE",
-        f"Winners: {len(winner_regs)} ({len(pair_winners)} pairs + {len(single_winners)} singles), "
-        f"Waitlist: {waitlist_people} ({len(loser_pairs)} pairs + {len(loser_singles)} singles)"
+        f"Winners: {winners} ({len(result.pair_winners)} pairs + {len(result.single_winners)} singles), "
+        f"Waitlist: {waitlist_people} ({len(result.loser_pairs)} pairs + {len(result.loser_singles)} singles), "
+        f"Seed: {seed}, Draw: {draw_ms:.1f} ms, Write: {write_ms:.1f} ms",
+        count=winners,
+        payload={
+            'winners': winners, 'winner_pairs': len(result.pair_winners), 'winner_singles': len(result.single_winners),
+            'waitlist': waitlist_people, 'waitlist_pairs': len(result.loser_pairs), 'waitlist_singles': len(result.loser_singles),
+            'draw_ms': round(draw_ms, 3), 'write_ms': round(write_ms, 3),
+            'draw': audit,
+        }
     )
-    await application.bot.send_message(chat_id, messages.REGISTRATION_CLOSED_SUMMARY.format(winners=len(winner_regs), waitlist=waitlist_people))
+    await application.bot.send_message(chat_id, messages.REGISTRATION_CLOSED_SUMMARY.format(winners=winners, waitlist=waitlist_people))
     await application.bot.send_message(chat_id, messages.LOTTERY_READY_FOR_REVIEW)
 
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -779,8 +1334,7 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
     
     if not event or event['status'] == 'CANCELLED':
         await update.message.reply_text(messages.NO_EVENT_FOUND)
@@ -788,16 +1342,11 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Check if user is in the speakers group
-    if event['speakers_group_id']:
-        try:
-            member = await context.bot.get_chat_member(_get_group_id(event['speakers_group_id']), update.effective_user.id)
-            if member.status in ["member", "administrator", "creator"]:
-                await update.message.reply_text(messages.ALREADY_SPEAKER)
-                log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER_FAIL', 'User is in speakers group')
-                conn.close()
-                return
-        except Exception as e:
-            logging.error(f"Error checking speaker group membership: {e}")
+    if await _is_group_speaker(context.bot, event, update.effective_user.id, cursor):
+        await update.message.reply_text(messages.ALREADY_SPEAKER)
+        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER_FAIL', 'User is in speakers group')
+        conn.close()
+        return
 
     # Check if user is a speaker (manual list)
     if update.effective_user.username:
@@ -855,7 +1404,9 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "INSERT INTO registrations (event_id, user_id, chat_id, username, first_name, status, signup_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
             (event['id'], update.effective_user.id, update.effective_chat.id, update.effective_user.username, update.effective_user.first_name, 'REGISTERED', get_now())
         )
-        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER', 'Status: REGISTERED')
+        conn.commit()
+        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER', 'Status: REGISTERED',
+                   reg_id=cursor.lastrowid, new_status='REGISTERED')
         try:
             await context.bot.send_message(update.effective_user.id, messages.REGISTER_SUCCESS_LOTTERY)
             if update.effective_chat.type != "private":
@@ -874,7 +1425,9 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "INSERT INTO registrations (event_id, user_id, chat_id, username, first_name, status, signup_time, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (event['id'], update.effective_user.id, update.effective_chat.id, update.effective_user.username, update.effective_user.first_name, 'WAITLIST', get_now(), max_p + 1)
         )
-        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER', 'Status: WAITLIST')
+        conn.commit()
+        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'REGISTER', 'Status: WAITLIST',
+                   reg_id=cursor.lastrowid, new_status='WAITLIST')
         try:
             await context.bot.send_message(update.effective_user.id, messages.REGISTER_WAITLIST.format(position=max_p + 2))
             if update.effective_chat.type != "private":
@@ -892,13 +1445,8 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def _is_speaker_user(event, user_id, username, cursor, context_or_app):
     if not event:
         return False
-    if event['speakers_group_id']:
-        try:
-            member = await context_or_app.bot.get_chat_member(_get_group_id(event['speakers_group_id']), user_id)
-            if member.status in ["member", "administrator", "creator"]:
-                return True
-        except Exception:
-            pass
+    if await _is_group_speaker(context_or_app.bot, event, user_id, cursor):
+        return True
     if username:
         cursor.execute("SELECT id FROM speakers WHERE event_id = ? AND username = ?", (event['id'], username.lower()))
         if cursor.fetchone():
@@ -921,8 +1469,7 @@ async def pair_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
 
     if not event or event['status'] != 'OPEN':
         await update.message.reply_text(messages.PAIR_NOT_OPEN)
@@ -1012,8 +1559,7 @@ async def invite_guest(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
     
     if not event or event['status'] == 'CANCELLED':
         await update.message.reply_text(messages.NO_EVENT_FOUND)
@@ -1027,14 +1573,7 @@ async def invite_guest(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Check if sender is a speaker
-    is_speaker = False
-    if event['speakers_group_id']:
-        try:
-            member = await context.bot.get_chat_member(_get_group_id(event['speakers_group_id']), update.effective_user.id)
-            if member.status in ["member", "administrator", "creator"]:
-                is_speaker = True
-        except Exception as e:
-            logging.error(f"Error checking speaker group: {e}")
+    is_speaker = await _is_group_speaker(context.bot, event, update.effective_user.id, cursor)
 
     if not is_speaker and update.effective_user.username:
         cursor.execute(
@@ -1109,69 +1648,81 @@ async def invite_guest(update: Update, context: ContextTypes.DEFAULT_TYPE):
         conn.close()
         return
 
-    # Check if guest is already registered (case insensitive)
-    cursor.execute(
-        "SELECT * FROM registrations WHERE event_id = ? AND LOWER(username) = ? AND status != 'UNREGISTERED'",
-        (event['id'], guest_username.lower())
-    )
-    existing_reg = cursor.fetchone()
+    # The duplicate check and the total_places bump must not interleave with
+    # another invite or promotion for the same event.
+    async with locks.event(event['id']):
+        # Check if guest is already registered (case insensitive)
+        cursor.execute(
+            "SELECT * FROM registrations WHERE event_id = ? AND LOWER(username) = ? AND status != 'UNREGISTERED'",
+            (event['id'], guest_username.lower())
+        )
+        existing_reg = cursor.fetchone()
     
-    log_details = None
-
-    if existing_reg:
-        # If they are already REGISTERED (lottery pool) or WAITLIST, upgrade them
-        if existing_reg['status'] in ['REGISTERED', 'WAITLIST']:
+        log_details = None
+        fail_details = None
+        notify_user_id = None
+
+        if existing_reg:
+            # If they are already REGISTERED (lottery pool) or WAITLIST, upgrade them
+            if existing_reg['status'] in ['REGISTERED', 'WAITLIST']:
+                if invite_to_delete_id:
+                    cursor.execute("DELETE FROM registrations WHERE id = ?", (invite_to_delete_id,))
+                else:
+                    # Upgrading from general pool, increase total_places so they don't consume a general spot
+                    cursor.execute("UPDATE events SET total_places = total_places + 1 WHERE id = ?", (event['id'],))
+                
+                cursor.execute(
+                    "UPDATE registrations SET status = 'ACCEPTED', guest_of_user_id = ? WHERE id = ?",
+                    (update.effective_user.id, existing_reg['id'])
+                )
+                log_details = f'Upgraded Guest: {guest_username}'
+                reply = old_guest_message + messages.GUEST_UPGRADED.format(username=guest_username)
+                notify_user_id = existing_reg['user_id']
+            elif existing_reg['status'] == 'ACCEPTED':
+                 # Already accepted (maybe via lottery or another invite?)
+                 if existing_reg['guest_of_user_id']:
+                     reply = messages.GUEST_ALREADY_GUEST.format(username=guest_username)
+                     fail_details = f'Guest {guest_username} is already invited by someone else'
+                 else:
+                     reply = messages.GUEST_ALREADY_HAS_SPOT.format(username=guest_username)
+                     fail_details = f'Guest {guest_username} already has a spot'
+            else:
+                 reply = f"@{guest_username} has status {existing_reg['status']}."
+        else:
             if invite_to_delete_id:
                 cursor.execute("DELETE FROM registrations WHERE id = ?", (invite_to_delete_id,))
             else:
-                # Upgrading from general pool, increase total_places so they don't consume a general spot
+                # Completely new guest, increase total_places so they don't consume a general spot
                 cursor.execute("UPDATE events SET total_places = total_places + 1 WHERE id = ?", (event['id'],))
-                
+            
+            # Create new registration for guest
+            invite_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(16))
             cursor.execute(
-                "UPDATE registrations SET status = 'ACCEPTED', guest_of_user_id = ? WHERE id = ?",
-                (update.effective_user.id, existing_reg['id'])
+                "INSERT INTO registrations (event_id, username, status, guest_of_user_id, signup_time, invite_token) VALUES (?, ?, ?, ?, ?, ?)",
+                (event['id'], guest_username, 'ACCEPTED', update.effective_user.id, get_now(), invite_token)
             )
-            log_details = f'Upgraded Guest: {guest_username}'
-            await update.message.reply_text(old_guest_message + messages.GUEST_UPGRADED.format(username=guest_username))
-            try:
-                if existing_reg['user_id']:
-                    await context.bot.send_message(existing_reg['user_id'], messages.GUEST_INVITED_NOTIFY.format(speaker=update.effective_user.first_name))
-            except: pass
-        elif existing_reg['status'] == 'ACCEPTED':
-             # Already accepted (maybe via lottery or another invite?)
-             if existing_reg['guest_of_user_id']:
-                 await update.message.reply_text(messages.GUEST_ALREADY_GUEST.format(username=guest_username))
-                 log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'INVITE_FAIL', f'Guest {guest_username} is already invited by someone else')
-             else:
-                 await update.message.reply_text(messages.GUEST_ALREADY_HAS_SPOT.format(username=guest_username))
-                 log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'INVITE_FAIL', f'Guest {guest_username} already has a spot')
-        else:
-             await update.message.reply_text(f"@{guest_username} has status {existing_reg['status']}.")
-    else:
-        if invite_to_delete_id:
-            cursor.execute("DELETE FROM registrations WHERE id = ?", (invite_to_delete_id,))
-        else:
-            # Completely new guest, increase total_places so they don't consume a general spot
-            cursor.execute("UPDATE events SET total_places = total_places + 1 WHERE id = ?", (event['id'],))
-            
-        # Create new registration for guest
-        invite_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(16))
-        cursor.execute(
-            "INSERT INTO registrations (event_id, username, status, guest_of_user_id, signup_time, invite_token) VALUES (?, ?, ?, ?, ?, ?)",
-            (event['id'], guest_username, 'ACCEPTED', update.effective_user.id, get_now(), invite_token)
-        )
-        log_details = f'Guest: {guest_username}'
+            log_details = f'Guest: {guest_username}'
         
-        # Decide which message to show based on whether it was a phone number
-        if is_phone:
-            bot_username = context.bot.username
-            link = f"https://t.me/{bot_username}?start={invite_token}"
-            await update.message.reply_text(old_guest_message + messages.GUEST_INVITED_LINK.format(link=link))
-        else:
-            await update.message.reply_text(old_guest_message + messages.GUEST_INVITED_NEW.format(username=guest_username))
+            # Decide which message to show based on whether it was a phone number
+            if is_phone:
+                bot_username = context.bot.username
+                link = f"https://t.me/{bot_username}?start={invite_token}"
+                reply = old_guest_message + messages.GUEST_INVITED_LINK.format(link=link)
+            else:
+                reply = old_guest_message + messages.GUEST_INVITED_NEW.format(username=guest_username)
  
-    conn.commit()
+        conn.commit()
     conn.close()
+    # total_places may have been bumped for the guest
+    event_cache.invalidate()
+
+    await update.message.reply_text(reply)
+    if notify_user_id:
+        try:
+            await context.bot.send_message(notify_user_id, messages.GUEST_INVITED_NOTIFY.format(speaker=update.effective_user.first_name))
+        except: pass
+    if fail_details:
+        log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'INVITE_FAIL', fail_details)
     
     # Log after commit to avoid DB lock
     if log_details:
@@ -1183,8 +1734,7 @@ async def unregister(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
 
     if not event or event['status'] == 'CANCELLED':
         await update.message.reply_text(messages.NO_ACTIVE_REGISTRATION)
@@ -1192,14 +1742,7 @@ async def unregister(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Check if user is a speaker
-    is_speaker = False
-    if event['speakers_group_id']:
-        try:
-            member = await context.bot.get_chat_member(_get_group_id(event['speakers_group_id']), update.effective_user.id)
-            if member.status in ["member", "administrator", "creator"]:
-                is_speaker = True
-        except Exception as e:
-            logging.error(f"Error checking speaker group membership: {e}")
+    is_speaker = await _is_group_speaker(context.bot, event, update.effective_user.id, cursor)
 
     if not is_speaker and update.effective_user.username:
         cursor.execute(
@@ -1242,10 +1785,13 @@ async def unregister(update: Update, context: ContextTypes.DEFAULT_TYPE):
         conn.close()
         return
 
-    cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', user_id = ? WHERE id = ?", (update.effective_user.id, reg['id']))
-    await _unlink_partner(reg, cursor, context.bot)
-    conn.commit()
-    log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'UNREGISTER', f'Old status: {old_status}')
+    async with locks.event(event['id']):
+        cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', user_id = ? WHERE id = ?", (update.effective_user.id, reg['id']))
+        partner = _unlink_partner(reg, cursor)
+        conn.commit()
+    await _notify_unlinked_partner(reg, partner, context.bot)
+    log_action(event['id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'UNREGISTER', f'Old status: {old_status}',
+               reg_id=reg['id'], old_status=old_status, new_status='UNREGISTERED')
     await update.message.reply_text(messages.UNREGISTERED_SUCCESS)
 
     if old_status in ('ACCEPTED', 'INVITED'):
@@ -1258,6 +1804,41 @@ async def invite_next(event_id):
         logging.info("Waitlist promotion stopped for event 26.")
         return
 
+    # Capacity check and promotion must not interleave with another
+    # capacity-changing handler for the same event.
+    async with locks.event(event_id):
+        unit, timeout_hours = _claim_next_waitlist_unit(event_id)
+    if not unit:
+        return
+
+    is_pair = len(unit) == 2
+    for reg in unit:
+        partner_username = None
+        if is_pair:
+            partner = unit[1] if reg['id'] == unit[0]['id'] else unit[0]
+            partner_username = partner['username'] or partner['first_name'] or '—'
+        keyboard = [[
+            InlineKeyboardButton("Accept", callback_data=f"acc_{reg['id']}"),
+            InlineKeyboardButton("Decline", callback_data=f"dec_{reg['id']}")
+        ]]
+        text = (
+            messages.SPOT_OPENED_PAIR_INVITE.format(partner=partner_username, hours=timeout_hours)
+            if is_pair else
+            messages.SPOT_OPENED_INVITE.format(hours=timeout_hours)
+        )
+        try:
+            await application.bot.send_message(
+                reg['user_id'],
+                text,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except Exception as e:
+            logging.error(f"Failed to notify waitlist user {reg['user_id']}: {e}")
+            await _report_send_failures([(reg['username'], reg['user_id'], str(e))], "приглашение из вейтлиста")
+
+def _claim_next_waitlist_unit(event_id):
+    """Move the next waitlist unit to INVITED (or ACCEPTED during review) if capacity allows.
+    Returns (unit, timeout_hours); unit is None when nobody needs to be messaged."""
     conn = get_db()
     cursor = conn.cursor()
     
@@ -1265,7 +1846,7 @@ async def invite_next(event_id):
     event = cursor.fetchone()
     if not event:
         conn.close()
-        return
+        return None, None
 
     # --- Strict Capacity Check ---
     cursor.execute("SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status IN ('ACCEPTED', 'INVITED')", (event_id,))
@@ -1279,7 +1860,7 @@ async def invite_next(event_id):
     if event['total_places'] is not None and total_occupied >= event['total_places']:
         logging.info(f"Strict Capacity Check: Event {event_id} is full (Total: {event['total_places']}, Occupied: {total_occupied}). Stopping waitlist promotion.")
         conn.close()
-        return
+        return None, None
     # -----------------------------
 
     seats_available = (event['total_places'] - total_occupied) if event['total_places'] is not None else 1
@@ -1291,10 +1872,12 @@ async def invite_next(event_id):
         if unit:
             for reg in unit:
                 cursor.execute("UPDATE registrations SET status = 'ACCEPTED' WHERE id = ?", (reg['id'],))
-                log_action(event_id, reg['user_id'], reg['username'], reg['first_name'], 'PROMOTE_REVIEW', 'Waitlist promoted silently during review')
             conn.commit()
+            for reg in unit:
+                log_action(event_id, reg['user_id'], reg['username'], reg['first_name'], 'PROMOTE_REVIEW', 'Waitlist promoted silently during review',
+                           reg_id=reg['id'], old_status='WAITLIST', new_status='ACCEPTED')
         conn.close()
-        return
+        return None, None
 
     # Default timeout is 24h
     default_timeout = 24
@@ -1317,7 +1900,7 @@ async def invite_next(event_id):
         if time_to_event < timedelta(hours=2):
             logging.info(f"Event {event_id} starts in {time_to_event}, stopping waitlist promotions.")
             conn.close()
-            return
+            return None, None
 
         if time_to_event < timedelta(hours=24):
             timeout_hours = 1
@@ -1329,7 +1912,7 @@ async def invite_next(event_id):
     unit = _next_waitlist_unit(event_id, cursor, seats_available)
     if not unit:
         conn.close()
-        return
+        return None, None
 
     expires_at = calculate_expiration_with_night_pause(get_now(), timeout_hours)
     for reg in unit:
@@ -1340,34 +1923,8 @@ async def invite_next(event_id):
     reoder_waitlist(event_id, cursor)
     conn.commit()
 
-    is_pair = len(unit) == 2
+    # Store the timers before any network I/O so a crash can't leave an invite without one
     for reg in unit:
-        log_action(event_id, reg['user_id'], reg['username'], reg['first_name'], 'INVITE_NEXT', 'Pair invited' if is_pair else 'Waitlist invited')
-
-    for reg in unit:
-        partner_username = None
-        if is_pair:
-            partner = unit[1] if reg['id'] == unit[0]['id'] else unit[0]
-            partner_username = partner['username'] or partner['first_name'] or '—'
-        keyboard = [[
-            InlineKeyboardButton("Accept", callback_data=f"acc_{reg['id']}"),
-            InlineKeyboardButton("Decline", callback_data=f"dec_{reg['id']}")
-        ]]
-        text = (
-            messages.SPOT_OPENED_PAIR_INVITE.format(partner=partner_username, hours=timeout_hours)
-            if is_pair else
-            messages.SPOT_OPENED_INVITE.format(hours=timeout_hours)
-        )
-        try:
-            await application.bot.send_message(
-                reg['user_id'],
-                text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify waitlist user {reg['user_id']}: {e}")
-            await _report_send_failures([(reg['username'], reg['user_id'], str(e))], "приглашение из вейтлиста")
-
         scheduler.add_job(
             check_timeout_job,
             'date',
@@ -1377,38 +1934,70 @@ async def invite_next(event_id):
             replace_existing=True
         )
 
+    is_pair = len(unit) == 2
+    for reg in unit:
+        log_action(event_id, reg['user_id'], reg['username'], reg['first_name'], 'INVITE_NEXT', 'Pair invited' if is_pair else 'Waitlist invited',
+                   reg_id=reg['id'], old_status='WAITLIST', new_status='INVITED')
+
     conn.close()
+    return unit, timeout_hours
 
 async def check_timeout_job(reg_id):
+    """Expire an invitation that is still pending (with its pair partner) and invite the next
+    waitlisted unit. Returns how many registrations expired: 0 if it was already answered."""
+    return await _expire_invites([reg_id])
+
+async def _expire_invites(reg_ids):
+    """Expire the still-INVITED registrations among reg_ids, with their INVITED pair partners,
+    in one UPDATE, then tell them and refill each affected event's freed seats.
+    Returns how many registrations expired."""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM registrations WHERE id = ?", (reg_id,))
-    reg = cursor.fetchone()
-
-    if reg and reg['status'] == 'INVITED':
-        # If paired and partner is also INVITED, expire both atomically.
-        partner = None
-        if reg['partner_reg_id']:
-            cursor.execute("SELECT * FROM registrations WHERE id = ?", (reg['partner_reg_id'],))
-            p = cursor.fetchone()
-            if p and p['status'] == 'INVITED':
-                partner = p
+    placeholders = ",".join("?" * len(reg_ids))
+    cursor.execute(f"SELECT * FROM registrations WHERE status = 'INVITED' AND id IN ({placeholders})", list(reg_ids))
+    regs = cursor.fetchall()
+    if not regs:
+        conn.close()
+        return 0
+    due_ids = {reg['id'] for reg in regs}
+    # If paired and partner is also INVITED, expire both atomically.
+    partner_ids = {reg['partner_reg_id'] for reg in regs if reg['partner_reg_id'] and reg['partner_reg_id'] not in due_ids}
+    partners = []
+    if partner_ids:
+        placeholders = ",".join("?" * len(partner_ids))
+        cursor.execute(f"SELECT * FROM registrations WHERE status = 'INVITED' AND id IN ({placeholders})", list(partner_ids))
+        partners = cursor.fetchall()
+
+    expired_ids = list(due_ids) + [p['id'] for p in partners]
+    placeholders = ",".join("?" * len(expired_ids))
+    cursor.execute(f"UPDATE registrations SET status = 'EXPIRED' WHERE id IN ({placeholders})", expired_ids)
+    conn.commit()
+    conn.close()
 
-        cursor.execute("UPDATE registrations SET status = 'EXPIRED' WHERE id = ?", (reg_id,))
-        if partner:
-            cursor.execute("UPDATE registrations SET status = 'EXPIRED' WHERE id = ?", (partner['id'],))
-        conn.commit()
+    for reg in regs:
+        log_action(reg['event_id'], reg['user_id'], reg['username'], reg['first_name'], 'EXPIRE_INVITE', 'Waitlist invite expired',
+                   reg_id=reg['id'], old_status='INVITED', new_status='EXPIRED')
+    for partner in partners:
+        log_action(partner['event_id'], partner['user_id'], partner['username'], partner['first_name'], 'EXPIRE_INVITE', 'Pair partner expired together',
+                   reg_id=partner['id'], old_status='INVITED', new_status='EXPIRED')
 
-        log_action(reg['event_id'], reg['user_id'], reg['username'], reg['first_name'], 'EXPIRE_INVITE', 'Waitlist invite expired')
-        if partner:
-            log_action(partner['event_id'], partner['user_id'], partner['username'], partner['first_name'], 'EXPIRE_INVITE', 'Pair partner expired together')
+    for r in list(regs) + list(partners):
+        try:
+            await application.bot.send_message(r['user_id'], messages.INVITATION_EXPIRED)
+        except: pass
 
-        for r in ([reg, partner] if partner else [reg]):
-            try:
-                await application.bot.send_message(r['user_id'], messages.INVITATION_EXPIRED)
-            except: pass
-        await invite_next(reg['event_id'])
-    conn.close()
+    # One invitation (single or pair) frees one waitlist unit's worth of seats
+    units = {}
+    seen = set()
+    for reg in regs:
+        if reg['id'] in seen:
+            continue
+        seen.update((reg['id'], reg['partner_reg_id']))
+        units[reg['event_id']] = units.get(reg['event_id'], 0) + 1
+    for event_id, count in units.items():
+        for _ in range(count):
+            await invite_next(event_id)
+    return len(expired_ids)
 
 async def handle_pair_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action, parts):
     query = update.callback_query
@@ -1479,6 +2068,19 @@ async def handle_pair_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     conn.close()
 
 
+def _still_invited(reg_id, cursor):
+    cursor.execute("SELECT status FROM registrations WHERE id = ?", (reg_id,))
+    row = cursor.fetchone()
+    return row is not None and row['status'] == 'INVITED'
+
+def _pending_partner(reg, cursor):
+    """The pair partner invited together with reg and still pending, or None."""
+    if not reg['partner_reg_id']:
+        return None
+    cursor.execute("SELECT * FROM registrations WHERE id = ?", (reg['partner_reg_id'],))
+    partner = cursor.fetchone()
+    return partner if partner and partner['status'] == 'INVITED' else None
+
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1508,21 +2110,22 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             conn.close()
             return
 
-        # Resolve partner if invited together as a pair and still pending
-        partner = None
-        if reg['partner_reg_id']:
-            cursor.execute("SELECT * FROM registrations WHERE id = ?", (reg['partner_reg_id'],))
-            p = cursor.fetchone()
-            if p and p['status'] == 'INVITED':
-                partner = p
-
         if action == "acc":
-            cursor.execute("UPDATE registrations SET status = 'ACCEPTED', priority = NULL WHERE id = ?", (reg_id,))
-            if partner:
-                cursor.execute("UPDATE registrations SET status = 'ACCEPTED', priority = NULL WHERE id = ?", (partner['id'],))
-            reoder_waitlist(reg['event_id'], cursor)
-            conn.commit()
-            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'CALLBACK_ACCEPT', 'Pair' if partner else '')
+            async with locks.event(reg['event_id']):
+                # The invite may have expired while we waited for the lock
+                if not _still_invited(reg_id, cursor):
+                    await query.edit_message_text(messages.INVALID_INVITATION)
+                    conn.close()
+                    return
+                # Resolved under the lock too: the partner may have declined meanwhile
+                partner = _pending_partner(reg, cursor)
+                cursor.execute("UPDATE registrations SET status = 'ACCEPTED', priority = NULL WHERE id = ?", (reg_id,))
+                if partner:
+                    cursor.execute("UPDATE registrations SET status = 'ACCEPTED', priority = NULL WHERE id = ?", (partner['id'],))
+                reoder_waitlist(reg['event_id'], cursor)
+                conn.commit()
+            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'CALLBACK_ACCEPT', 'Pair' if partner else '',
+                       reg_id=reg_id, old_status='INVITED', new_status='ACCEPTED')
             await query.edit_message_text(messages.INVITATION_ACCEPTED)
             if partner:
                 try:
@@ -1532,6 +2135,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         elif action == "dec":
             # Show confirmation before permanently discarding the spot
+            partner = _pending_partner(reg, cursor)
             if partner and partner['username']:
                 confirm_text = messages.INVITATION_DECLINE_CONFIRM_PAIR.format(partner=partner['username'])
             else:
@@ -1545,11 +2149,18 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif action == "decyes":
             # Confirmed decline — execute and notify partner with a distinct message
             decliner_label = reg['username'] or reg['first_name'] or "—"
-            cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', priority = NULL WHERE id = ?", (reg_id,))
-            if partner:
-                cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', priority = NULL WHERE id = ?", (partner['id'],))
-            conn.commit()
-            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'CALLBACK_DECLINE', 'Pair' if partner else '')
+            async with locks.event(reg['event_id']):
+                if not _still_invited(reg_id, cursor):
+                    await query.edit_message_text(messages.INVALID_INVITATION)
+                    conn.close()
+                    return
+                partner = _pending_partner(reg, cursor)
+                cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', priority = NULL WHERE id = ?", (reg_id,))
+                if partner:
+                    cursor.execute("UPDATE registrations SET status = 'UNREGISTERED', priority = NULL WHERE id = ?", (partner['id'],))
+                conn.commit()
+            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'CALLBACK_DECLINE', 'Pair' if partner else '',
+                       reg_id=reg_id, old_status='INVITED', new_status='UNREGISTERED')
             await query.edit_message_text(messages.INVITATION_DECLINED)
             if partner:
                 try:
@@ -1573,11 +2184,16 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if reg['status'] == 'UNREGISTERED':
             await query.edit_message_text(messages.UNREGISTERED_SUCCESS)
         else:
-            old_status = reg['status']
-            cursor.execute("UPDATE registrations SET status = 'UNREGISTERED' WHERE id = ?", (reg_id,))
-            await _unlink_partner(reg, cursor, context.bot)
-            conn.commit() # Commit BEFORE invite_next
-            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'UNREGISTER', f'Confirmed unregister: {old_status}')
+            async with locks.event(reg['event_id']):
+                # Re-read: an invite may have been accepted or expired since the button was shown
+                cursor.execute("SELECT status FROM registrations WHERE id = ?", (reg_id,))
+                old_status = cursor.fetchone()['status']
+                cursor.execute("UPDATE registrations SET status = 'UNREGISTERED' WHERE id = ?", (reg_id,))
+                partner = _unlink_partner(reg, cursor)
+                conn.commit() # Commit BEFORE invite_next
+            await _notify_unlinked_partner(reg, partner, context.bot)
+            log_action(reg['event_id'], update.effective_user.id, update.effective_user.username, update.effective_user.first_name, 'UNREGISTER', f'Confirmed unregister: {old_status}',
+                       reg_id=reg_id, old_status=old_status, new_status='UNREGISTERED')
             await query.edit_message_text(messages.UNREGISTERED_SUCCESS)
             if old_status in ('ACCEPTED', 'INVITED'):
                 await invite_next(reg['event_id'])
@@ -1598,17 +2214,10 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if user is a speaker first
     is_speaker = False
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
     
     if event and event['status'] != 'CANCELLED':
-        if event['speakers_group_id']:
-            try:
-                member = await context.bot.get_chat_member(_get_group_id(event['speakers_group_id']), update.effective_user.id)
-                if member.status in ["member", "administrator", "creator"]:
-                    is_speaker = True
-            except Exception as e:
-                logging.error(f"Error checking speaker group: {e}")
+        is_speaker = await _is_group_speaker(context.bot, event, update.effective_user.id, cursor)
 
         if not is_speaker and update.effective_user.username:
             cursor.execute(
@@ -1652,8 +2261,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         msg = messages.STATUS_MSG.format(status=display_status)
         if reg['status'] == 'WAITLIST' and (reg['event_status'] != 'REVIEW' or reg['guest_of_user_id'] is not None):
-            cursor.execute("SELECT COUNT(*) as pos FROM registrations WHERE event_id = ? AND status = 'WAITLIST' AND priority < ?", (reg['event_id'], reg['priority']))
-            msg += messages.WAITLIST_POSITION.format(position=cursor.fetchone()['pos'] + 1)
+            msg += messages.WAITLIST_POSITION.format(position=_waitlist_position(reg['event_id'], reg['priority'], cursor))
     
     await update.message.reply_text(msg)
     conn.close()
@@ -1721,11 +2329,31 @@ async def who(update: Update, context: ContextTypes.DEFAULT_TYPE):
     conn.close()
 
 
+def participant_counts(cursor, event_id):
+    """Every /stats counter from one pass over the event's active registrations.
+
+    general_taken includes pending invitations (invited); speakers come from the
+    speakers table, which is auto-populated or filled in manually."""
+    cursor.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM speakers WHERE event_id = :e) AS speakers,
+               COALESCE(SUM(status IN ('ACCEPTED', 'INVITED') AND guest_of_user_id IS NOT NULL), 0) AS guests,
+               COALESCE(SUM(status IN ('ACCEPTED', 'INVITED') AND guest_of_user_id IS NULL), 0) AS general_taken,
+               COALESCE(SUM(status = 'REGISTERED'), 0) AS lottery,
+               COALESCE(SUM(status = 'WAITLIST'), 0) AS waitlist,
+               COALESCE(SUM(status = 'INVITED'), 0) AS invited
+        FROM registrations
+        WHERE event_id = :e AND status IN ('ACCEPTED', 'INVITED', 'REGISTERED', 'WAITLIST')
+        """,
+        {'e': event_id}
+    )
+    return dict(cursor.fetchone())
+
+
 async def list_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM events ORDER BY created_at DESC LIMIT 1")
-    event = cursor.fetchone()
+    event = event_cache.get(cursor)
     
     if not event:
         await update.message.reply_text(messages.NO_EVENTS_FOUND)
@@ -1737,45 +2365,13 @@ async def list_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
         conn.close()
         return
 
-    # Count speakers
-    # We now rely exclusively on the speakers table which is auto-populated/manual
-    cursor.execute("SELECT COUNT(*) as count FROM speakers WHERE event_id = ?", (event['id'],))
-    speakers_count = cursor.fetchone()['count']
-
-    # Count guests
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status IN ('ACCEPTED', 'INVITED') AND guest_of_user_id IS NOT NULL",
-        (event['id'],)
-    )
-    guests_count = cursor.fetchone()['count']
-
-    # Count general accepted
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status IN ('ACCEPTED', 'INVITED') AND guest_of_user_id IS NULL",
-        (event['id'],)
-    )
-    general_taken = cursor.fetchone()['count']
-
-    # Count lottery pool
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status = 'REGISTERED'",
-        (event['id'],)
-    )
-    lottery_count = cursor.fetchone()['count']
-
-    # Count waitlist
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status = 'WAITLIST'",
-        (event['id'],)
-    )
-    waitlist_count = cursor.fetchone()['count']
-
-    # Count pending confirmations (already included in general_taken if guest_of_user_id is NULL)
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM registrations WHERE event_id = ? AND status = 'INVITED'",
-        (event['id'],)
-    )
-    invited_count = cursor.fetchone()['count']
+    counts = participant_counts(cursor, event['id'])
+    speakers_count = counts['speakers']
+    guests_count = counts['guests']
+    general_taken = counts['general_taken']
+    lottery_count = counts['lottery']
+    waitlist_count = counts['waitlist']
+    invited_count = counts['invited']
     
     total_places = event['total_places']
     vip_total = speakers_count + guests_count
@@ -1827,11 +2423,119 @@ async def list_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, parse_mode='Markdown')
     conn.close()
 
+def build_scheduler():
+    """Scheduler whose jobs live in the bot's SQLite file, so close/timeout/reminder
+    timers survive restarts. Missed runs are coalesced and always executed on resume."""
+    jobstores = {
+        'default': SQLAlchemyJobStore(
+            url=f"sqlite:///{DB_PATH}",
+            engine_options={'connect_args': {'timeout': 30}},
+        )
+    }
+    job_defaults = {'coalesce': True, 'misfire_grace_time': None, 'max_instances': 1}
+    return AsyncIOScheduler(jobstores=jobstores, job_defaults=job_defaults)
+
+def _as_utc_datetime(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo("UTC"))
+    return value
+
+async def expire_overdue_invites():
+    """Expire every INVITED registration whose deadline has already passed.
+
+    They expire in one batch, the same way check_timeout_job expires a single one:
+    pair partners expire together and each event's waitlist is then promoted.
+    Returns the number of expired registrations."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, expires_at FROM registrations WHERE status = 'INVITED'")
+    invited = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+
+    now = get_now()
+    overdue = []
+    for reg in invited:
+        if not reg['expires_at']:
+            continue
+        try:
+            if _as_utc_datetime(reg['expires_at']) <= now:
+                overdue.append(reg['id'])
+        except ValueError:
+            logging.error(f"Invalid expires_at for registration {reg['id']}: {reg['expires_at']!r}")
+
+    for reg_id in overdue:
+        job_id = f"timeout_{reg_id}"
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+    expired = await _expire_invites(overdue) if overdue else 0
+    if expired:
+        logging.info(f"Expired {expired} overdue invitations at startup.")
+    return expired
+
+def _reconcile_jobs():
+    """Add any close/timeout/reminder timers missing from the job store, e.g. for events
+    opened before the store existed or a crash between a DB write and add_job."""
+    scheduled = {job.id for job in scheduler.get_jobs()}
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, chat_id, end_time FROM events WHERE status = 'OPEN'")
+    for event in cursor.fetchall():
+        if f"close_{event['id']}" in scheduled:
+            continue
+        try:
+            end_time = _as_utc_datetime(event['end_time'])
+            logging.info(f"Restoring closure job for event {event['id']} at {end_time}")
+            scheduler.add_job(
+                close_registration_job,
+                'date',
+                run_date=end_time,
+                args=[event['id'], event['chat_id']],
+                id=f"close_{event['id']}",
+                replace_existing=True
+            )
+        except Exception as e:
+            logging.error(f"Failed to resume job for event {event['id']}: {e}")
+
+    cursor.execute("SELECT id, expires_at FROM registrations WHERE status = 'INVITED'")
+    for reg in cursor.fetchall():
+        if f"timeout_{reg['id']}" in scheduled:
+            continue
+        try:
+            expires_at = _as_utc_datetime(reg['expires_at'])
+            logging.info(f"Restoring timeout job for invitation {reg['id']} at {expires_at}")
+            scheduler.add_job(
+                check_timeout_job,
+                'date',
+                run_date=expires_at,
+                args=[reg['id']],
+                id=f"timeout_{reg['id']}",
+                replace_existing=True
+            )
+        except Exception as e:
+            logging.error(f"Failed to resume timeout job for registration {reg['id']}: {e}")
+
+    cursor.execute("SELECT id, event_start_time FROM events WHERE status != 'CANCELLED' AND event_start_time IS NOT NULL")
+    for event in cursor.fetchall():
+        if f"remind_5_{event['id']}" in scheduled and f"remind_2_{event['id']}" in scheduled:
+            continue
+        try:
+            schedule_reminders(event['id'], event['event_start_time'])
+        except Exception as e:
+            logging.error(f"Failed to reschedule reminders for event {event['id']}: {e}")
+
+    conn.close()
+
 async def post_init(app):
     global scheduler
-    scheduler = AsyncIOScheduler()
-    scheduler.start()
+    # Start paused: persisted jobs that fired while we were down must not run
+    # until overdue invites have been swept and missing timers restored.
+    scheduler = build_scheduler()
+    scheduler.start(paused=True)
     logging.info("Scheduler started in post_init")
+    action_log_writer.start()
 
     # Set bot commands menu
     user_commands = [
@@ -1851,6 +2555,8 @@ async def post_init(app):
         BotCommand("close", messages.DESC_CLOSE),
         BotCommand("send_invites", messages.DESC_SEND_INVITES),
         BotCommand("reset", messages.DESC_RESET),
+        BotCommand("compact", messages.DESC_COMPACT),
+        BotCommand("replay_lottery", messages.DESC_REPLAY_LOTTERY),
     ]
     
     # Default scope for everyone
@@ -1865,70 +2571,79 @@ async def post_init(app):
             
     logging.info("Bot commands menu set with scoping")
     
+    await expire_overdue_invites()
+    _reconcile_jobs()
+    scheduler.add_job(compact_logs_job, 'cron', hour=COMPACT_LOGS_HOUR, timezone=TZ, id="compact_logs", replace_existing=True)
+    scheduler.resume()
+    logging.info("Scheduler resumed")
+
+    # Finish any bulk send cut short by the previous shutdown.
+    app.create_task(_resume_outbox(app.bot))
+
+async def _resume_outbox(bot):
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, chat_id, end_time FROM events WHERE status = 'OPEN'")
-    open_events = cursor.fetchall()
-    
-    for event in open_events:
-        try:
-            end_time = datetime.fromisoformat(event['end_time'])
-            if end_time.tzinfo is None:
-                end_time = end_time.replace(tzinfo=ZoneInfo("UTC"))
-            
-            if end_time <= get_now():
-                # Already expired, run close logic now
-                logging.info(f"Event {event['id']} expired while bot was down, closing now.")
-                await close_registration_job(event['id'], event['chat_id'])
-            else:
-                logging.info(f"Rescheduling closure for event {event['id']} at {end_time}")
-                scheduler.add_job(
-                    close_registration_job,
-                    'date',
-                    run_date=end_time,
-                    args=[event['id'], event['chat_id']],
-                    id=f"close_{event['id']}",
-                    replace_existing=True
-                )
-        except Exception as e:
-            logging.error(f"Failed to resume job for event {event['id']}: {e}")
+    try:
+        result = await resume_outbox(bot, conn, clock=get_now)
+    finally:
+        conn.close()
+    await _report_send_failures(result.failures, "досылка после перезапуска")
 
-    # Reschedule timeout jobs for INVITED registrations
-    cursor.execute("SELECT id, expires_at FROM registrations WHERE status = 'INVITED'")
-    invited_regs = cursor.fetchall()
-    for reg in invited_regs:
-        try:
-            expires_at = datetime.fromisoformat(reg['expires_at'])
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=ZoneInfo("UTC"))
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the speakers mirror and cached membership in step with joins and leaves."""
+    change = update.chat_member
+    user = change.new_chat_member.user
+    is_member = change.new_chat_member.status in SPEAKER_STATUSES
+    speaker_cache.set(change.chat.id, user.id, is_member)
+    if user.is_bot:
+        return
 
-            if expires_at <= get_now():
-                logging.info(f"Invitation {reg['id']} expired while bot was down, checking timeout now.")
-                await check_timeout_job(reg['id'])
-            else:
-                logging.info(f"Rescheduling timeout for invitation {reg['id']} at {expires_at}")
-                scheduler.add_job(
-                    check_timeout_job,
-                    'date',
-                    run_date=expires_at,
-                    args=[reg['id']],
-                    id=f"timeout_{reg['id']}",
-                    replace_existing=True
-                )
-        except Exception as e:
-            logging.error(f"Failed to resume timeout job for registration {reg['id']}: {e}")
+    conn = get_db()
+    cursor = conn.cursor()
+    event = event_cache.get(cursor)
+    if not event or event['status'] == 'CANCELLED' or _get_group_id(event['speakers_group_id']) != change.chat.id:
+        conn.close()
+        return
 
-    # Reschedule reminders
-    cursor.execute("SELECT id, event_start_time FROM events WHERE status != 'CANCELLED' AND event_start_time IS NOT NULL")
-    active_events = cursor.fetchall()
-    for event in active_events:
-        try:
-            schedule_reminders(event['id'], event['event_start_time'])
-        except Exception as e:
-            logging.error(f"Failed to reschedule reminders for event {event['id']}: {e}")
-            
+    # Same identifier rule as speaker_import.speaker_row: lowercased username, else the id
+    identifier = user.username.lower() if user.username else str(user.id)
+    cursor.execute(
+        "SELECT id FROM speakers WHERE event_id = ? AND (user_id = ? OR username = ?)",
+        (event['id'], user.id, identifier)
+    )
+    existing = cursor.fetchone()
+    if is_member:
+        # A row under an old username goes; the current one is upserted on the
+        # unique (event_id, username) key, which a manually added row may already hold.
+        cursor.execute(
+            "DELETE FROM speakers WHERE event_id = ? AND user_id = ? AND username IS NOT ?",
+            (event['id'], user.id, identifier)
+        )
+        cursor.execute(
+            "INSERT INTO speakers (event_id, username, first_name, user_id) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (event_id, username) DO UPDATE SET user_id = excluded.user_id, first_name = excluded.first_name",
+            (event['id'], identifier, user.first_name, user.id)
+        )
+        action = None if existing else 'SPEAKER_JOINED'
+    elif existing:
+        cursor.execute(
+            "DELETE FROM speakers WHERE event_id = ? AND (user_id = ? OR username = ?)",
+            (event['id'], user.id, identifier)
+        )
+        action = 'SPEAKER_LEFT'
+    else:
+        action = None
+    conn.commit()
     conn.close()
 
+    # Log after commit to avoid DB lock
+    if action:
+        log_action(event['id'], user.id, user.username, user.first_name, action, f'status={change.new_chat_member.status}')
+
+async def post_shutdown(app):
+    speaker_importer.stop()
+    await action_log_writer.stop()
+    close_pool()
+
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if await is_admin(update, context):
         await update.message.reply_text(messages.UNKNOWN_COMMAND_ADMIN)
@@ -1938,8 +2653,20 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def main():
     global application
     init_db()
+    event_cache.enabled = True
+    speaker_cache.enabled = True
     
-    application = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    application = builder.build()
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("create", create_event))
@@ -1954,11 +2681,36 @@ def main():
     application.add_handler(CommandHandler("stats", list_participants))
     application.add_handler(CommandHandler("who", who))
     application.add_handler(CommandHandler("reset", reset_event))
+    application.add_handler(CommandHandler("compact", compact_logs_command))
+    application.add_handler(CommandHandler("replay_lottery", replay_lottery_command))
     application.add_handler(CallbackQueryHandler(callback_handler))
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
     application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 
-    logging.info("Bot starting polling...")
-    application.run_polling()
+    run_application(application)
+
+def run_application(app):
+    if not WEBHOOK_URL:
+        logging.info("Bot starting polling...")
+        # chat_member updates are only delivered when asked for explicitly
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+        return
+
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET environment variable must be set when WEBHOOK_URL is used")
+    logging.info(f"Bot starting webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+    # Updates queued while the bot was restarting are kept (drop_pending_updates=False):
+    # a /register sent during a deploy must not be lost.
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=False,
+    )
 
 if __name__ == '__main__':
     main()
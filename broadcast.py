@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+# Telegram allows ~30 messages/second per bot and ~1 message/second per chat.
+# Stay a bit under the global limit so interactive replies still get through.
+GLOBAL_RATE_PER_SECOND = 25
+PER_CHAT_INTERVAL_SECONDS = 1.0
+WORKERS = 8
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+# Delivery results are written back in short transactions of this many rows,
+# so a bulk send never holds the SQLite write lock across network calls.
+FLUSH_EVERY = 50
+PROGRESS_INTERVAL_SECONDS = 10.0
+# Per-chat slots older than this are dropped once SendLimiter tracks too many chats
+MAX_TRACKED_CHATS = 10000
+
+
+@dataclass
+class Recipient:
+    chat_id: int
+    text: str
+    username: str = None
+    reg_id: int = None  # registrations.id to mark notified once delivered
+
+
+@dataclass
+class BroadcastResult:
+    sent: int
+    failures: list  # (username, chat_id, error) tuples, as used by _report_send_failures
+
+
+class TokenBucket:
+    """Global send-rate limiter. pause() stops everyone after a flood-control RetryAfter."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SendLimiter:
+    """The global token bucket plus per-chat spacing, for every message the bot sends in bulk."""
+
+    def __init__(self, rate=GLOBAL_RATE_PER_SECOND):
+        self.bucket = TokenBucket(rate)
+        self._next_chat_slot = {}
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+    async def acquire(self, chat_id):
+        await self.bucket.acquire()
+        now = time.monotonic()
+        if len(self._next_chat_slot) >= MAX_TRACKED_CHATS:
+            self._next_chat_slot = {k: v for k, v in self._next_chat_slot.items() if v > now}
+        slot = max(now, self._next_chat_slot.get(chat_id, 0.0))
+        self._next_chat_slot[chat_id] = slot + PER_CHAT_INTERVAL_SECONDS
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Shared by all broadcasts in the process, and by the progress and failure
+# reports sent alongside them, so together they stay under Telegram's limits.
+limiter = SendLimiter()
+
+
+async def throttle(chat_id):
+    """Wait for a send slot to chat_id; for one-off messages sent next to a broadcast."""
+    await limiter.acquire(chat_id)
+
+
+def _retry_after_seconds(err):
+    value = err.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class _Broadcast:
+    def __init__(self, bot, conn, label, rows, progress, clock):
+        self.bot = bot
+        self.conn = conn
+        self.label = label
+        self.rows = rows
+        self.progress = progress
+        self.clock = clock
+        self.pending_results = []
+        self.failures = []
+        self.sent = 0
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_progress = self.started
+
+    async def _deliver(self, row):
+        attempts = row['attempts'] or 0
+        while True:
+            attempts += 1
+            await limiter.acquire(row['chat_id'])
+            try:
+                await self.bot.send_message(row['chat_id'], row['text'])
+                return attempts, None
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logging.warning(f"Flood limit during '{self.label}' broadcast, pausing {delay}s")
+                limiter.pause(delay)
+                error = str(e)
+            except (BadRequest, Forbidden) as e:
+                # Permanent (chat not found, bot blocked); BadRequest is a NetworkError subclass
+                return attempts, str(e)
+            except (TimedOut, NetworkError) as e:
+                if attempts < MAX_ATTEMPTS:
+                    await asyncio.sleep(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+                error = str(e)
+            except Exception as e:
+                return attempts, str(e)
+            if attempts >= MAX_ATTEMPTS:
+                return attempts, error
+
+    async def _worker(self, queue):
+        while True:
+            try:
+                row = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            attempts, error = await self._deliver(row)
+            if error is None:
+                self.sent += 1
+            else:
+                logging.error(f"Failed to deliver '{self.label}' message to {row['chat_id']}: {error}")
+                self.failures.append((row['username'], row['chat_id'], error))
+            self.pending_results.append((row, attempts, error, self.clock()))
+            self.done += 1
+            if len(self.pending_results) >= FLUSH_EVERY:
+                self._flush()
+            await self._report_progress()
+
+    def _flush(self):
+        results, self.pending_results = self.pending_results, []
+        if not results:
+            return
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, sent_at = ? WHERE id = ?",
+            [('FAILED' if error else 'SENT', attempts, error, None if error else now, row['id'])
+             for row, attempts, error, now in results]
+        )
+        delivered = [(now, row['reg_id']) for row, _, error, now in results if not error and row['reg_id']]
+        if delivered:
+            cursor.executemany("UPDATE registrations SET notified_at = ? WHERE id = ?", delivered)
+        self.conn.commit()
+
+    async def _report_progress(self):
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if now - self.last_progress < PROGRESS_INTERVAL_SECONDS or self.done == len(self.rows):
+            return
+        self.last_progress = now
+        rate = self.done / (now - self.started)
+        eta = int((len(self.rows) - self.done) / rate) if rate > 0 else 0
+        try:
+            await self.progress(self.done, len(self.rows), eta)
+        except Exception as e:
+            logging.error(f"Failed to report '{self.label}' broadcast progress: {e}")
+
+    async def run(self):
+        queue = asyncio.Queue()
+        for row in self.rows:
+            queue.put_nowait(row)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(min(WORKERS, len(self.rows)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            self._flush()
+        return BroadcastResult(sent=self.sent, failures=self.failures)
+
+
+def _utc_now():
+    return datetime.now(ZoneInfo("UTC"))
+
+
+def _fetch_pending(cursor, where, params):
+    cursor.execute(
+        f"SELECT id, chat_id, username, text, reg_id, attempts FROM outbox WHERE status = 'PENDING' AND {where} ORDER BY id",
+        params
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+
+async def send_bulk(bot, conn, label, recipients, progress=None, clock=_utc_now, dedupe=True):
+    """Queue recipients in the outbox and deliver them, rate-limited, with retries.
+
+    progress, if given, is awaited as progress(done, total, eta_seconds) at most every
+    PROGRESS_INTERVAL_SECONDS. clock stamps sent_at and registrations.notified_at.
+    With dedupe, a chat that already has a PENDING or SENT message under the same
+    label (e.g. "winners:<event_id>") is skipped: re-running a send while
+    resume_outbox still drains the previous one must not message anyone twice.
+    Returns a BroadcastResult once every queued message is SENT or FAILED."""
+    recipients = [r for r in recipients if r.chat_id]
+    if not recipients:
+        return BroadcastResult(sent=0, failures=[])
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM outbox")
+    first_id = cursor.fetchone()[0] + 1
+    rows = [(label, r.chat_id, r.username, r.text, r.reg_id) for r in recipients]
+    if dedupe:
+        cursor.executemany(
+            "INSERT INTO outbox (broadcast, chat_id, username, text, reg_id, status) "
+            "SELECT ?1, ?2, ?3, ?4, ?5, 'PENDING' WHERE NOT EXISTS ("
+            "SELECT 1 FROM outbox WHERE broadcast = ?1 AND chat_id = ?2 AND status IN ('PENDING', 'SENT'))",
+            rows
+        )
+    else:
+        cursor.executemany(
+            "INSERT INTO outbox (broadcast, chat_id, username, text, reg_id, status) VALUES (?, ?, ?, ?, ?, 'PENDING')",
+            rows
+        )
+    conn.commit()
+
+    rows = _fetch_pending(cursor, "broadcast = ? AND id >= ?", (label, first_id))
+    if len(rows) < len(recipients):
+        logging.info(f"'{label}' broadcast: {len(recipients) - len(rows)} recipients already queued or sent, skipped")
+    return await _Broadcast(bot, conn, label, rows, progress, clock).run()
+
+
+async def resume_outbox(bot, conn, clock=_utc_now):
+    """Deliver messages still PENDING from a bulk send interrupted by a restart."""
+    cursor = conn.cursor()
+    rows = _fetch_pending(cursor, "1 = 1", ())
+    if not rows:
+        return BroadcastResult(sent=0, failures=[])
+    logging.info(f"Resuming {len(rows)} undelivered outbox messages")
+    return await _Broadcast(bot, conn, "resume", rows, None, clock).run()
@@ -0,0 +1,203 @@
+"""A local stand-in for the Telegram Bot API, for load tests.
+
+Speaks enough of the HTTP protocol for python-telegram-bot: getMe, getUpdates
+(long polling), sendMessage, editMessageText, answerCallbackQuery,
+getChatMember and friends; any other method answers ok with True. Updates are
+queued with push_update(), and every call the bot makes is passed to the
+on_call callback.
+
+To mimic Telegram under load it can add a fixed latency to every request,
+refuse a share of sends with 429, and enforce flood limits (sends per second
+overall and per chat), also answered with 429 and retry_after.
+
+Point the bot at it with TELEGRAM_API_URL=<FakeBotApi.url>.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 4242, "is_bot": True, "first_name": "Load test bot", "username": "load_test_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Methods that deliver something to a chat: subject to 429 injection and flood limits
+SEND_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'answerCallbackQuery'}
+
+
+class RateLimiter:
+    """Sliding one-second window of requests per key; a limit of 0 means unlimited."""
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self._windows = defaultdict(deque)
+
+    def allow(self, key, now):
+        if not self.per_second:
+            return True
+        window = self._windows[key]
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= self.per_second:
+            return False
+        window.append(now)
+        return True
+
+
+def _decode(value):
+    # python-telegram-bot sends form fields with nested values JSON-encoded
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, error_rate=0.0, global_rate=0, per_chat_rate=0, retry_after=1,
+                 member_status='left', seed=None, on_call=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self.on_call = on_call
+        self.url = None
+        # Per-method counters: calls, refused with 429
+        self.calls = defaultdict(int)
+        self.throttled = defaultdict(int)
+        # update_id -> time.perf_counter() when getUpdates handed it to the bot
+        self.delivered_at = {}
+        self._rng = random.Random(seed)
+        self._global = RateLimiter(global_rate)
+        self._per_chat = RateLimiter(per_chat_rate)
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._server = None
+        self._thread = None
+
+    def start(self, host='127.0.0.1', port=0):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                api._handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        return self.url
+
+    def stop(self):
+        if self._server:
+            with self._lock:
+                self._updates_ready.notify_all()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def push_update(self, update):
+        """Queue an update (without update_id) for the bot's next getUpdates. Returns its update_id."""
+        with self._lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({"update_id": update_id, **update})
+            self._updates_ready.notify_all()
+        return update_id
+
+    def _handle(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length).decode() if length else ''
+        if 'json' in (request.headers.get('Content-Type') or ''):
+            params = json.loads(body) if body else {}
+        else:
+            params = {key: _decode(value) for key, value in parse_qsl(body)}
+        method = request.path.rstrip('/').rsplit('/', 1)[-1]
+
+        if self.latency:
+            time.sleep(self.latency)
+        status, payload = self._dispatch(method, params)
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+        if self.on_call and payload['ok']:
+            self.on_call(method, params)
+
+    def _dispatch(self, method, params):
+        with self._lock:
+            self.calls[method] += 1
+            if method in SEND_METHODS and self._refused(method, params):
+                self.throttled[method] += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+        if method == 'getUpdates':
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    def _refused(self, method, params):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return True
+        now = time.monotonic()
+        if not self._global.allow(None, now):
+            return True
+        return method != 'answerCallbackQuery' and not self._per_chat.allow(params.get('chat_id'), now)
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._lock:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates and self._server and time.monotonic() < deadline:
+                self._updates_ready.wait(deadline - time.monotonic())
+            batch = self._updates[:limit]
+            now = time.perf_counter()
+            for update in batch:
+                self.delivered_at.setdefault(update['update_id'], now)
+        return batch
+
+    def _message(self, params):
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        chat_id = int(params.get('chat_id') or 0)
+        message = {
+            "message_id": params.get('message_id') or message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": str(params.get('text', '')),
+        }
+        if params.get('reply_markup'):
+            message["reply_markup"] = params['reply_markup']
+        return message
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            return self._message(params)
+        if method == 'getChatMember':
+            user = {"id": int(params.get('user_id') or 0), "is_bot": False, "first_name": "User"}
+            return {"status": self.member_status, "user": user}
+        if method == 'getChat':
+            return {"id": int(params.get('chat_id') or 0), "type": "supergroup", "title": "Fake group"}
+        if method == 'getWebhookInfo':
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
@@ -1,83 +1,60 @@
-import os
-import sqlite3
 import argparse
 import asyncio
-from telethon import TelegramClient
-
-API_ID = int(os.getenv('TELEGRAM_API_ID', 0))
-API_HASH = os.getenv('TELEGRAM_API_HASH', '')
+import os
+import sys
+import models
+import speaker_import
 
 async def main():
     parser = argparse.ArgumentParser(description="Extract users from a telegram group and add them to the speakers table.")
     parser.add_argument('group_id', type=str, help="The Telegram Group ID or Username (e.g. -1001234567890)")
-    parser.add_argument('--db', type=str, default='/app/data/bot_data.db', help="Path to the bot database")
+    parser.add_argument('--db', type=str, default=models.DB_PATH, help="Path to the bot database")
+    parser.add_argument('--event-id', type=int, help="Target event (default: the most recently created one)")
     args = parser.parse_args()
 
+    # The bot's user id is the token's prefix; the list only counts as synced if the bot administers the group
+    bot_token = os.getenv("BOT_TOKEN", "")
+    bot_user_id = int(bot_token.split(":")[0]) if bot_token.split(":")[0].isdigit() else None
+    if bot_user_id is None:
+        print("Warning: BOT_TOKEN is not set, so the list is not marked as synced and the bot keeps asking Telegram.")
+
     print(f"Connecting to database: {args.db}")
-    conn = sqlite3.connect(args.db)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM events ORDER BY id DESC LIMIT 1")
-    event = cursor.fetchone()
-    
-    if not event:
-        print("Error: No events found in the database. Run /create first.")
+    models.DB_PATH = args.db
+    models.init_db()
+
+    event_id = args.event_id
+    if event_id is None:
+        # By creation time, not id: test events have negative ids
+        conn = models.get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM events ORDER BY created_at DESC LIMIT 1")
+        event = cursor.fetchone()
         conn.close()
-        return
-        
-    event_id = event[0]
+        if not event:
+            print("Error: No events found in the database. Run /create first.", file=sys.stderr)
+            sys.exit(1)
+        event_id = event['id']
     print(f"Target Event ID: {event_id}")
 
-    # Log in and fetch members
+    # Interactive login on first run; the session file is reused by the bot afterwards
     print("Initialize Telethon login...")
-    # Use persistent path for session file
-    session_file = '/app/data/userbot_session'
-    client = TelegramClient(session_file, API_ID, API_HASH)
-    
+    client = speaker_import._new_client()
     await client.start()
-    
+
     try:
-        # Resolve peer correctly based on input type
-        group_peer = int(args.group_id) if args.group_id.lstrip('-').isdigit() else args.group_id
-        
-        print(f"Fetching members from chat: {group_peer}...")
-        entity = await client.get_entity(group_peer)
-        participants = await client.get_participants(entity)
-        
-        print(f"Found {len(participants)} members.")
-        
-        inserted = 0
-        skipped = 0
-        
-        for user in participants:
-            if user.bot:
-                continue # Skip bots
-                
-            username = user.username.lower() if user.username else None
-            first_name = user.first_name
-            
-            # If no username, use ID as string for speakers table (which usually expects username)
-            # though our logic currently matches lowercase usernames. We should probably only add users 
-            # with names, but let's just insert what we have.
-            identifier = username if username else str(user.id)
-            
-            # Check if already exists to prevent duplicates
-            cursor.execute("SELECT id FROM speakers WHERE event_id = ? AND username = ?", (event_id, identifier))
-            if cursor.fetchone():
-                skipped += 1
-                continue
-                
-            cursor.execute("INSERT INTO speakers (event_id, username, first_name) VALUES (?, ?, ?)", (event_id, identifier, first_name))
-            inserted += 1
-            
-        conn.commit()
-        print(f"Successfully added {inserted} speakers. (Skipped {skipped} duplicates/bots).")
-        
+        result = await speaker_import.import_group(
+            client, args.group_id, event_id,
+            progress=lambda count: print(f"... {count} members imported"),
+            mark_synced=bot_user_id is not None, bot_user_id=bot_user_id
+        )
+        print(f"Successfully imported {result.imported} speakers. (Skipped {result.skipped_bots} bots).")
     except Exception as e:
-        print(f"Error fetching members: {e}")
-        
+        # Non-zero exit so a partial list is never treated as complete
+        print(f"Error fetching members: {e}", file=sys.stderr)
+        sys.exit(1)
     finally:
-        conn.close()
         await client.disconnect()
+        models.close_pool()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,305 @@
+"""Launch-minute load test: bot.py end to end against a fake Bot API.
+
+Usage:
+    python load_test.py [--users 2000] [--pair-share 0.2] [--places 300] [--ramp 10]
+                        [--latency 0.05] [--error-rate 0.01] [--global-rate 30] [--per-chat-rate 1]
+
+Starts fake_bot_api.FakeBotApi, creates an open event in a fresh database and
+runs bot.py in a subprocess pointed at the fake server (TELEGRAM_API_URL).
+Every simulated user arrives within --ramp seconds and sends /register and
+/status; a --pair-share of them team up, one sending /pair and the other
+pressing the confirmation button. Then an admin runs /stats and /close (the
+lottery).
+
+For every action it reports p50/p99 latency from the bot fetching the update
+to its answer reaching the fake API (handler latency; "e2e" adds the wait
+for getUpdates), how many went unanswered, overall throughput and the 429s
+the fake API handed out.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import messages
+from fake_bot_api import FakeBotApi
+from replay_updates import _percentile
+
+ADMIN_ID = 1
+FIRST_USER_ID = 100000
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+
+@dataclass
+class ActionStats:
+    handler: list = field(default_factory=list)
+    e2e: list = field(default_factory=list)
+    timeouts: int = 0
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"load{user_id}"}
+
+
+def command_update(user_id, text):
+    command = text.split()[0]
+    return {"message": {
+        "message_id": random.randint(1, 2**31), "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"}, "from": _user(user_id), "text": text,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+    }}
+
+
+def callback_update(user_id, query_id, message, data):
+    return {"callback_query": {
+        "id": query_id, "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {**message, "from": {"id": 4242, "is_bot": True, "first_name": "Load test bot"}},
+    }}
+
+
+def _buttons(params):
+    markup = params.get('reply_markup') or {}
+    return [button for row in markup.get('inline_keyboard', []) for button in row]
+
+
+def create_database(path, places, speakers_group_id=None):
+    """A fresh bot database with one OPEN event; returns its id."""
+    import models
+    models.DB_PATH = path
+    models.init_db()
+    models.close_pool()
+    conn = sqlite3.connect(path)
+    try:
+        end_time = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        cursor = conn.execute(
+            "INSERT INTO events (chat_id, status, total_places, speakers_group_id, waitlist_timeout_hours, end_time) "
+            "VALUES (?, 'OPEN', ?, ?, 24, ?)",
+            (ADMIN_ID, places, speakers_group_id, end_time)
+        )
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+class LoadTest:
+    def __init__(self, api, loop, timeout):
+        self.api = api
+        self.loop = loop
+        self.timeout = timeout
+        self.stats = defaultdict(ActionStats)
+        # Everything the bot sent, per chat id (answerCallbackQuery under "cb:<id>")
+        self.inboxes = defaultdict(list)
+        self._waiters = defaultdict(list)
+        self._query_ids = 0
+
+    def on_call(self, method, params):
+        """FakeBotApi callback, from its server threads."""
+        if method == 'answerCallbackQuery':
+            key = f"cb:{params.get('callback_query_id')}"
+        elif 'chat_id' in params:
+            key = params['chat_id']
+        else:
+            return
+        self.loop.call_soon_threadsafe(self._record, key, method, params)
+
+    def _record(self, key, method, params):
+        entry = (time.perf_counter(), method, params)
+        self.inboxes[key].append(entry)
+        for waiter in list(self._waiters[key]):
+            predicate, future = waiter
+            if not future.done() and predicate(entry):
+                future.set_result(entry)
+                self._waiters[key].remove(waiter)
+
+    async def expect(self, key, predicate, since=0, timeout=None):
+        """The first entry sent to `key` from index `since` on that matches, or None after the timeout."""
+        for entry in self.inboxes[key][since:]:
+            if predicate(entry):
+                return entry
+        future = self.loop.create_future()
+        waiter = (predicate, future)
+        self._waiters[key].append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._waiters[key]:
+                self._waiters[key].remove(waiter)
+
+    async def _timed(self, action, update, key, predicate, timeout=None):
+        since = len(self.inboxes[key])
+        pushed = time.perf_counter()
+        update_id = self.api.push_update(update)
+        entry = await self.expect(key, predicate, since, timeout)
+        stats = self.stats[action]
+        if entry is None:
+            stats.timeouts += 1
+            return None
+        answered = entry[0]
+        stats.e2e.append(answered - pushed)
+        stats.handler.append(answered - self.api.delivered_at.get(update_id, pushed))
+        return entry
+
+    async def command(self, user_id, text, predicate=None, timeout=None):
+        """Send a command and wait for the bot's first message back to that user."""
+        def is_reply(entry):
+            return entry[1] == 'sendMessage' and not any(
+                str(b.get('callback_data', '')).startswith('pyes_') for b in _buttons(entry[2]))
+        action = text.split()[0]
+        return await self._timed(action, command_update(user_id, text), user_id, predicate or is_reply, timeout)
+
+    async def press(self, user_id, message_params, data):
+        self._query_ids += 1
+        query_id = str(self._query_ids)
+        message = {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                   "text": message_params.get('text', ''), "reply_markup": message_params.get('reply_markup')}
+        return await self._timed('callback', callback_update(user_id, query_id, message, data),
+                                 f"cb:{query_id}", lambda entry: True)
+
+
+async def _single(test, user_id, arrival, think):
+    await asyncio.sleep(arrival)
+    await test.command(user_id, "/register")
+    await asyncio.sleep(think)
+    await test.command(user_id, "/status")
+
+
+async def _requester(test, user_id, partner_id, partner_registered, arrival, think):
+    await _single(test, user_id, arrival, think)
+    await partner_registered.wait()
+    await asyncio.sleep(think)
+    await test.command(user_id, f"/pair @load{partner_id}")
+
+
+async def _partner(test, user_id, registered, arrival, think):
+    await _single(test, user_id, arrival, think)
+    registered.set()
+
+    def is_invite(entry):
+        return any(str(b.get('callback_data', '')).startswith('pyes_') for b in _buttons(entry[2]))
+    invite = await test.expect(user_id, is_invite)
+    if invite is None:
+        test.stats['pair invite'].timeouts += 1
+        return
+    await asyncio.sleep(think)
+    button = next(b for b in _buttons(invite[2]) if str(b.get('callback_data', '')).startswith('pyes_'))
+    await test.press(user_id, invite[2], button['callback_data'])
+
+
+async def wait_until_polling(api, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while api.calls['getUpdates'] == 0:
+        if process.returncode is not None:
+            raise SystemExit(f"bot.py exited with code {process.returncode} before polling")
+        if time.monotonic() > deadline:
+            raise SystemExit("bot.py did not start polling in time")
+        await asyncio.sleep(0.1)
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    api = FakeBotApi(latency=args.latency, error_rate=args.error_rate, global_rate=args.global_rate,
+                     per_chat_rate=args.per_chat_rate, seed=args.seed)
+    test = LoadTest(api, loop, args.timeout)
+    api.on_call = test.on_call
+    api.start()
+
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    db_path = os.path.join(workdir, 'bot_data.db')
+    create_database(db_path, args.places, args.speakers_group)
+    env = {**os.environ, 'BOT_TOKEN': '123456:load-test', 'TELEGRAM_API_URL': api.url, 'DB_PATH': db_path,
+           'ADMIN_IDS': str(ADMIN_ID), 'WEBHOOK_URL': '', 'LOG_ARCHIVE_PATH': os.path.join(workdir, 'archive.db')}
+    log = open(os.path.join(workdir, 'bot.log'), 'w')
+    process = await asyncio.create_subprocess_exec(sys.executable, BOT_PATH, env=env, stdout=log, stderr=log)
+    try:
+        await wait_until_polling(api, process)
+
+        rng = random.Random(args.seed)
+        user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+        paired = int(args.users * args.pair_share) // 2 * 2
+        tasks = []
+        for i in range(0, paired, 2):
+            registered = asyncio.Event()
+            tasks.append(_requester(test, user_ids[i], user_ids[i + 1], registered, rng.uniform(0, args.ramp), args.think))
+            tasks.append(_partner(test, user_ids[i + 1], registered, rng.uniform(0, args.ramp), args.think))
+        tasks += [_single(test, user_id, rng.uniform(0, args.ramp), args.think) for user_id in user_ids[paired:]]
+
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        handled = sum(len(s.handler) for s in test.stats.values())
+
+        await test.command(ADMIN_ID, "/stats")
+        await test.command(ADMIN_ID, "/close", timeout=args.close_timeout,
+                           predicate=lambda entry: entry[2].get('text') == messages.REGISTRATION_CLOSED_MANUAL)
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 15)
+            except asyncio.TimeoutError:
+                process.kill()
+        log.close()
+        api.stop()
+        if args.keep:
+            print(f"Database and bot log kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "users": args.users, "seconds": elapsed, "handled": handled,
+        "per_second": handled / elapsed if elapsed > 0 else 0.0,
+        "actions": dict(test.stats),
+        "calls": dict(api.calls), "throttled": dict(api.throttled),
+    }
+
+
+def format_report(report):
+    lines = [f"{'action':<12} {'ok':>6} {'lost':>5} {'p50 ms':>8} {'p99 ms':>8} {'e2e p50':>8} {'e2e p99':>8}"]
+    for action, stats in sorted(report["actions"].items()):
+        handler, e2e = sorted(stats.handler), sorted(stats.e2e)
+        lines.append(
+            f"{action:<12} {len(handler):>6} {stats.timeouts:>5} {_percentile(handler, 50) * 1000:>8.1f} "
+            f"{_percentile(handler, 99) * 1000:>8.1f} {_percentile(e2e, 50) * 1000:>8.1f} {_percentile(e2e, 99) * 1000:>8.1f}"
+        )
+    lines.append(
+        f"{report['users']} users: {report['handled']} updates answered in {report['seconds']:.2f}s "
+        f"({report['per_second']:.1f}/s); {sum(report['calls'].values())} API calls, "
+        f"{sum(report['throttled'].values())} refused with 429"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test bot.py against a fake Telegram Bot API")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--pair-share", type=float, default=0.2, help="Share of users who team up with /pair")
+    parser.add_argument("--places", type=int, default=300)
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which users arrive")
+    parser.add_argument("--think", type=float, default=0.2, help="Seconds a user waits between actions")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for each answer")
+    parser.add_argument("--close-timeout", type=float, default=120.0, help="Seconds to wait for the lottery")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of sends refused with 429")
+    parser.add_argument("--global-rate", type=int, default=0, help="Sends per second before 429 (0: no limit)")
+    parser.add_argument("--per-chat-rate", type=int, default=0, help="Sends per second per chat before 429 (0: no limit)")
+    parser.add_argument("--speakers-group", help="Speakers group id, so /register also checks getChatMember")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--keep", action="store_true", help="Keep the database and bot log")
+    args = parser.parse_args()
+
+    print(format_report(asyncio.run(run(args))))
+
+
+if __name__ == '__main__':
+    main()
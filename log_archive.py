@@ -0,0 +1,150 @@
+"""Retention for action_logs: move finished events' logs out of the live database.
+
+compact() copies every log entry of an event that ended more than RETENTION_DAYS
+ago into a separate archive database (attached for the copy, so rows keep their
+ids and columns), leaves a per-action summary in action_log_rollup and deletes
+the entries from the live table. The bot runs it nightly and on /compact, on a
+worker thread while the bot keeps writing: entries move CHUNK_SIZE at a time,
+each chunk in a short transaction of its own followed by a CHUNK_PAUSE_SECONDS
+pause, so the bot's writers never wait long for the database.
+
+Entries logged for an event after it was archived are picked up by the next run.
+The archive is a plain SQLite file; open it with the sqlite3 shell to dig into
+old events. archived_entries() reads it back for the bot (e.g. /replay_lottery).
+"""
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+import analytics
+from models import DB_PATH
+
+# Kept next to the database so it lives on the same persistent volume
+ARCHIVE_PATH = os.getenv('LOG_ARCHIVE_PATH', os.path.join(os.path.dirname(DB_PATH) or '.', 'action_logs_archive.db'))
+RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 30))
+CHUNK_SIZE = 1000
+CHUNK_PAUSE_SECONDS = 0.05
+
+ROLLUP_SQL = """
+    INSERT INTO action_log_rollup (event_id, action, entries, first_at, last_at)
+    SELECT event_id, action, COUNT(*), MIN(timestamp), MAX(timestamp)
+    FROM main.action_logs WHERE event_id = ? AND id <= ? GROUP BY action
+    ON CONFLICT (event_id, action) DO UPDATE SET
+        entries = entries + excluded.entries,
+        first_at = COALESCE(MIN(first_at, excluded.first_at), first_at, excluded.first_at),
+        last_at = COALESCE(MAX(last_at, excluded.last_at), last_at, excluded.last_at)
+"""
+
+
+@dataclass
+class CompactionResult:
+    entries: int = 0
+    event_ids: list = field(default_factory=list)
+
+
+def archivable_events(cursor, now, retention_days=RETENTION_DAYS):
+    """Ids of closed or cancelled events older than retention_days that still have live logs."""
+    cutoff = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute(
+        """
+        SELECT e.id FROM events e
+        WHERE e.status IN ('CLOSED', 'CANCELLED')
+          AND COALESCE(e.event_start_time, e.created_at) < ?
+          AND EXISTS (SELECT 1 FROM action_logs l WHERE l.event_id = e.id)
+        ORDER BY e.id
+        """,
+        (cutoff,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _prepare_archive(cursor):
+    """Create or widen archive.action_logs to match the live table; return the column list."""
+    cursor.execute("PRAGMA main.table_info(action_logs)")
+    columns = [row[1] for row in cursor.fetchall()]
+    cursor.execute("CREATE TABLE IF NOT EXISTS archive.action_logs (id INTEGER PRIMARY KEY)")
+    cursor.execute("PRAGMA archive.table_info(action_logs)")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column in columns:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE archive.action_logs ADD COLUMN {column}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_action_logs_event ON action_logs (event_id, id)")
+    return columns
+
+
+def _archive_chunk(cursor, event_id, columns):
+    """Move the event's oldest CHUNK_SIZE live entries; return how many moved (0 when done)."""
+    cursor.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM main.action_logs WHERE event_id = ? ORDER BY id LIMIT ?)",
+        (event_id, CHUNK_SIZE)
+    )
+    last_id = cursor.fetchone()[0]
+    if last_id is None:
+        return 0
+    names = ', '.join(columns)
+    # OR IGNORE: a run interrupted between the archive's commit and the live
+    # database's can be repeated without duplicating rows.
+    cursor.execute(
+        f"INSERT OR IGNORE INTO archive.action_logs ({names}) SELECT {names} FROM main.action_logs WHERE event_id = ? AND id <= ?",
+        (event_id, last_id)
+    )
+    # The rollup accumulates, so adding it chunk by chunk gives the same totals
+    cursor.execute(ROLLUP_SQL, (event_id, last_id))
+    cursor.execute("DELETE FROM main.action_logs WHERE event_id = ? AND id <= ?", (event_id, last_id))
+    return cursor.rowcount
+
+
+def archived_entries(event_id, actions, limit=100, archive_path=None):
+    """Newest-first archived log entries of an event with the given actions, payload decoded.
+
+    Opens the archive read-only; an archive that does not exist yet has no entries."""
+    archive_path = archive_path or ARCHIVE_PATH
+    if not os.path.exists(archive_path):
+        return []
+    conn = sqlite3.connect(f"file:{archive_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM action_logs WHERE event_id = ? AND action IN ({', '.join('?' * len(actions))}) "
+            "ORDER BY id DESC LIMIT ?",
+            (event_id, *actions, limit)
+        )
+        return [analytics.decode_payload(row) for row in cursor.fetchall()]
+    except sqlite3.OperationalError:
+        # No action_logs table: nothing was ever archived into this file
+        return []
+    finally:
+        conn.close()
+
+
+def compact(conn, now, retention_days=RETENTION_DAYS, archive_path=None, sleep=time.sleep):
+    """Archive the logs of every eligible event, one short transaction per chunk."""
+    archive_path = archive_path or ARCHIVE_PATH
+    cursor = conn.cursor()
+    result = CompactionResult()
+    event_ids = archivable_events(cursor, now, retention_days)
+    if not event_ids:
+        return result
+    cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    try:
+        columns = _prepare_archive(cursor)
+        conn.commit()
+        for event_id in event_ids:
+            while True:
+                moved = _archive_chunk(cursor, event_id, columns)
+                if moved:
+                    conn.commit()
+                    result.entries += moved
+                    sleep(CHUNK_PAUSE_SECONDS)
+                if moved < CHUNK_SIZE:
+                    break
+            cursor.execute("UPDATE events SET logs_archived_at = ? WHERE id = ?", (now, event_id))
+            conn.commit()
+            result.event_ids.append(event_id)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        cursor.execute("DETACH DATABASE archive")
+    return result
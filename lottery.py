@@ -0,0 +1,220 @@
+"""The registration lottery: who gets a seat and in which order the others wait.
+
+The draw functions only decide; close_registration_job writes the result.
+Pairs are atomic units (both members win or both wait), and every individual,
+paired or not, should win with probability seats / pool size. See TODO.md for
+the derivation and lottery_sim.py for checking it at scale. draw() is the
+original re-rolling version, draw_exact() the current one.
+
+The bot draws through run(), seeded from the OS CSPRNG. The seed, the pool and
+the outcome are kept as an audit record (record()), and replay() re-derives the
+outcome from it, so a disputed draw can be checked after the fact.
+"""
+import functools
+import math
+import random
+import secrets
+from dataclasses import dataclass
+
+# Stage 1 re-rolls before falling back to truncating the pair winners
+MAX_ATTEMPTS = 1000
+
+
+@dataclass
+class Draw:
+    pair_winners: list
+    single_winners: list
+    loser_pairs: list
+    loser_singles: list
+    # Waitlist order: one unit per losing pair or single, head first
+    loser_units: list
+    attempts: int = 0
+    truncated: bool = False
+
+    @property
+    def winners(self):
+        return [member for pair in self.pair_winners for member in pair] + list(self.single_winners)
+
+
+def draw(pairs, singles, seats, rng=random):
+    """Run the stratified lottery over pairs (2-tuples) and singles for `seats` places.
+
+    Stage 1 gives each pair an independent seats/N coin and re-rolls while the
+    pairs would take more than `seats`; after MAX_ATTEMPTS it shuffles the pair
+    winners and keeps seats // 2 of them. Stage 2 fills the remaining seats with
+    a uniform sample of singles. Stage 3 shuffles the losing units into the
+    waitlist order. rng is anything with random(), shuffle() and sample().
+    """
+    pool_size = 2 * len(pairs) + len(singles)
+    winner_indices = []
+    attempts = 0
+    truncated = False
+    if pool_size > 0 and seats > 0:
+        p_win = seats / pool_size
+        while True:
+            attempts += 1
+            winner_indices = [i for i in range(len(pairs)) if rng.random() < p_win]
+            if 2 * len(winner_indices) <= seats:
+                break
+            if attempts >= MAX_ATTEMPTS:
+                rng.shuffle(winner_indices)
+                winner_indices = sorted(winner_indices[: seats // 2])
+                truncated = True
+                break
+
+    return _fill_and_order(pairs, singles, seats, winner_indices, rng, attempts, truncated)
+
+
+def _fill_and_order(pairs, singles, seats, winner_indices, rng, attempts=1, truncated=False):
+    """Stages 2 and 3, shared by every algorithm: singles for the seats the pairs left, then the waitlist shuffle."""
+    seats_left = max(0, seats - 2 * len(winner_indices))
+    single_indices = rng.sample(range(len(singles)), min(seats_left, len(singles))) if singles else []
+
+    won_pairs = set(winner_indices)
+    won_singles = set(single_indices)
+    loser_pairs = [pair for i, pair in enumerate(pairs) if i not in won_pairs]
+    loser_singles = [single for i, single in enumerate(singles) if i not in won_singles]
+    loser_units = [list(pair) for pair in loser_pairs] + [[single] for single in loser_singles]
+    rng.shuffle(loser_units)
+
+    return Draw(
+        pair_winners=[pairs[i] for i in winner_indices],
+        single_winners=[singles[i] for i in single_indices],
+        loser_pairs=loser_pairs,
+        loser_singles=loser_singles,
+        loser_units=loser_units,
+        attempts=attempts,
+        truncated=truncated,
+    )
+
+
+def _log_binomials(pairs, seats):
+    """log C(pairs, k) for k = 0..min(pairs, seats // 2), from the ratio C(k + 1) / C(k)."""
+    logs = [0.0]
+    for k in range(min(pairs, seats // 2)):
+        logs.append(logs[-1] + math.log(pairs - k) - math.log(k + 1))
+    return logs
+
+
+def _pair_count_weights(log_binomials, p):
+    """P(K = k) for K ~ Binomial(pairs, p) conditioned on K <= len(log_binomials) - 1.
+
+    Computed in log space, so large pools neither overflow nor underflow."""
+    top = len(log_binomials) - 1
+    if p <= 0:
+        return [1.0] + [0.0] * top
+    if p >= 1:
+        return [0.0] * top + [1.0]
+    log_odds = math.log(p / (1 - p))
+    logs = [c + k * log_odds for k, c in enumerate(log_binomials)]
+    peak = max(logs)
+    weights = [math.exp(x - peak) for x in logs]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def _rate_gap(pairs, singles, seats, weights):
+    """Pair-member win rate minus single win rate for a distribution of the pair-winner count."""
+    pair_rate = sum(k * w for k, w in enumerate(weights)) / pairs
+    if not singles:
+        return pair_rate - 1.0
+    single_rate = sum(min(singles, seats - 2 * k) * w for k, w in enumerate(weights)) / singles
+    return pair_rate - single_rate
+
+
+@functools.lru_cache(maxsize=64)
+def pair_count_distribution(pairs, singles, seats, iterations=40):
+    """Distribution of the number of winning pairs for draw_exact(), as a tuple of weights.
+
+    A Binomial(pairs, p) count conditioned on the pairs fitting (2K <= seats),
+    with p chosen so pair members and singles win at the same rate. When the
+    condition never binds and singles can always take the remaining seats,
+    p is seats / N and this is exactly Stage 1 of draw(). Otherwise plain
+    conditioning would shortchange pairs, and p is raised (by bisection) to
+    compensate, up to giving pairs every seat they can fit when equal rates
+    are out of reach (e.g. an odd seat no pair can take).
+    """
+    if not pairs or seats <= 0:
+        return (1.0,)
+    log_binomials = _log_binomials(pairs, seats)
+    if 2 * pairs <= seats <= singles:
+        return tuple(_pair_count_weights(log_binomials, seats / (2 * pairs + singles)))
+    low, high = 0.0, 1.0
+    if _rate_gap(pairs, singles, seats, _pair_count_weights(log_binomials, high)) <= 0:
+        return tuple(_pair_count_weights(log_binomials, high))
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        if _rate_gap(pairs, singles, seats, _pair_count_weights(log_binomials, mid)) < 0:
+            low = mid
+        else:
+            high = mid
+    return tuple(_pair_count_weights(log_binomials, (low + high) / 2))
+
+
+def draw_exact(pairs, singles, seats, rng=random):
+    """The stratified lottery without re-rolls: one draw of the pair-winner count, then who.
+
+    The number of winning pairs K comes straight from pair_count_distribution()
+    (one random() against its cumulative weights), the K pairs are a uniform
+    sample, and Stages 2 and 3 are the same as in draw(). Time is linear in
+    the pool size whatever the configuration.
+    """
+    weights = pair_count_distribution(len(pairs), len(singles), seats)
+    u = rng.random()
+    count = 0
+    cumulative = weights[0]
+    while u >= cumulative and count < len(weights) - 1:
+        count += 1
+        cumulative += weights[count]
+    winner_indices = sorted(rng.sample(range(len(pairs)), count))
+    return _fill_and_order(pairs, singles, seats, winner_indices, rng)
+
+
+# Draw functions by the version stored in audit records. Never change one that
+# has shipped: old records must keep replaying to the same result.
+ALGORITHMS = {1: draw, 2: draw_exact}
+ALGORITHM = 2
+
+
+def new_seed():
+    """A fresh 128-bit seed from the OS CSPRNG, as hex."""
+    return secrets.token_hex(16)
+
+
+def canonical_units(units):
+    """Pool units as sorted tuples in sorted order, so the draw ignores how the pool was queried."""
+    return sorted(tuple(sorted(unit)) for unit in units)
+
+
+def run(units, seats, seed, algorithm=ALGORITHM):
+    """Draw `seats` places among pool units: (reg_id,) for a single, (a, b) for a pair.
+
+    The result depends only on the arguments: the same units, seats and seed
+    always give the same winners and waitlist order.
+    """
+    units = canonical_units(units)
+    pairs = [unit for unit in units if len(unit) == 2]
+    singles = [unit[0] for unit in units if len(unit) == 1]
+    return ALGORITHMS[algorithm](pairs, singles, seats, random.Random(seed))
+
+
+def record(units, seats, seed, result, algorithm=ALGORITHM):
+    """JSON-ready audit record of a run(): its inputs and the outcome."""
+    return {
+        'algorithm': algorithm,
+        'seed': seed,
+        'seats': seats,
+        'pool': [list(unit) for unit in canonical_units(units)],
+        'winners': list(result.winners),
+        'waitlist': [list(unit) for unit in result.loser_units],
+    }
+
+
+def replay(audit):
+    """Re-run a recorded draw. Returns (result, matches the recorded outcome)."""
+    result = run(audit['pool'], audit['seats'], audit['seed'], audit.get('algorithm', 1))
+    matches = (
+        list(result.winners) == audit['winners']
+        and [list(unit) for unit in result.loser_units] == audit['waitlist']
+    )
+    return result, matches
@@ -0,0 +1,223 @@
+"""Monte Carlo check of the lottery's fairness and speed over a grid of pool sizes.
+
+Usage:
+    python lottery_sim.py --singles 8 40 --pairs 1 10 --seats 5 20 [--trials 1000000] [--engine numpy|python] [--algorithm 1|2]
+    python lottery_sim.py --bench --singles 8 200 --pairs 10 500 --seats 20 50 --trials 200
+
+For every (singles, pairs, seats) combination it runs `trials` lotteries and
+prints the win rate of pair members and of singles next to the fair rate
+seats / N, the largest per-individual deviation, how many Stage 1 re-rolls and
+truncating fallbacks happened, and the runtime. A "!" marks configurations
+where pair members and singles differ by more than Z_LIMIT standard errors.
+
+The numpy engine is a vectorised re-implementation of the lottery algorithms
+(numpy is not a bot dependency: pip install numpy). The python engine calls
+lottery.ALGORITHMS themselves; it is slow but is the reference the numpy
+engine is checked against. --bench times the algorithms per draw instead.
+"""
+import argparse
+import itertools
+import math
+import random
+import time
+from dataclasses import dataclass
+import lottery
+
+# Trials x pool size per numpy batch, to bound memory (~16 MB per float array)
+BATCH_CELLS = 2_000_000
+Z_LIMIT = 5.0
+
+
+@dataclass
+class SimResult:
+    singles: int
+    pairs: int
+    seats: int
+    trials: int
+    # Wins per individual: pair members first (2i, 2i + 1), then singles
+    wins: list
+    rerolls: int
+    fallbacks: int
+    seconds: float
+
+    @property
+    def pool_size(self):
+        return 2 * self.pairs + self.singles
+
+    @property
+    def fair_rate(self):
+        return min(1.0, self.seats / self.pool_size) if self.pool_size else 0.0
+
+    @property
+    def pair_rate(self):
+        members = 2 * self.pairs
+        return sum(self.wins[:members]) / (members * self.trials) if members else math.nan
+
+    @property
+    def single_rate(self):
+        return sum(self.wins[2 * self.pairs:]) / (self.singles * self.trials) if self.singles else math.nan
+
+    @property
+    def max_deviation(self):
+        return max((abs(w / self.trials - self.fair_rate) for w in self.wins), default=0.0)
+
+    @property
+    def z_score(self):
+        """Pair-member rate minus single rate, in standard errors (0 if either group is empty)."""
+        if not self.pairs or not self.singles:
+            return 0.0
+        p = self.fair_rate
+        # Both members of a pair share one outcome, so a pair counts as one sample
+        variance = p * (1 - p) * (1 / (self.pairs * self.trials) + 1 / (self.singles * self.trials))
+        return (self.pair_rate - self.single_rate) / math.sqrt(variance) if variance else 0.0
+
+
+def simulate_python(singles, pairs, seats, trials, seed=None, algorithm=lottery.ALGORITHM):
+    """Run `trials` lotteries through the given lottery algorithm."""
+    draw = lottery.ALGORITHMS[algorithm]
+    rng = random.Random(seed)
+    pair_units = [(2 * i, 2 * i + 1) for i in range(pairs)]
+    single_units = list(range(2 * pairs, 2 * pairs + singles))
+    wins = [0] * (2 * pairs + singles)
+    rerolls = fallbacks = 0
+    started = time.perf_counter()
+    for _ in range(trials):
+        result = draw(pair_units, single_units, seats, rng)
+        for member in result.winners:
+            wins[member] += 1
+        rerolls += max(0, result.attempts - 1)
+        fallbacks += result.truncated
+    return SimResult(singles, pairs, seats, trials, wins, rerolls, fallbacks, time.perf_counter() - started)
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SystemExit("The numpy engine needs numpy (pip install numpy); use --engine python without it.")
+    return numpy
+
+
+def _keep_smallest(keys, counts):
+    """Boolean mask of the `counts[row]` smallest keys in each row."""
+    ranks = keys.argsort(axis=1).argsort(axis=1)
+    return ranks < counts[:, None]
+
+
+def simulate_numpy(singles, pairs, seats, trials, seed=None, algorithm=lottery.ALGORITHM):
+    """Run `trials` lotteries as batched array operations, same algorithm as lottery.ALGORITHMS[algorithm]."""
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+    pool_size = 2 * pairs + singles
+    pair_wins = np.zeros(pairs, dtype=np.int64)
+    single_wins = np.zeros(singles, dtype=np.int64)
+    rerolls = fallbacks = 0
+    batch = max(1, BATCH_CELLS // max(1, pairs + singles))
+    if algorithm == 2:
+        cumulative = np.cumsum(lottery.pair_count_distribution(pairs, singles, seats))
+    started = time.perf_counter()
+    done = 0
+    while done < trials:
+        size = min(batch, trials - done)
+        done += size
+
+        won = np.zeros((size, pairs), dtype=bool)
+        if pool_size and seats > 0 and pairs and algorithm == 1:
+            # Stage 1: independent seats/N coins, re-rolling only the rows that overflowed
+            p_win = seats / pool_size
+            won = rng.random((size, pairs)) < p_win
+            pending = np.flatnonzero(2 * won.sum(axis=1) > seats)
+            attempts = 1
+            while pending.size and attempts < lottery.MAX_ATTEMPTS:
+                attempts += 1
+                rerolls += pending.size
+                won[pending] = rng.random((pending.size, pairs)) < p_win
+                pending = pending[2 * won[pending].sum(axis=1) > seats]
+            if pending.size:
+                # Fallback: a uniform seats // 2 of each row's pair winners
+                fallbacks += pending.size
+                keys = rng.random((pending.size, pairs))
+                keys[~won[pending]] = 2.0
+                won[pending] = _keep_smallest(keys, np.full(pending.size, seats // 2))
+        elif pairs and algorithm == 2:
+            # Stage 1: the pair-winner count from its distribution, then a uniform set of that size
+            counts = np.minimum(np.searchsorted(cumulative, rng.random(size), side='right'), len(cumulative) - 1)
+            won = _keep_smallest(rng.random((size, pairs)), counts)
+        pair_wins += won.sum(axis=0)
+
+        # Stage 2: a uniform sample of singles for the seats left
+        if singles:
+            seats_left = np.maximum(0, seats - 2 * won.sum(axis=1))
+            single_wins += _keep_smallest(rng.random((size, singles)), seats_left).sum(axis=0)
+
+    wins = np.repeat(pair_wins, 2).tolist() + single_wins.tolist()
+    return SimResult(singles, pairs, seats, trials, wins, rerolls, fallbacks, time.perf_counter() - started)
+
+
+def benchmark(singles, pairs, seats, draws, seed=None):
+    """Seconds per draw of each lottery algorithm on one pool, as the bot runs it (pure Python)."""
+    pair_units = [(2 * i, 2 * i + 1) for i in range(pairs)]
+    single_units = list(range(2 * pairs, 2 * pairs + singles))
+    timings = {}
+    for algorithm, draw in sorted(lottery.ALGORITHMS.items()):
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        for _ in range(draws):
+            # The bot draws once per event, so no draw gets a cached distribution
+            lottery.pair_count_distribution.cache_clear()
+            draw(pair_units, single_units, seats, rng)
+        timings[algorithm] = (time.perf_counter() - started) / draws
+    return timings
+
+
+ENGINES = {'numpy': simulate_numpy, 'python': simulate_python}
+
+
+def run_grid(singles, pairs, seats, trials, engine='numpy', seed=None, algorithm=lottery.ALGORITHM):
+    simulate = ENGINES[engine]
+    return [
+        simulate(s, p, m, trials, seed, algorithm)
+        for s, p, m in itertools.product(singles, pairs, seats)
+        if 2 * p + s > 0
+    ]
+
+
+def format_result(r):
+    flag = "!" if abs(r.z_score) > Z_LIMIT else " "
+    return (
+        f"{flag} N={r.pool_size:<5} singles={r.singles:<5} pairs={r.pairs:<4} seats={r.seats:<5} "
+        f"fair {r.fair_rate:.4f}  pair {r.pair_rate:.4f}  single {r.single_rate:.4f}  z {r.z_score:+6.1f}  "
+        f"max dev {r.max_deviation:.4f}  rerolls/trial {r.rerolls / r.trials:.3f}  fallbacks {r.fallbacks}  "
+        f"{r.seconds:.2f}s ({r.trials / r.seconds if r.seconds else 0:,.0f}/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the registration lottery and report per-individual win rates")
+    parser.add_argument("--singles", type=int, nargs="+", default=[8, 40, 200])
+    parser.add_argument("--pairs", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--seats", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--trials", type=int, default=1_000_000)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="numpy")
+    parser.add_argument("--algorithm", type=int, choices=sorted(lottery.ALGORITHMS), default=lottery.ALGORITHM)
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible run")
+    parser.add_argument("--bench", action="store_true",
+                        help="Time every algorithm per draw instead (--trials draws per configuration)")
+    args = parser.parse_args()
+
+    if args.bench:
+        for s, p, m in itertools.product(args.singles, args.pairs, args.seats):
+            timings = benchmark(s, p, m, args.trials, args.seed)
+            per_draw = "  ".join(f"v{a} {t * 1000:8.3f} ms" for a, t in timings.items())
+            print(f"N={2 * p + s:<5} singles={s:<5} pairs={p:<4} seats={m:<5} {per_draw}")
+        return
+
+    results = run_grid(args.singles, args.pairs, args.seats, args.trials, args.engine, args.seed, args.algorithm)
+    for r in results:
+        print(format_result(r))
+    unfair = sum(abs(r.z_score) > Z_LIMIT for r in results)
+    print(f"{len(results)} configurations, {unfair} where pair members and singles differ by more than {Z_LIMIT} SE")
+
+
+if __name__ == '__main__':
+    main()
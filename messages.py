@@ -59,7 +59,9 @@ REGISTRATION_CLOSED_MANUAL = "Регистрация закрыта вручну
 REGISTRATION_CLOSED_NO_REG = "Регистрация закрыта. Никто не пришел :("
 REGISTRATION_CLOSED_SUMMARY = "Регистрация закрыта! {winners} человек получили места. {waitlist} — в листе ожидания."
 LOTTERY_READY_FOR_REVIEW = "Лотерея проведена! Результаты готовы к проверке. Используй /send_invites для рассылки уведомлений."
+LOTTERY_WRITE_FAILED = "⚠️ Результаты лотереи не сохранились в базе так, как выпали, поэтому ничего не записано и регистрация всё ещё открыта. Бот попробует закрыть её снова в {retry_time}; проверь логи или запусти /close раньше."
 SEND_INVITES_SUCCESS = "Уведомления отправлены! Регистрация официально закрыта."
+BROADCAST_PROGRESS = "Рассылка идёт: отправлено {done} из {total}, осталось примерно {eta} сек."
 
 REGISTER_SUCCESS_LOTTERY = "Записал тебя! Маякнем здесь, как пройдет лотерея.\n\nℹ️ Имей в виду: имена всех, кто будет на конфе, видны другим через команду /who."
 REGISTER_SUCCESS_PUBLIC = "@{username} в игре!"
@@ -155,11 +157,27 @@ DESC_OPEN = "Открыть регистрацию (админ)"
 DESC_CLOSE = "Закрыть регистрацию (админ)"
 DESC_SEND_INVITES = "Разослать приглашения после лотереи (админ)"
 DESC_RESET = "Сбросить все регистрации (админ)"
+DESC_COMPACT = "Архивировать логи прошедших событий (админ)"
+DESC_REPLAY_LOTTERY = "Перепроверить результат лотереи по сохранённому сиду (админ)"
 
 RESET_CONFIRMATION = "⚠️ Ты уверен, что хочешь сбросить ВСЕ регистрации для этого события? Это действие необратимо. Напиши `/reset confirm` для подтверждения."
 RESET_SUCCESS = "✅ Все регистрации сброшены. Статистика очищена."
 ONLY_ADMIN_RESET = "Сбросить регистрации может только админ."
 
+# Log retention
+ONLY_ADMIN_COMPACT = "Архивировать логи может только админ."
+USAGE_COMPACT = "Используй так: /compact или /compact <дней хранения>"
+COMPACT_NOTHING = "Архивировать нечего: логов закрытых событий старше {days} дн. нет."
+COMPACT_DONE = "🗄 Перенесено в архив: {entries} записей логов, событий: {events}."
+COMPACT_FAILED = "⚠️ Не удалось заархивировать логи: {error}"
+
+# Lottery replay
+ONLY_ADMIN_REPLAY_LOTTERY = "Перепроверять лотерею может только админ."
+USAGE_REPLAY_LOTTERY = "Используй так: /replay_lottery или /replay_lottery <номер события>"
+REPLAY_LOTTERY_NO_RECORD = "Для события #{event_id} нет записи о жеребьёвке с сидом."
+REPLAY_LOTTERY_MATCH = "✅ Лотерея события #{event_id} воспроизведена по сиду {seed}: те же {winners} победителей и тот же порядок вейтлиста ({waitlist} чел.)."
+REPLAY_LOTTERY_MISMATCH = "⚠️ Лотерея события #{event_id} по сиду {seed} даёт другой результат, чем записан в логах. Проверь логи и базу."
+
 # Pairing
 USAGE_PAIR = "Используй так: /pair @юзернейм"
 PAIR_INVALID_USERNAME = "Не могу разобрать юзернейм. Попробуй так: /pair @ejania"
@@ -216,7 +234,9 @@ UNKNOWN_COMMAND_ADMIN = (
     "/close — закрыть регистрацию досрочно\n"
     "/review — разослать инвайты победителям лотереи\n"
     "/stats — статистика участников\n"
-    "/reset — сбросить событие"
+    "/reset — сбросить событие\n"
+    "/compact — архивировать логи прошедших событий\n"
+    "/replay_lottery — перепроверить результат лотереи"
 )
 
 # Reminders
@@ -1,11 +1,68 @@
 import sqlite3
 import os
+import threading
 from datetime import datetime
 
 DB_PATH = os.getenv("DB_PATH", "bot_data.db")
 
+# Connection pool settings. Idle connections are kept per process and reused, so
+# their prepared-statement caches stay warm between handler calls.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_SECONDS = 5
+STATEMENT_CACHE_SIZE = 256
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+def _connect(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_SECONDS,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    # WAL lets the dashboard read while the bot writes; NORMAL is durable across
+    # application crashes and only skips the per-commit fsync of the WAL.
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+class PooledConnection:
+    """A pooled sqlite3 connection. close() rolls back anything left uncommitted
+    and hands the connection back to the pool instead of closing it."""
+
+    def __init__(self, conn, path):
+        self._conn = conn
+        self._path = path
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            idle = _pool.setdefault(self._path, [])
+            if len(idle) < POOL_SIZE:
+                idle.append(conn)
+                return
+        conn.close()
+
+def close_pool():
+    """Close all idle pooled connections (e.g. on shutdown)."""
+    with _pool_lock:
+        conns = [c for idle in _pool.values() for c in idle]
+        _pool.clear()
+    for conn in conns:
+        conn.close()
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect(DB_PATH)
     cursor = conn.cursor()
     
     # Event table: only one active event at a time for simplicity
@@ -70,46 +127,204 @@ def init_db():
         )
     ''')
     
-    # Simple migration for existing DBs
-    try:
-        cursor.execute("ALTER TABLE registrations ADD COLUMN guest_of_user_id INTEGER")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE events ADD COLUMN registration_duration_hours INTEGER")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE events ADD COLUMN event_start_time DATETIME")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE speakers ADD COLUMN first_name TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE action_logs ADD COLUMN first_name TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE registrations ADD COLUMN invite_token TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        cursor.execute("ALTER TABLE registrations ADD COLUMN partner_reg_id INTEGER")
-    except sqlite3.OperationalError:
-        pass
+    _run_migrations(cursor)
 
     conn.commit()
     conn.close()
 
+def _ensure_column(cursor, table, column, decl):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migration_legacy_columns(cursor):
+    # Columns added over time before migrations were versioned.
+    _ensure_column(cursor, "registrations", "guest_of_user_id", "INTEGER")
+    _ensure_column(cursor, "events", "registration_duration_hours", "INTEGER")
+    _ensure_column(cursor, "events", "event_start_time", "DATETIME")
+    _ensure_column(cursor, "speakers", "first_name", "TEXT")
+    _ensure_column(cursor, "action_logs", "first_name", "TEXT")
+    _ensure_column(cursor, "registrations", "invite_token", "TEXT")
+    _ensure_column(cursor, "registrations", "partner_reg_id", "INTEGER")
+
+def _migration_hot_path_indexes(cursor):
+    # One index per access pattern used by the handlers and the dashboard.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_created_at ON events (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_event_status ON registrations (event_id, status, priority)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_event_user ON registrations (event_id, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_event_username ON registrations (event_id, LOWER(username))")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_event_guest_of ON registrations (event_id, guest_of_user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_invite_token ON registrations (invite_token) WHERE invite_token IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_invited ON registrations (expires_at) WHERE status = 'INVITED'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_speakers_event_username ON speakers (event_id, username)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_action_logs_event ON action_logs (event_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_action_logs_user ON action_logs (user_id, id)")
+
+def create_outbox_table(cursor):
+    # Bulk notifications are queued here before sending, so an interrupted
+    # broadcast can be resumed after a restart instead of silently dropped.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            broadcast TEXT,
+            chat_id INTEGER,
+            username TEXT,
+            text TEXT,
+            reg_id INTEGER,
+            status TEXT DEFAULT 'PENDING', -- PENDING, SENT, FAILED
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)")
+
+def _migration_speakers_mirror(cursor):
+    # speakers is kept in sync with the speakers group by chat_member updates;
+    # user_id lets leaves be matched for members without a username, and
+    # speakers_synced_at marks events whose list came from a complete import.
+    _ensure_column(cursor, "speakers", "user_id", "INTEGER")
+    _ensure_column(cursor, "events", "speakers_synced_at", "DATETIME")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_speakers_event_user ON speakers (event_id, user_id)")
+
+def _migration_speakers_unique(cursor):
+    # The speaker importer upserts with ON CONFLICT (event_id, username), which needs
+    # a unique key; drop duplicates left by earlier imports first.
+    cursor.execute(
+        "DELETE FROM speakers WHERE username IS NOT NULL AND id NOT IN "
+        "(SELECT MIN(id) FROM speakers WHERE username IS NOT NULL GROUP BY event_id, username)"
+    )
+    cursor.execute("DROP INDEX IF EXISTS idx_speakers_event_username")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_speakers_event_username ON speakers (event_id, username)")
+
+# Status each logged transition ends in, for backfilling rows written before
+# action_logs had structured columns.
+_LEGACY_TRANSITIONS = {
+    'UNREGISTER': 'UNREGISTERED',
+    'CALLBACK_DECLINE': 'UNREGISTERED',
+    'CALLBACK_ACCEPT': 'ACCEPTED',
+    'EXPIRE_INVITE': 'EXPIRED',
+    'INVITE_NEXT': 'INVITED',
+    'PROMOTE_REVIEW': 'ACCEPTED',
+}
+
+def _migration_structured_action_logs(cursor):
+    # Typed columns so timelines, funnels and status changes are index lookups
+    # (see analytics.py) instead of parsing details; payload holds JSON.
+    _ensure_column(cursor, "action_logs", "reg_id", "INTEGER")
+    _ensure_column(cursor, "action_logs", "old_status", "TEXT")
+    _ensure_column(cursor, "action_logs", "new_status", "TEXT")
+    _ensure_column(cursor, "action_logs", "count", "INTEGER")
+    _ensure_column(cursor, "action_logs", "payload", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_action_logs_event_action ON action_logs (event_id, action, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_action_logs_reg ON action_logs (reg_id, id) WHERE reg_id IS NOT NULL")
+
+    # Backfill status changes, linking a row to a registration only when the user
+    # has exactly one in that event (guests of the same user would be ambiguous).
+    for action, new_status in _LEGACY_TRANSITIONS.items():
+        cursor.execute(
+            """
+            UPDATE action_logs SET new_status = ?, reg_id = (
+                SELECT MIN(r.id) FROM registrations r
+                WHERE r.event_id = action_logs.event_id AND r.user_id = action_logs.user_id
+                HAVING COUNT(*) = 1
+            )
+            WHERE action = ? AND new_status IS NULL
+            """,
+            (new_status, action)
+        )
+    cursor.execute(
+        """
+        UPDATE action_logs SET new_status = SUBSTR(details, 9), reg_id = (
+            SELECT MIN(r.id) FROM registrations r
+            WHERE r.event_id = action_logs.event_id AND r.user_id = action_logs.user_id
+            HAVING COUNT(*) = 1
+        )
+        WHERE action = 'REGISTER' AND details LIKE 'Status: %' AND new_status IS NULL
+        """
+    )
+
+def _migration_action_log_rollup(cursor):
+    # Per-event, per-action summary left behind when log_archive moves an event's
+    # action_logs out of the live database; logs_archived_at marks such events.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS action_log_rollup (
+            event_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            entries INTEGER NOT NULL,
+            first_at DATETIME,
+            last_at DATETIME,
+            PRIMARY KEY (event_id, action)
+        )
+    ''')
+    _ensure_column(cursor, "events", "logs_archived_at", "DATETIME")
+
+def _migration_registrations_paging(cursor):
+    # Keyset paging of one status's registrations by id (web.py's JSON API).
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_registrations_event_status_id ON registrations (event_id, status, id)")
+
+def _migration_lottery_seed(cursor):
+    # Seed of the event's lottery draw (lottery.run), for replaying it later.
+    _ensure_column(cursor, "events", "lottery_seed", "TEXT")
+
+def _migration_outbox_dedupe(cursor):
+    # broadcast.send_bulk skips chats already queued or sent under the same label.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_broadcast_chat ON outbox (broadcast, chat_id, status)")
+
+def _migration_lottery_audit(cursor):
+    # The draw's audit record (lottery.record) as JSON, written with the results,
+    # so /replay_lottery never depends on action_logs surviving or staying live.
+    _ensure_column(cursor, "events", "lottery_audit", "TEXT")
+
+def _migration_events_version(cursor):
+    # A counter bumped by triggers on every change to events, whichever process
+    # makes it (bot, dashboard, import_speakers.py), so the bot's EventCache can
+    # tell from one single-row read whether its copy of the event is stale.
+    cursor.execute("CREATE TABLE IF NOT EXISTS events_version (version INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO events_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM events_version)")
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS events_version_{operation.lower()} AFTER {operation} ON events "
+            "BEGIN UPDATE events_version SET version = version + 1; END"
+        )
+
+# Ordered (version, migration) pairs. Append new migrations at the end; never
+# edit or reorder one that has shipped.
+MIGRATIONS = [
+    (1, _migration_legacy_columns),
+    (2, _migration_hot_path_indexes),
+    (3, create_outbox_table),
+    (4, _migration_speakers_mirror),
+    (5, _migration_speakers_unique),
+    (6, _migration_structured_action_logs),
+    (7, _migration_action_log_rollup),
+    (8, _migration_registrations_paging),
+    (9, _migration_lottery_seed),
+    (10, _migration_outbox_dedupe),
+    (11, _migration_lottery_audit),
+    (12, _migration_events_version),
+]
+
+def _run_migrations(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    cursor.execute("SELECT version FROM schema_version")
+    row = cursor.fetchone()
+    current = row[0] if row else 0
+    if row is None:
+        cursor.execute("INSERT INTO schema_version (version) VALUES (0)")
+
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        migration(cursor)
+        cursor.execute("UPDATE schema_version SET version = ?", (version,))
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    path = DB_PATH
+    with _pool_lock:
+        idle = _pool.get(path)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _connect(path)
+    return PooledConnection(conn, path)
@@ -0,0 +1,105 @@
+"""Replay recorded Telegram updates into the bot's webhook listener and report throughput.
+
+Usage:
+    python replay_updates.py updates.jsonl [--url http://127.0.0.1:8443/telegram] [--concurrency 40]
+
+updates.jsonl holds one Update JSON object per line, e.g. the "result" entries of a
+getUpdates response. The secret token is read from WEBHOOK_SECRET, as in bot.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from dotenv import load_dotenv
+import httpx
+
+load_dotenv()
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path):
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                updates.append(json.loads(line))
+    return updates
+
+
+def renumber(updates, start=1):
+    """Give updates fresh increasing update_ids so one recording can be replayed repeatedly."""
+    return [{**update, "update_id": start + i} for i, update in enumerate(updates)]
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def replay(updates, url, secret, concurrency=40, client=None):
+    """POST every update to url with at most `concurrency` in flight. Returns a stats dict."""
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(timeout=30)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def post(update):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=update, headers={SECRET_HEADER: secret or ""})
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(post(update) for update in updates))
+    finally:
+        if own_client:
+            await client.aclose()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates": len(updates),
+        "errors": errors,
+        "seconds": elapsed,
+        "per_second": len(updates) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    default_url = f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8443')}/{os.getenv('WEBHOOK_PATH', 'telegram')}"
+    parser = argparse.ArgumentParser(description="Replay recorded updates into the webhook listener")
+    parser.add_argument("path", help="JSONL file with one Update per line")
+    parser.add_argument("--url", default=default_url)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the recording this many times")
+    args = parser.parse_args()
+
+    recorded = load_updates(args.path)
+    updates = renumber(recorded * args.repeat, start=int(time.time()))
+    stats = asyncio.run(replay(updates, args.url, os.getenv("WEBHOOK_SECRET"), args.concurrency))
+    print(
+        f"{stats['updates']} updates in {stats['seconds']:.2f}s ({stats['per_second']:.1f}/s), "
+        f"{stats['errors']} errors; latency p50 {stats['p50_ms']:.1f} ms, "
+        f"p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Import the members of a speakers group into the speakers table via a Telethon userbot.
+
+The bot uses SpeakerImporter, which keeps one logged-in client on its own thread
+and event loop (Telethon and python-telegram-bot must not share a loop), so
+repeated imports skip interpreter and client startup. import_speakers.py is the
+command-line entry point, used for the one-time interactive login over SSH.
+"""
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from models import get_db, DB_PATH
+
+API_ID = int(os.getenv('TELEGRAM_API_ID', 0))
+API_HASH = os.getenv('TELEGRAM_API_HASH', '')
+# Kept next to the database so it lives on the same persistent volume
+SESSION_PATH = os.getenv('TELETHON_SESSION', os.path.join(os.path.dirname(DB_PATH) or '.', 'userbot_session'))
+
+BATCH_SIZE = 500
+PROGRESS_EVERY = 2000
+
+UPSERT_SQL = (
+    "INSERT INTO speakers (event_id, username, first_name, user_id) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (event_id, username) DO UPDATE SET first_name = excluded.first_name, user_id = excluded.user_id"
+)
+
+
+class ImportNotConfigured(Exception):
+    pass
+
+
+@dataclass
+class ImportResult:
+    imported: int
+    skipped_bots: int
+
+
+def speaker_row(event_id, user):
+    # Lowercased username for matching; members without one are stored by id
+    identifier = user.username.lower() if user.username else str(user.id)
+    return (event_id, identifier, user.first_name, user.id)
+
+
+async def import_participants(conn, event_id, participants, progress=None, mark_synced=True):
+    """Upsert an async iterable of Telethon users into speakers in batches of BATCH_SIZE.
+
+    progress(count) is called roughly every PROGRESS_EVERY members. With mark_synced,
+    once every member has been written, rows of members who have left the group are
+    removed and the event's speaker list is marked as synced. Pass False when the
+    bot does not administer the group: without chat_member updates the mirror
+    would go stale, so the bot must keep asking Telegram."""
+    cursor = conn.cursor()
+    batch = []
+    member_ids = set()
+    imported = 0
+    skipped_bots = 0
+    next_progress = PROGRESS_EVERY
+    async for user in participants:
+        if user.bot:
+            skipped_bots += 1
+            continue
+        batch.append(speaker_row(event_id, user))
+        member_ids.add(user.id)
+        if len(batch) >= BATCH_SIZE:
+            cursor.executemany(UPSERT_SQL, batch)
+            conn.commit()
+            imported += len(batch)
+            batch = []
+            if progress and imported >= next_progress:
+                progress(imported)
+                next_progress += PROGRESS_EVERY
+    if batch:
+        cursor.executemany(UPSERT_SQL, batch)
+        imported += len(batch)
+    if mark_synced:
+        # Rows added by hand have no user_id and stay
+        cursor.execute("SELECT id, user_id FROM speakers WHERE event_id = ? AND user_id IS NOT NULL", (event_id,))
+        gone = [(row[0],) for row in cursor.fetchall() if row[1] not in member_ids]
+        cursor.executemany("DELETE FROM speakers WHERE id = ?", gone)
+        cursor.execute(
+            "UPDATE events SET speakers_synced_at = ? WHERE id = ?",
+            (datetime.now(ZoneInfo("UTC")), event_id)
+        )
+    conn.commit()
+    return ImportResult(imported=imported, skipped_bots=skipped_bots)
+
+
+def _group_peer(group_id):
+    group_id = str(group_id)
+    return int(group_id) if group_id.lstrip('-').isdigit() else group_id
+
+
+async def bot_is_admin(client, entity, bot_user_id):
+    """True if the bot administers the group, checked through the userbot."""
+    try:
+        permissions = await client.get_permissions(entity, bot_user_id)
+    except Exception as e:
+        logging.error(f"Could not check the bot's rights in the speakers group: {e}")
+        return False
+    return permissions.is_admin
+
+
+async def import_group(client, group_id, event_id, progress=None, mark_synced=True, bot_user_id=None):
+    """Import the group's members. Given bot_user_id, the list is only marked synced
+    if that bot administers the group."""
+    entity = await client.get_entity(_group_peer(group_id))
+    if mark_synced and bot_user_id is not None and not await bot_is_admin(client, entity, bot_user_id):
+        logging.warning(f"The bot is not an admin of {group_id}: speakers will keep being checked with Telegram")
+        mark_synced = False
+    conn = get_db()
+    try:
+        return await import_participants(conn, event_id, client.iter_participants(entity), progress, mark_synced)
+    finally:
+        conn.close()
+
+
+def _new_client():
+    from telethon import TelegramClient
+    return TelegramClient(SESSION_PATH, API_ID, API_HASH)
+
+
+class SpeakerImporter:
+    """Long-lived importer running a logged-in Telethon client on a dedicated thread."""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="speaker-import", daemon=True)
+            self._thread.start()
+
+    async def _connect(self):
+        if self._client is None:
+            self._client = _new_client()
+        if not self._client.is_connected():
+            await self._client.connect()
+        if not await self._client.is_user_authorized():
+            raise ImportNotConfigured("userbot session is not logged in; run import_speakers.py once over SSH")
+        return self._client
+
+    async def _run(self, group_id, event_id, progress, mark_synced):
+        client = await self._connect()
+        return await import_group(client, group_id, event_id, progress, mark_synced)
+
+    async def run(self, group_id, event_id, progress=None, mark_synced=True):
+        """Import group_id's members into event_id from the caller's loop.
+
+        progress(count) is called on the importer thread."""
+        if not API_ID or not API_HASH:
+            raise ImportNotConfigured("TELEGRAM_API_ID / TELEGRAM_API_HASH are not set")
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._run(group_id, event_id, progress, mark_synced), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            if self._client is not None:
+                asyncio.run_coroutine_threadsafe(self._client.disconnect(), self._loop).result(timeout=10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+            self._loop.close()
+            self._thread = self._loop = self._client = None
+            logging.info("Speaker importer stopped")
@@ -0,0 +1,123 @@
+"""
+ActionLogWriter: write-behind batching of action_logs inserts.
+
+Real-conference risk: every log_action used to cost its own commit, so a burst
+of /register commands spent most of its time fsyncing audit rows. Batching
+must not lose entries: lifecycle events are written at once, and whatever is
+queued at shutdown is flushed.
+"""
+import asyncio
+import unittest
+import sqlite3
+from unittest.mock import patch
+import bot
+from bot import ActionLogWriter, log_action
+
+
+class MockConnection:
+    def __init__(self, real_conn, commits):
+        self.real_conn = real_conn
+        self.commits = commits
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.commits.append(1)
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    conn.cursor().execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        reg_id INTEGER, old_status TEXT, new_status TEXT, count INTEGER, payload TEXT
+    )''')
+    conn.commit()
+
+
+class TestActionLogWriter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        _setup_schema(self.real_conn)
+        self.commits = []
+
+        self.writer = ActionLogWriter()
+        for target, value in [
+            ('bot.get_db', lambda: MockConnection(self.real_conn, self.commits)),
+            ('bot.action_log_writer', self.writer),
+            ('bot.LOG_FLUSH_INTERVAL_SECONDS', 0.05),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.writer.stop()
+        self.real_conn.close()
+
+    def _actions(self):
+        return [r[0] for r in self.real_conn.execute("SELECT action FROM action_logs ORDER BY id").fetchall()]
+
+    async def test_synchronous_until_started(self):
+        log_action(1, 2, "u", "U", 'REGISTER', 'x')
+        self.assertEqual(self._actions(), ['REGISTER'])
+
+    async def test_entries_are_batched_into_one_commit(self):
+        self.writer.start()
+        for i in range(10):
+            log_action(1, i, "u", "U", 'PROMOTE_REVIEW', '')
+        self.assertEqual(self._actions(), [])
+
+        await asyncio.sleep(0.15)
+
+        self.assertEqual(len(self._actions()), 10)
+        self.assertEqual(len(self.commits), 1)
+
+    async def test_full_queue_flushes_early(self):
+        with patch('bot.LOG_FLUSH_INTERVAL_SECONDS', 60), patch('bot.LOG_FLUSH_MAX_ENTRIES', 3):
+            self.writer.start()
+            for i in range(3):
+                log_action(1, i, "u", "U", 'REGISTER', '')
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self._actions()), 3)
+
+    async def test_critical_actions_written_immediately(self):
+        self.writer.start()
+        log_action(1, 2, "u", "U", 'REGISTER', '')
+        log_action(1, 2, "u", "U", 'CLOSE_REGISTRATION', '')
+        self.assertEqual(self._actions(), ['REGISTER', 'CLOSE_REGISTRATION'])
+
+    async def test_stop_flushes_queue(self):
+        self.writer.start()
+        log_action(1, 2, "u", "U", 'UNREGISTER', '')
+        await self.writer.stop()
+        self.assertEqual(self._actions(), ['UNREGISTER'])
+        self.assertFalse(self.writer.running)
+
+    async def test_failed_flush_keeps_entries(self):
+        self.writer.start()
+        log_action(1, 2, "u", "U", 'REGISTER', '')
+        with patch('bot.get_db', side_effect=sqlite3.OperationalError("database is locked")):
+            self.writer.flush()
+        self.writer.flush()
+        self.assertEqual(self._actions(), ['REGISTER'])
+
+    async def test_timestamp_taken_when_logged(self):
+        self.writer.start()
+        logged_at = bot.datetime(2026, 5, 1, 12, 0, 0)
+        with patch('bot.datetime') as mock_dt:
+            mock_dt.now.return_value = logged_at
+            log_action(1, 2, "u", "U", 'REGISTER', '')
+        self.writer.flush()
+        stamp = self.real_conn.execute("SELECT timestamp FROM action_logs").fetchone()[0]
+        self.assertEqual(stamp, "2026-05-01 12:00:00")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Structured action_logs: typed columns written by log_action and read by analytics.
+
+Real-conference risk: the dashboard found out when someone left by matching
+user_id and action names in free-text logs, so a guest of the same user or a
+renamed action gave the wrong time (expired invites never showed one at all).
+Status changes must carry their registration id and be queryable without
+parsing details.
+"""
+import unittest
+import sqlite3
+from unittest.mock import patch
+import analytics
+from bot import ActionLogWriter, log_action
+
+LEGACY_LOGS = '''CREATE TABLE action_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER, user_id INTEGER, username TEXT,
+    first_name TEXT, action TEXT, details TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+)'''
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute(LEGACY_LOGS)
+    for column, decl in [('reg_id', 'INTEGER'), ('old_status', 'TEXT'), ('new_status', 'TEXT'),
+                         ('count', 'INTEGER'), ('payload', 'TEXT')]:
+        cursor.execute(f"ALTER TABLE action_logs ADD COLUMN {column} {decl}")
+    cursor.execute("CREATE TABLE action_log_rollup (event_id INTEGER, action TEXT, entries INTEGER, first_at DATETIME, last_at DATETIME)")
+    cursor.execute('''CREATE TABLE registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT, status TEXT
+    )''')
+    conn.commit()
+
+
+class TestStructuredLogging(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+        for target, value in [
+            ('bot.get_db', lambda: MockConnection(self.real_conn)),
+            ('bot.action_log_writer', ActionLogWriter()),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def test_structured_fields_are_stored(self):
+        log_action(1, 2, "u", "U", 'UNREGISTER', 'Old status: ACCEPTED',
+                   reg_id=5, old_status='ACCEPTED', new_status='UNREGISTERED')
+        log_action(1, None, "System", None, 'LOTTERY_COMPLETE', 'Winners: 3', count=3, payload={'winners': 3, 'waitlist': 1})
+
+        timeline = analytics.event_timeline(self.real_conn.cursor(), 1)
+        self.assertEqual(timeline[0]['payload'], {'winners': 3, 'waitlist': 1})
+        self.assertEqual(timeline[0]['count'], 3)
+        self.assertEqual(
+            (timeline[1]['reg_id'], timeline[1]['old_status'], timeline[1]['new_status']),
+            (5, 'ACCEPTED', 'UNREGISTERED')
+        )
+
+    async def test_batched_writer_stores_structured_fields(self):
+        writer = ActionLogWriter()
+        with patch('bot.action_log_writer', writer):
+            writer.start()
+            log_action(1, 2, "u", "U", 'CALLBACK_ACCEPT', '', reg_id=7, old_status='INVITED', new_status='ACCEPTED')
+            await writer.stop()
+        self.assertEqual(
+            analytics.status_transitions(self.real_conn.cursor(), 1),
+            {('INVITED', 'ACCEPTED'): 1}
+        )
+
+
+class TestAnalyticsQueries(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        _setup_schema(self.conn)
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _log(self, event_id, user_id, action, timestamp="2026-05-01 10:00:00", **fields):
+        columns = ['event_id', 'user_id', 'action', 'timestamp', *fields]
+        self.cursor.execute(
+            f"INSERT INTO action_logs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            (event_id, user_id, action, timestamp, *fields.values())
+        )
+
+    def test_funnel_and_timeline_filters(self):
+        for action in ['REGISTER', 'REGISTER', 'UNREGISTER', 'REGISTER_FAIL']:
+            self._log(1, 2, action)
+        self._log(2, 2, 'REGISTER')
+
+        self.assertEqual(analytics.funnel_counts(self.cursor, 1), {'REGISTER': 2, 'UNREGISTER': 1, 'REGISTER_FAIL': 1})
+        timeline = analytics.event_timeline(self.cursor, 1, actions=['REGISTER'], limit=1)
+        self.assertEqual([e['id'] for e in timeline], [2])
+        older = analytics.event_timeline(self.cursor, 1, actions=['REGISTER'], before_id=timeline[-1]['id'])
+        self.assertEqual([e['id'] for e in older], [1])
+
+    def test_user_history(self):
+        self._log(1, 2, 'REGISTER')
+        self._log(1, 3, 'REGISTER')
+        self._log(2, 2, 'UNREGISTER')
+        self.assertEqual([e['action'] for e in analytics.user_history(self.cursor, 2)], ['UNREGISTER', 'REGISTER'])
+        self.assertEqual([e['action'] for e in analytics.user_history(self.cursor, 2, event_id=1)], ['REGISTER'])
+
+    def test_unregistered_time_follows_the_registration_not_the_user(self):
+        # A speaker's guest shares nothing with the speaker's own log entries
+        self.cursor.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (1, 2, 'UNREGISTERED')")
+        self.cursor.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (1, 3, 'EXPIRED')")
+        self._log(1, 2, 'UNREGISTER', "2026-05-01 09:00:00", reg_id=1, new_status='UNREGISTERED')
+        self._log(1, 2, 'INVITE_GUEST', "2026-05-01 11:00:00")
+        self._log(1, 3, 'EXPIRE_INVITE', "2026-05-01 12:00:00", reg_id=2, new_status='EXPIRED')
+
+        rows = analytics.unregistered_with_times(self.cursor, 1)
+
+        self.assertEqual([(r['id'], r['unreg_time']) for r in rows], [(2, "2026-05-01 12:00:00"), (1, "2026-05-01 09:00:00")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+"""
+broadcast: outbox-backed, rate-limited bulk sends.
+
+Real-conference risk: announcing lottery results to ~1,500 people trips
+Telegram flood control halfway through, and everyone after that point never
+learns whether they got a seat. Flood limits and network blips must be
+retried, and a send interrupted by a restart must resume from the outbox.
+"""
+import unittest
+import sqlite3
+from unittest.mock import patch, AsyncMock
+from telegram.error import BadRequest, RetryAfter, TimedOut, Forbidden
+import broadcast
+from broadcast import Recipient, SendLimiter, TokenBucket, send_bulk, resume_outbox
+from models import create_outbox_table, _migration_outbox_dedupe
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        status TEXT, notified_at DATETIME
+    )''')
+    create_outbox_table(cursor)
+    _migration_outbox_dedupe(cursor)
+    conn.commit()
+
+
+class TestBroadcast(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+        self.conn = MockConnection(self.real_conn)
+
+        for name in ('BACKOFF_BASE_SECONDS', 'PER_CHAT_INTERVAL_SECONDS'):
+            patcher = patch(f'broadcast.{name}', 0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('broadcast.limiter', SendLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.bot = AsyncMock()
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _outbox(self):
+        return {row['chat_id']: row for row in self.real_conn.execute("SELECT * FROM outbox").fetchall()}
+
+    async def test_delivers_and_marks_registrations_notified(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO registrations (user_id, status) VALUES (1, 'ACCEPTED')")
+        reg_id = cursor.lastrowid
+        self.real_conn.commit()
+
+        result = await send_bulk(self.bot, self.conn, "winners:1", [
+            Recipient(chat_id=1, text="hi", reg_id=reg_id),
+            Recipient(chat_id=2, text="hi"),
+            Recipient(chat_id=None, text="hi"),
+        ])
+
+        self.assertEqual((result.sent, result.failures), (2, []))
+        self.assertEqual(self.bot.send_message.await_count, 2)
+        self.assertEqual({row['status'] for row in self._outbox().values()}, {'SENT'})
+        notified = self.real_conn.execute("SELECT notified_at FROM registrations WHERE id = ?", (reg_id,)).fetchone()[0]
+        self.assertIsNotNone(notified)
+
+    async def test_retry_after_pauses_and_retries(self):
+        self.bot.send_message.side_effect = [RetryAfter(0), None]
+
+        result = await send_bulk(self.bot, self.conn, "reminder", [Recipient(chat_id=1, text="hi")])
+
+        self.assertEqual(result.sent, 1)
+        self.assertEqual(self._outbox()[1]['attempts'], 2)
+
+    async def test_network_errors_give_up_after_max_attempts(self):
+        self.bot.send_message.side_effect = TimedOut()
+
+        result = await send_bulk(self.bot, self.conn, "reminder", [Recipient(chat_id=1, text="hi", username="bob")])
+
+        self.assertEqual(result.sent, 0)
+        self.assertEqual([f[:2] for f in result.failures], [("bob", 1)])
+        self.assertEqual(self.bot.send_message.await_count, broadcast.MAX_ATTEMPTS)
+        self.assertEqual(self._outbox()[1]['status'], 'FAILED')
+
+    async def test_same_chat_is_spaced_out(self):
+        with patch('broadcast.PER_CHAT_INTERVAL_SECONDS', 1.0), \
+                patch('broadcast.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await send_bulk(self.bot, self.conn, "admin_report", [Recipient(chat_id=1, text="a"), Recipient(chat_id=1, text="b")],
+                            dedupe=False)
+
+        self.assertEqual(self.bot.send_message.await_count, 2)
+        self.assertTrue(any(c.args[0] > 0.9 for c in sleep.await_args_list))
+
+    async def test_permanent_error_is_not_retried(self):
+        self.bot.send_message.side_effect = Forbidden("bot was blocked by the user")
+
+        result = await send_bulk(self.bot, self.conn, "winners:1", [Recipient(chat_id=1, text="hi")])
+
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(self.bot.send_message.await_count, 1)
+        self.assertIn("blocked", self._outbox()[1]['last_error'])
+
+    async def test_bad_request_is_not_retried(self):
+        self.bot.send_message.side_effect = BadRequest("Chat not found")
+
+        with patch('broadcast.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            result = await send_bulk(self.bot, self.conn, "winners:1", [Recipient(chat_id=1, text="hi")])
+
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(self.bot.send_message.await_count, 1)
+        sleep.assert_not_awaited()
+        self.assertEqual(self._outbox()[1]['attempts'], 1)
+
+    async def test_no_backoff_after_the_last_attempt(self):
+        self.bot.send_message.side_effect = TimedOut()
+
+        with patch('broadcast.BACKOFF_BASE_SECONDS', 1.0), \
+                patch('broadcast.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await send_bulk(self.bot, self.conn, "reminder", [Recipient(chat_id=1, text="hi")])
+
+        self.assertEqual(self.bot.send_message.await_count, broadcast.MAX_ATTEMPTS)
+        backoffs = [c.args[0] for c in sleep.await_args_list if c.args[0] >= 1.0]
+        self.assertEqual(len(backoffs), broadcast.MAX_ATTEMPTS - 1)
+
+    async def test_resume_sends_only_pending(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO outbox (broadcast, chat_id, text, status) VALUES ('w', 1, 'a', 'SENT')")
+        cursor.execute("INSERT INTO outbox (broadcast, chat_id, text, status) VALUES ('w', 2, 'b', 'PENDING')")
+        self.real_conn.commit()
+
+        result = await resume_outbox(self.bot, self.conn)
+
+        self.assertEqual(result.sent, 1)
+        self.bot.send_message.assert_awaited_once_with(2, 'b')
+        self.assertEqual(self._outbox()[2]['status'], 'SENT')
+
+    async def test_rerun_skips_chats_already_queued_or_sent(self):
+        cursor = self.real_conn.cursor()
+        # Left PENDING by a restart, still being drained by resume_outbox
+        cursor.execute("INSERT INTO outbox (broadcast, chat_id, text, status) VALUES ('winners:1', 1, 'hi', 'PENDING')")
+        cursor.execute("INSERT INTO outbox (broadcast, chat_id, text, status) VALUES ('winners:1', 2, 'hi', 'SENT')")
+        cursor.execute("INSERT INTO outbox (broadcast, chat_id, text, status) VALUES ('winners:1', 3, 'hi', 'FAILED')")
+        self.real_conn.commit()
+
+        result = await send_bulk(self.bot, self.conn, "winners:1", [Recipient(chat_id=i, text="hi") for i in (1, 2, 3, 4)])
+
+        self.assertEqual(result.sent, 2)
+        self.assertEqual(sorted(c.args[0] for c in self.bot.send_message.await_args_list), [3, 4])
+
+    async def test_admin_reports_are_not_deduplicated(self):
+        for _ in range(2):
+            await send_bulk(self.bot, self.conn, "admin_report", [Recipient(chat_id=1, text="x")], dedupe=False)
+
+        self.assertEqual(self.bot.send_message.await_count, 2)
+
+    async def test_concurrent_broadcasts_share_the_global_rate(self):
+        with patch('broadcast.limiter', SendLimiter(rate=2)), \
+                patch('broadcast.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await send_bulk(self.bot, self.conn, "winners:1", [Recipient(chat_id=1, text="a"), Recipient(chat_id=2, text="a")])
+            sleep.assert_not_awaited()
+            # A second broadcast finds the shared bucket empty and has to wait
+            await send_bulk(self.bot, self.conn, "waitlist:1", [Recipient(chat_id=3, text="b")])
+
+        self.assertTrue(sleep.await_count >= 1)
+
+    async def test_progress_reported_for_long_sends(self):
+        progress = AsyncMock()
+        with patch('broadcast.PROGRESS_INTERVAL_SECONDS', 0):
+            await send_bulk(self.bot, self.conn, "w", [Recipient(chat_id=i, text="x") for i in range(1, 4)], progress=progress)
+
+        self.assertTrue(progress.await_count >= 1)
+        done, total, eta = progress.await_args_list[0].args
+        self.assertEqual(total, 3)
+        self.assertTrue(0 < done < 3)
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_throttle(self):
+        bucket = TokenBucket(rate=1000, capacity=2)
+        with patch('broadcast.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await bucket.acquire()
+            await bucket.acquire()
+            sleep.assert_not_awaited()
+            bucket._tokens = 0
+            bucket._updated = broadcast.time.monotonic()
+            await bucket.acquire()
+            self.assertTrue(sleep.await_count >= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
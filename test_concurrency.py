@@ -0,0 +1,233 @@
+"""
+Concurrent update processing: per-user ordering and per-event capacity locks.
+
+Real-conference risk: with updates handled in parallel, an "Accept" tapped
+just as the invite expires, or two promotions racing for the last seat, could
+put more people on the list than the venue holds.
+"""
+import asyncio
+import gc
+import unittest
+import sqlite3
+from unittest.mock import patch, MagicMock, AsyncMock
+from telegram import Update
+import bot
+from bot import LockManager, PerUserUpdateProcessor, invite_next, callback_handler
+import messages
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER, status TEXT, total_places INTEGER,
+        speakers_group_id TEXT, waitlist_timeout_hours INTEGER,
+        end_time DATETIME, event_start_time DATETIME,
+        registration_duration_hours INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, chat_id INTEGER,
+        username TEXT, first_name TEXT, status TEXT,
+        signup_time DATETIME, priority INTEGER, notified_at DATETIME,
+        expires_at DATETIME, guest_of_user_id INTEGER,
+        partner_reg_id INTEGER, invite_token TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.commit()
+
+
+def _user_update(user_id):
+    update = MagicMock(spec=Update)
+    update.effective_user.id = user_id
+    return update
+
+
+class TestLockManager(unittest.IsolatedAsyncioTestCase):
+    async def test_locks_are_shared_per_key(self):
+        locks = LockManager()
+        self.assertIs(locks.user(1), locks.user(1))
+        self.assertIsNot(locks.user(1), locks.user(2))
+        self.assertIsNot(locks.user(1), locks.event(1))
+
+    async def test_unused_locks_are_dropped(self):
+        locks = LockManager()
+        async with locks.event(1):
+            pass
+        gc.collect()
+        self.assertEqual(len(locks._events), 0)
+
+
+class TestPerUserUpdateProcessor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.processor = PerUserUpdateProcessor(16)
+        locks_patcher = patch('bot.locks', LockManager())
+        locks_patcher.start()
+        self.addCleanup(locks_patcher.stop)
+        self.running = 0
+        self.peak = 0
+
+    async def _handler(self):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+
+    async def test_same_user_runs_in_order(self):
+        await asyncio.gather(*(self.processor.process_update(_user_update(1), self._handler()) for _ in range(5)))
+        self.assertEqual(self.peak, 1)
+
+    async def test_different_users_run_concurrently(self):
+        await asyncio.gather(*(self.processor.process_update(_user_update(i), self._handler()) for i in range(5)))
+        self.assertEqual(self.peak, 5)
+
+    async def test_one_busy_user_does_not_take_every_slot(self):
+        processor = PerUserUpdateProcessor(4)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        async def quick():
+            return None
+
+        spam = [asyncio.create_task(processor.process_update(_user_update(1), blocked())) for _ in range(10)]
+        await asyncio.sleep(0)
+        # User 1 holds a single slot; the rest of their updates wait on their lock
+        self.assertEqual(processor.current_concurrent_updates, 1)
+        await asyncio.wait_for(processor.process_update(_user_update(2), quick()), 1)
+
+        release.set()
+        await asyncio.gather(*spam)
+
+    async def test_slots_limit_different_users(self):
+        processor = PerUserUpdateProcessor(2)
+        await asyncio.gather(*(processor.process_update(_user_update(i), self._handler()) for i in range(6)))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(processor.current_concurrent_updates, 0)
+
+
+class TestCapacityLocks(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+
+        for target, value in [
+            ('bot.get_db', MagicMock(return_value=MockConnection(self.real_conn))),
+            ('bot.locks', LockManager()),
+            ('bot.scheduler', MagicMock()),
+            ('bot.application', MagicMock()),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        bot.application.bot.send_message = AsyncMock()
+
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places) VALUES (123, 'CLOSED', 2)")
+        self.event_id = cursor.lastrowid
+        for user_id in range(1, 6):
+            cursor.execute(
+                "INSERT INTO registrations (event_id, user_id, status, priority) VALUES (?, ?, 'WAITLIST', ?)",
+                (self.event_id, user_id, user_id)
+            )
+        self.real_conn.commit()
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _count(self, status):
+        return self.real_conn.execute(
+            "SELECT COUNT(*) FROM registrations WHERE event_id = ? AND status = ?", (self.event_id, status)
+        ).fetchone()[0]
+
+    async def test_racing_promotions_respect_capacity(self):
+        await asyncio.gather(*(invite_next(self.event_id) for _ in range(5)))
+        self.assertEqual(self._count('INVITED'), 2)
+        self.assertEqual(bot.application.bot.send_message.await_count, 2)
+
+    async def test_claim_runs_under_event_lock(self):
+        held = []
+        original = bot._claim_next_waitlist_unit
+
+        def claim(event_id):
+            held.append(bot.locks.event(event_id).locked())
+            return original(event_id)
+
+        with patch('bot._claim_next_waitlist_unit', side_effect=claim):
+            await invite_next(self.event_id)
+        self.assertEqual(held, [True])
+
+    async def test_accept_after_expiry_is_rejected(self):
+        await invite_next(self.event_id)
+        reg_id = self.real_conn.execute(
+            "SELECT id FROM registrations WHERE status = 'INVITED' ORDER BY id LIMIT 1"
+        ).fetchone()[0]
+
+        update = MagicMock()
+        update.effective_user.id = 1
+        update.callback_query.data = f"acc_{reg_id}"
+        update.callback_query.answer = AsyncMock()
+        update.callback_query.edit_message_text = AsyncMock()
+
+        # The timeout job expires the invite while the tap waits for the event lock
+        async with bot.locks.event(self.event_id):
+            tap = asyncio.create_task(callback_handler(update, MagicMock()))
+            await asyncio.sleep(0)
+            self.real_conn.execute("UPDATE registrations SET status = 'EXPIRED' WHERE id = ?", (reg_id,))
+            self.real_conn.commit()
+        await tap
+
+        update.callback_query.edit_message_text.assert_awaited_once_with(messages.INVALID_INVITATION)
+        status = self.real_conn.execute("SELECT status FROM registrations WHERE id = ?", (reg_id,)).fetchone()[0]
+        self.assertEqual(status, 'EXPIRED')
+
+    async def test_accept_does_not_revive_partner_who_declined_meanwhile(self):
+        self.real_conn.execute("UPDATE registrations SET status = 'INVITED', partner_reg_id = 2 WHERE id = 1")
+        self.real_conn.execute("UPDATE registrations SET status = 'INVITED', partner_reg_id = 1 WHERE id = 2")
+        self.real_conn.commit()
+
+        update = MagicMock()
+        update.effective_user.id = 1
+        update.callback_query.data = "acc_1"
+        update.callback_query.answer = AsyncMock()
+        update.callback_query.edit_message_text = AsyncMock()
+
+        async with bot.locks.event(self.event_id):
+            tap = asyncio.create_task(callback_handler(update, MagicMock()))
+            await asyncio.sleep(0)
+            self.real_conn.execute("UPDATE registrations SET status = 'UNREGISTERED' WHERE id = 2")
+            self.real_conn.commit()
+        await tap
+
+        statuses = [r[0] for r in self.real_conn.execute("SELECT status FROM registrations WHERE id IN (1, 2) ORDER BY id")]
+        self.assertEqual(statuses, ['ACCEPTED', 'UNREGISTERED'])
+
+
+if __name__ == '__main__':
+    unittest.main()
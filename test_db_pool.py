@@ -0,0 +1,89 @@
+"""
+models.get_db: pooled, long-lived connections in WAL mode.
+
+Real-conference risk: the dashboard polling during a registration burst used to
+stall the bot with "database is locked". Readers must not block writers, and a
+handler that bails out without committing must not leak its writes into the
+next user of the same pooled connection.
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import models
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'pool.db')
+        patcher = patch('models.DB_PATH', self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.close_pool()
+        models.init_db()
+
+    def tearDown(self):
+        models.close_pool()
+        self.tmp.cleanup()
+
+    def test_wal_mode_and_pragmas(self):
+        conn = models.get_db()
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode")
+        self.assertEqual(cursor.fetchone()[0], 'wal')
+        cursor.execute("PRAGMA synchronous")
+        self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        cursor.execute("PRAGMA busy_timeout")
+        self.assertEqual(cursor.fetchone()[0], models.BUSY_TIMEOUT_SECONDS * 1000)
+        conn.close()
+
+    def test_closed_connection_is_reused(self):
+        first = models.get_db()
+        raw = first._conn
+        first.close()
+        second = models.get_db()
+        self.assertIs(second._conn, raw)
+        second.close()
+
+    def test_concurrent_checkouts_get_distinct_connections(self):
+        a = models.get_db()
+        b = models.get_db()
+        self.assertIsNot(a._conn, b._conn)
+        a.close()
+        b.close()
+
+    def test_close_rolls_back_uncommitted_writes(self):
+        conn = models.get_db()
+        conn.cursor().execute("INSERT INTO events (status) VALUES ('OPEN')")
+        conn.close()
+
+        conn = models.get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM events")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        conn.close()
+
+    def test_reader_not_blocked_by_open_write_transaction(self):
+        writer = models.get_db()
+        writer.cursor().execute("INSERT INTO events (status) VALUES ('OPEN')")
+
+        reader = models.get_db()
+        cursor = reader.cursor()
+        cursor.execute("SELECT COUNT(*) FROM events")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        reader.close()
+
+        writer.commit()
+        writer.close()
+
+    def test_pool_size_is_bounded(self):
+        with patch('models.POOL_SIZE', 2):
+            conns = [models.get_db() for _ in range(4)]
+            for conn in conns:
+                conn.close()
+            self.assertEqual(len(models._pool[self.db_path]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
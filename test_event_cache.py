@@ -0,0 +1,188 @@
+"""
+EventCache: the current event is served from memory on the hot path.
+
+Real-conference risk: a stale cached event would let people register after
+the lottery closed, or show the wrong capacity in /stats. Every handler that
+changes the events table must write through to the cache.
+"""
+import unittest
+import sqlite3
+from unittest.mock import patch, MagicMock, AsyncMock
+import bot
+from models import _migration_events_version
+from bot import EventCache, list_participants, reset_event, close_registration_job
+
+TEST_DB_PATH = ":memory:"
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER, status TEXT, total_places INTEGER,
+        speakers_group_id TEXT, waitlist_timeout_hours INTEGER,
+        end_time DATETIME, event_start_time DATETIME,
+        registration_duration_hours INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, chat_id INTEGER,
+        username TEXT, first_name TEXT, status TEXT,
+        signup_time DATETIME, priority INTEGER, notified_at DATETIME,
+        expires_at DATETIME, guest_of_user_id INTEGER,
+        partner_reg_id INTEGER, invite_token TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.commit()
+
+
+def _make_update(user_id=111):
+    update = MagicMock()
+    update.effective_user.id = user_id
+    update.effective_user.username = "admin"
+    update.effective_user.first_name = "Admin"
+    update.effective_chat.type = "private"
+    update.message.reply_text = AsyncMock()
+    return update
+
+
+class TestEventCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(TEST_DB_PATH)
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+
+        patcher = patch('bot.get_db', return_value=MockConnection(self.real_conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = EventCache()
+        self.cache.enabled = True
+        cache_patcher = patch('bot.event_cache', self.cache)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+        self.statements = []
+        self.real_conn.set_trace_callback(self.statements.append)
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _event_reads(self):
+        return [s for s in self.statements if "FROM events ORDER BY created_at" in s]
+
+    def _insert_event(self, status='OPEN', total_places=10):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places) VALUES (123, ?, ?)", (status, total_places))
+        self.real_conn.commit()
+        return cursor.lastrowid
+
+    async def test_hot_path_reads_event_once(self):
+        self._insert_event()
+        for _ in range(5):
+            await list_participants(_make_update(), MagicMock())
+        self.assertEqual(len(self._event_reads()), 1)
+
+    async def test_disabled_cache_always_reads(self):
+        self.cache.enabled = False
+        self._insert_event()
+        for _ in range(3):
+            await list_participants(_make_update(), MagicMock())
+        self.assertEqual(len(self._event_reads()), 3)
+
+    async def test_close_job_writes_status_through(self):
+        event_id = self._insert_event()
+        self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'OPEN')
+
+        with patch('bot.application') as mock_app:
+            mock_app.bot.send_message = AsyncMock()
+            await close_registration_job(event_id, 123)
+
+        self.statements.clear()
+        self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'REVIEW')
+        self.assertEqual(self._event_reads(), [])
+
+    async def test_reset_writes_status_through(self):
+        event_id = self._insert_event()
+        self.cache.get(self.real_conn.cursor())
+
+        context = MagicMock()
+        context.args = ["confirm"]
+        with patch('bot.ADMIN_IDS', {111}), patch('bot.scheduler'):
+            await reset_event(_make_update(), context)
+
+        cached = self.cache.get(self.real_conn.cursor())
+        self.assertEqual(cached['id'], event_id)
+        self.assertEqual(cached['status'], 'CANCELLED')
+        self.assertIsNone(cached['end_time'])
+
+    async def test_expired_entry_is_reloaded(self):
+        self._insert_event()
+        self.cache.get(self.real_conn.cursor())
+        self.real_conn.execute("UPDATE events SET status = 'CLOSED'")
+        self.real_conn.commit()
+
+        with patch('bot.EVENT_CACHE_MAX_AGE_SECONDS', 0):
+            self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'CLOSED')
+
+    async def test_change_from_another_process_is_seen_at_the_next_check(self):
+        _migration_events_version(self.real_conn.cursor())
+        self.real_conn.commit()
+        self._insert_event()
+        with patch('bot.EVENT_CACHE_VERSION_CHECK_SECONDS', 0):
+            self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'OPEN')
+            self.statements.clear()
+            self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'OPEN')
+            self.assertEqual(self._event_reads(), [])
+
+            # E.g. the dashboard closes registration
+            self.real_conn.execute("UPDATE events SET status = 'CLOSED'")
+            self.real_conn.commit()
+
+            self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'CLOSED')
+
+    async def test_version_is_checked_at_most_once_per_interval(self):
+        _migration_events_version(self.real_conn.cursor())
+        self.real_conn.commit()
+        self._insert_event()
+        self.cache.get(self.real_conn.cursor())
+        self.statements.clear()
+
+        for _ in range(5):
+            self.cache.get(self.real_conn.cursor())
+
+        self.assertEqual(self.statements, [])
+
+    async def test_update_ignores_other_events(self):
+        event_id = self._insert_event()
+        self.cache.get(self.real_conn.cursor())
+        self.cache.update(event_id + 1, status='CANCELLED')
+        self.assertEqual(self.cache.get(self.real_conn.cursor())['status'], 'OPEN')
+
+
+if __name__ == '__main__':
+    unittest.main()
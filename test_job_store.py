@@ -0,0 +1,199 @@
+"""
+Durable scheduler: close/timeout/reminder timers live in the SQLite job store.
+
+Real-conference risk: a restart (or a crash right after an invite is written)
+used to lose the timeout timer, so an invited user who never answers could hold
+a seat forever. Overdue invites found at startup are expired in one sweep.
+"""
+import os
+import tempfile
+import unittest
+import sqlite3
+from datetime import timedelta
+from unittest.mock import patch, MagicMock, AsyncMock
+import bot
+from bot import build_scheduler, expire_overdue_invites, _reconcile_jobs, get_now
+import messages
+
+TEST_DB_PATH = ":memory:"
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER, status TEXT, total_places INTEGER,
+        speakers_group_id TEXT, waitlist_timeout_hours INTEGER,
+        end_time DATETIME, event_start_time DATETIME,
+        registration_duration_hours INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, chat_id INTEGER,
+        username TEXT, first_name TEXT, status TEXT,
+        signup_time DATETIME, priority INTEGER, notified_at DATETIME,
+        expires_at DATETIME, guest_of_user_id INTEGER,
+        partner_reg_id INTEGER, invite_token TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.commit()
+
+
+async def _noop_job(*args):
+    pass
+
+
+class TestSchedulerPersistence(unittest.IsolatedAsyncioTestCase):
+    async def test_jobs_survive_scheduler_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch('bot.DB_PATH', os.path.join(tmp, 'jobs.db')):
+                run_at = get_now() + timedelta(days=1)
+                first = build_scheduler()
+                first.start()
+                first.add_job(_noop_job, 'date', run_date=run_at, args=[42], id='timeout_42')
+                first.shutdown(wait=False)
+
+                second = build_scheduler()
+                second.start(paused=True)
+                job = second.get_job('timeout_42')
+                second.shutdown(wait=False)
+
+        self.assertIsNotNone(job)
+        self.assertEqual(job.args, (42,))
+        self.assertEqual(job.next_run_time, run_at)
+
+
+class TestStartupRecovery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(TEST_DB_PATH)
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+
+        patcher = patch('bot.get_db', return_value=MockConnection(self.real_conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_app = MagicMock()
+        self.mock_app.bot.send_message = AsyncMock()
+        app_patcher = patch('bot.application', self.mock_app)
+        app_patcher.start()
+        self.addCleanup(app_patcher.stop)
+
+        self.mock_scheduler = MagicMock()
+        self.mock_scheduler.get_jobs.return_value = []
+        sched_patcher = patch('bot.scheduler', self.mock_scheduler)
+        sched_patcher.start()
+        self.addCleanup(sched_patcher.stop)
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _insert(self, sql, params):
+        cursor = self.real_conn.cursor()
+        cursor.execute(sql, params)
+        self.real_conn.commit()
+        return cursor.lastrowid
+
+    def _status(self, reg_id):
+        cursor = self.real_conn.cursor()
+        cursor.execute("SELECT status FROM registrations WHERE id = ?", (reg_id,))
+        return cursor.fetchone()['status']
+
+    async def test_overdue_invites_expire_in_one_sweep(self):
+        event_id = self._insert("INSERT INTO events (status, total_places) VALUES ('CLOSED', 10)", ())
+        past = get_now() - timedelta(hours=1)
+        future = get_now() + timedelta(hours=1)
+        overdue_ids = [
+            self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, ?, 'INVITED', ?)",
+                         (event_id, 100 + i, past))
+            for i in range(3)
+        ]
+        pending_id = self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, ?, 'INVITED', ?)",
+                                  (event_id, 200, future))
+
+        with patch('bot.invite_next', new_callable=AsyncMock) as mock_invite_next:
+            expired = await expire_overdue_invites()
+
+        self.assertEqual(expired, 3)
+        for reg_id in overdue_ids:
+            self.assertEqual(self._status(reg_id), 'EXPIRED')
+        self.assertEqual(self._status(pending_id), 'INVITED')
+        self.assertEqual(mock_invite_next.await_count, 3)
+        self.mock_app.bot.send_message.assert_any_await(100, messages.INVITATION_EXPIRED)
+
+    async def test_overdue_invites_expire_in_one_update(self):
+        event_id = self._insert("INSERT INTO events (status, total_places) VALUES ('CLOSED', 10)", ())
+        past = get_now() - timedelta(hours=1)
+        for i in range(5):
+            self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, ?, 'INVITED', ?)",
+                         (event_id, 100 + i, past))
+        statements = []
+        self.real_conn.set_trace_callback(statements.append)
+        try:
+            with patch('bot.invite_next', new_callable=AsyncMock):
+                self.assertEqual(await expire_overdue_invites(), 5)
+        finally:
+            self.real_conn.set_trace_callback(None)
+
+        updates = [s for s in statements if s.startswith("UPDATE registrations SET status = 'EXPIRED'")]
+        self.assertEqual(len(updates), 1)
+
+    async def test_overdue_pair_expires_together_and_promotes_once(self):
+        event_id = self._insert("INSERT INTO events (status, total_places) VALUES ('CLOSED', 10)", ())
+        past = get_now() - timedelta(minutes=5)
+        a = self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, 1, 'INVITED', ?)", (event_id, past))
+        b = self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at, partner_reg_id) VALUES (?, 2, 'INVITED', ?, ?)", (event_id, past, a))
+        self.real_conn.execute("UPDATE registrations SET partner_reg_id = ? WHERE id = ?", (b, a))
+        self.real_conn.commit()
+
+        with patch('bot.invite_next', new_callable=AsyncMock) as mock_invite_next:
+            expired = await expire_overdue_invites()
+
+        self.assertEqual(expired, 2)
+        self.assertEqual(self._status(a), 'EXPIRED')
+        self.assertEqual(self._status(b), 'EXPIRED')
+        mock_invite_next.assert_awaited_once_with(event_id)
+
+    async def test_reconcile_restores_only_missing_timers(self):
+        end_time = get_now() + timedelta(hours=3)
+        event_id = self._insert("INSERT INTO events (chat_id, status, total_places, end_time) VALUES (123, 'OPEN', 10, ?)", (end_time,))
+        expires_at = get_now() + timedelta(hours=2)
+        reg_with_job = self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, 1, 'INVITED', ?)", (event_id, expires_at))
+        reg_without_job = self._insert("INSERT INTO registrations (event_id, user_id, status, expires_at) VALUES (?, 2, 'INVITED', ?)", (event_id, expires_at))
+
+        existing = MagicMock()
+        existing.id = f"timeout_{reg_with_job}"
+        self.mock_scheduler.get_jobs.return_value = [existing]
+
+        _reconcile_jobs()
+
+        added_ids = [c.kwargs['id'] for c in self.mock_scheduler.add_job.call_args_list]
+        self.assertEqual(sorted(added_ids), sorted([f"close_{event_id}", f"timeout_{reg_without_job}"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import sqlite3
 import os
 from unittest.mock import MagicMock, AsyncMock, patch
-from bot import list_participants
+from bot import list_participants, participant_counts
 import messages
 
 # Use an in-memory database for testing
@@ -150,5 +150,25 @@ class TestList(unittest.IsolatedAsyncioTestCase):
         actual_msg = update.message.reply_text.call_args[0][0]
         self.assertEqual(actual_msg, expected_msg)
 
+    async def test_counters_come_from_one_query(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (status, total_places) VALUES ('OPEN', 10)")
+        event_id = cursor.lastrowid
+        cursor.execute("INSERT INTO speakers (event_id, username) VALUES (?, 's1')", (event_id,))
+        for user_id, status, guest_of in [(1, 'ACCEPTED', 9), (2, 'INVITED', None), (3, 'ACCEPTED', None),
+                                          (4, 'REGISTERED', None), (5, 'WAITLIST', None), (6, 'UNREGISTERED', None)]:
+            cursor.execute(
+                "INSERT INTO registrations (event_id, user_id, status, guest_of_user_id) VALUES (?, ?, ?, ?)",
+                (event_id, user_id, status, guest_of)
+            )
+        self.real_conn.commit()
+        statements = []
+        self.real_conn.set_trace_callback(statements.append)
+
+        counts = participant_counts(self.real_conn.cursor(), event_id)
+
+        self.assertEqual(counts, {'speakers': 1, 'guests': 1, 'general_taken': 2, 'lottery': 1, 'waitlist': 1, 'invited': 1})
+        self.assertEqual(len(statements), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+"""
+fake_bot_api and load_test: the local Bot API stand-in and the load generator.
+
+Real-conference risk: nobody knows how the bot copes with the launch-minute
+spike until it happens. The fake API has to speak the protocol
+python-telegram-bot expects, including 429s, or the measurements say nothing
+about production.
+"""
+import argparse
+import asyncio
+import time
+import unittest
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+import load_test
+from fake_bot_api import FakeBotApi
+
+
+class TestFakeBotApi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        self.api = FakeBotApi(per_chat_rate=1, on_call=lambda method, params: self.calls.append((method, params)))
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        self.bot = Bot("123:abc", base_url=f"{self.api.url}/bot")
+        await self.bot.initialize()
+        self.addAsyncCleanup(self.bot.shutdown)
+
+    async def test_updates_are_long_polled_and_confirmed_by_offset(self):
+        update_id = self.api.push_update(load_test.command_update(5, "/register"))
+
+        updates = await self.bot.get_updates(timeout=1)
+        self.assertEqual([(u.update_id, u.message.text) for u in updates], [(update_id, "/register")])
+        self.assertIn(update_id, self.api.delivered_at)
+
+        started = time.monotonic()
+        self.assertEqual(await self.bot.get_updates(offset=update_id + 1, timeout=0.2), ())
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    async def test_sends_are_recorded_and_flood_limited_per_chat(self):
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("Да", callback_data="pyes_1_2")]])
+        message = await self.bot.send_message(5, "hi", reply_markup=markup)
+        self.assertEqual(message.chat.id, 5)
+        self.assertEqual(load_test._buttons(self.calls[-1][1]), [{"text": "Да", "callback_data": "pyes_1_2"}])
+
+        with self.assertRaises(RetryAfter):
+            await self.bot.send_message(5, "again")
+        await self.bot.send_message(6, "other chat")
+        self.assertEqual(self.api.throttled['sendMessage'], 1)
+
+    async def test_chat_member_lookup(self):
+        member = await self.bot.get_chat_member(-100123, 5)
+        self.assertEqual((member.status, member.user.id), ('left', 5))
+
+
+class TestLoadRun(unittest.TestCase):
+    def test_small_run_end_to_end(self):
+        args = argparse.Namespace(
+            users=6, pair_share=0.34, places=3, ramp=0.2, think=0.0, timeout=20.0, close_timeout=30.0,
+            latency=0.0, error_rate=0.0, global_rate=0, per_chat_rate=0, speakers_group='-100123',
+            seed=1, keep=False,
+        )
+        report = asyncio.run(load_test.run(args))
+
+        actions = report["actions"]
+        self.assertEqual({a: len(s.handler) for a, s in actions.items()},
+                         {'/register': 6, '/status': 6, '/pair': 1, 'callback': 1, '/stats': 1, '/close': 1})
+        self.assertEqual(sum(s.timeouts for s in actions.values()), 0)
+        self.assertGreater(report["calls"]['getChatMember'], 0)
+        self.assertIn('/register', load_test.format_report(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+log_archive: finished events' action_logs move to an archive database.
+
+Real-conference risk: action_logs is never pruned, so after a few conferences
+every dashboard refresh scans years of history. Archival must not lose
+entries: each one ends up in the archive exactly once, and per-action counts
+stay available through the rollup.
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch, MagicMock, AsyncMock
+from zoneinfo import ZoneInfo
+import analytics
+import log_archive
+import messages
+import models
+from bot import compact_logs_command
+
+NOW = datetime(2026, 10, 1, 12, 0, tzinfo=ZoneInfo("UTC"))
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    @property
+    def in_transaction(self):
+        return self.real_conn.in_transaction
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def rollback(self):
+        self.real_conn.rollback()
+
+    def close(self):
+        pass
+
+
+class TestLogArchive(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.archive_path = os.path.join(self.tmp.name, 'archive.db')
+        db_path = os.path.join(self.tmp.name, 'bot.db')
+        with patch('models.DB_PATH', db_path):
+            models.init_db()
+        models.close_pool()
+
+        self.real_conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.real_conn.row_factory = sqlite3.Row
+        self.addCleanup(self.real_conn.close)
+        self.conn = MockConnection(self.real_conn)
+
+        cursor = self.real_conn.cursor()
+        events = [
+            (1, 'CLOSED', '2026-05-01 18:00:00'),     # old: archived
+            (2, 'CANCELLED', '2026-06-01 18:00:00'),  # old: archived
+            (3, 'CLOSED', '2026-09-25 18:00:00'),     # within retention
+            (4, 'OPEN', '2026-05-01 18:00:00'),       # still running
+        ]
+        cursor.executemany("INSERT INTO events (id, status, event_start_time) VALUES (?, ?, ?)", events)
+        for event_id, _, _ in events:
+            for action in ['REGISTER', 'REGISTER', 'UNREGISTER']:
+                cursor.execute(
+                    "INSERT INTO action_logs (event_id, user_id, action, timestamp) VALUES (?, 2, ?, '2026-04-01 10:00:00')",
+                    (event_id, action)
+                )
+        self.real_conn.commit()
+
+    def _compact(self, retention_days=30):
+        return log_archive.compact(self.conn, NOW, retention_days, self.archive_path)
+
+    def _archived(self):
+        archive = sqlite3.connect(self.archive_path)
+        try:
+            return archive.execute("SELECT event_id, action FROM action_logs ORDER BY id").fetchall()
+        finally:
+            archive.close()
+
+    def test_moves_only_finished_old_events(self):
+        funnel_before = analytics.funnel_counts(self.real_conn.cursor(), 1)
+
+        result = self._compact()
+
+        self.assertEqual((result.entries, result.event_ids), (6, [1, 2]))
+        live = {row[0] for row in self.real_conn.execute("SELECT DISTINCT event_id FROM action_logs")}
+        self.assertEqual(live, {3, 4})
+        self.assertEqual([e for e, _ in self._archived()], [1, 1, 1, 2, 2, 2])
+        self.assertEqual(analytics.funnel_counts(self.real_conn.cursor(), 1), funnel_before)
+        archived_at = self.real_conn.execute("SELECT id FROM events WHERE logs_archived_at IS NOT NULL ORDER BY id").fetchall()
+        self.assertEqual([r[0] for r in archived_at], [1, 2])
+        self.assertEqual(self.real_conn.execute("PRAGMA database_list").fetchall()[-1][1], 'main')
+
+    def test_late_entries_are_added_to_the_rollup(self):
+        self._compact()
+        self.real_conn.execute("INSERT INTO action_logs (event_id, user_id, action, timestamp) VALUES (1, 3, 'REGISTER', '2026-09-30 10:00:00')")
+        self.real_conn.commit()
+
+        result = self._compact()
+
+        self.assertEqual((result.entries, result.event_ids), (1, [1]))
+        rollup = self.real_conn.execute(
+            "SELECT entries, first_at, last_at FROM action_log_rollup WHERE event_id = 1 AND action = 'REGISTER'"
+        ).fetchone()
+        self.assertEqual(tuple(rollup), (3, '2026-04-01 10:00:00', '2026-09-30 10:00:00'))
+        self.assertEqual(len(self._archived()), 7)
+
+    def test_rerun_after_interrupted_delete_does_not_duplicate(self):
+        # Simulate a crash after the archive was written but before the live delete
+        self.real_conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        columns = log_archive._prepare_archive(self.real_conn.cursor())
+        self.real_conn.execute(f"INSERT INTO archive.action_logs SELECT {', '.join(columns)} FROM main.action_logs WHERE event_id = 1")
+        self.real_conn.commit()
+        self.real_conn.execute("DETACH DATABASE archive")
+
+        self._compact()
+
+        self.assertEqual(len(self._archived()), 6)
+
+    def test_moves_entries_in_short_transactions(self):
+        pauses = []
+
+        def sleep(seconds):
+            # Between chunks nothing is left uncommitted for the bot's writers to wait on
+            pauses.append(self.real_conn.in_transaction)
+
+        with patch('log_archive.CHUNK_SIZE', 2):
+            result = log_archive.compact(self.conn, NOW, 30, self.archive_path, sleep=sleep)
+
+        self.assertEqual((result.entries, result.event_ids), (6, [1, 2]))
+        self.assertEqual(pauses, [False] * 4)
+        rollup = self.real_conn.execute(
+            "SELECT action, entries FROM action_log_rollup WHERE event_id = 1 ORDER BY action"
+        ).fetchall()
+        self.assertEqual([tuple(r) for r in rollup], [('REGISTER', 2), ('UNREGISTER', 1)])
+        self.assertEqual(len(self._archived()), 6)
+
+    def test_nothing_to_do_leaves_archive_untouched(self):
+        result = self._compact(retention_days=365)
+        self.assertEqual(result.event_ids, [])
+        self.assertFalse(os.path.exists(self.archive_path))
+
+    async def test_admin_command(self):
+        update = MagicMock()
+        update.effective_user.id = 1
+        update.message.reply_text = AsyncMock()
+        context = MagicMock()
+        context.args = ['0']
+        with patch('bot.ADMIN_IDS', {1}), patch('bot.get_db', return_value=self.conn), \
+                patch('bot.get_now', return_value=NOW), patch('log_archive.ARCHIVE_PATH', self.archive_path):
+            await compact_logs_command(update, context)
+
+        update.message.reply_text.assert_awaited_once_with(messages.COMPACT_DONE.format(entries=9, events=3))
+        actions = [r[0] for r in self.real_conn.execute("SELECT action FROM action_logs")]
+        self.assertIn('COMPACT_LOGS', actions)
+
+    async def test_non_admin_rejected(self):
+        update = MagicMock()
+        update.effective_user.id = 2
+        update.message.reply_text = AsyncMock()
+        with patch('bot.ADMIN_IDS', {1}), patch('log_archive.compact') as compact:
+            await compact_logs_command(update, MagicMock(args=[]))
+        compact.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
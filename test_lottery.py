@@ -0,0 +1,335 @@
+"""
+lottery.draw and the lottery_sim fairness check.
+
+Real-conference risk: the draw was only ever exercised through
+close_registration_job, so nobody could tell whether pair members and singles
+really win at the same rate, or what the re-roll fallback does to the odds.
+The pure draw must keep pairs together and fill every seat; the simulator
+must show the skew when there is one.
+
+A disputed draw must be reproducible: the seed and pool recorded at close
+time have to re-derive the same winners and waitlist order.
+"""
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+import analytics
+import log_archive
+import lottery
+import lottery_sim
+import messages
+import models
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from bot import ActionLogWriter, close_registration_job, get_now, replay_lottery_command
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AlwaysWin:
+    """Every coin lands heads, so Stage 1 can never fit and has to fall back."""
+    def __init__(self):
+        self.rng = random.Random(0)
+
+    def random(self):
+        return 0.0
+
+    def shuffle(self, items):
+        self.rng.shuffle(items)
+
+    def sample(self, population, k):
+        return self.rng.sample(population, k)
+
+
+class TestDraw(unittest.TestCase):
+    def setUp(self):
+        self.pairs = [(1, 2), (3, 4), (5, 6)]
+        self.singles = [7, 8, 9, 10, 11]
+
+    def test_seats_filled_and_everyone_placed(self):
+        for seed in range(50):
+            result = lottery.draw(self.pairs, self.singles, 5, random.Random(seed))
+            waitlisted = [member for unit in result.loser_units for member in unit]
+            self.assertEqual(len(result.winners), 5)
+            self.assertEqual(sorted(result.winners + waitlisted), list(range(1, 12)))
+            self.assertFalse(result.truncated)
+
+    def test_pairs_stay_together(self):
+        for seed in range(50):
+            result = lottery.draw(self.pairs, self.singles, 4, random.Random(seed))
+            for a, b in self.pairs:
+                self.assertEqual(a in result.winners, b in result.winners)
+                if a not in result.winners:
+                    self.assertIn([a, b], result.loser_units)
+
+    def test_same_rng_state_same_draw(self):
+        first = lottery.draw(self.pairs, self.singles, 5, random.Random(42))
+        second = lottery.draw(self.pairs, self.singles, 5, random.Random(42))
+        self.assertEqual((first.winners, first.loser_units), (second.winners, second.loser_units))
+
+    def test_fallback_truncates_pair_winners(self):
+        result = lottery.draw(self.pairs, self.singles, 3, AlwaysWin())
+        self.assertTrue(result.truncated)
+        self.assertEqual(result.attempts, lottery.MAX_ATTEMPTS)
+        self.assertEqual(len(result.pair_winners), 1)
+        self.assertEqual(len(result.single_winners), 1)
+
+    def test_exact_draw_has_no_rerolls(self):
+        for seed in range(50):
+            result = lottery.draw_exact(self.pairs, self.singles, 5, random.Random(seed))
+            self.assertEqual(len(result.winners), 5)
+            self.assertEqual((result.attempts, result.truncated), (1, False))
+        # Only seats // 2 pairs fit, and nothing is left to chance once they do
+        result = lottery.draw_exact(self.pairs, [], 3, random.Random(1))
+        self.assertEqual(len(result.pair_winners), 1)
+
+    def test_pair_count_distribution(self):
+        # Pairs always fit and singles can take the rest: plain Binomial(P, M/N)
+        for weight, expected in zip(lottery.pair_count_distribution(2, 8, 4), [4 / 9, 4 / 9, 1 / 9]):
+            self.assertAlmostEqual(weight, expected)
+        for pairs, singles, seats in [(20, 8, 5), (500, 20, 50), (5, 0, 5)]:
+            weights = lottery.pair_count_distribution(pairs, singles, seats)
+            self.assertEqual(len(weights), min(pairs, seats // 2) + 1)
+            self.assertAlmostEqual(sum(weights), 1.0)
+
+    def test_no_seats(self):
+        result = lottery.draw(self.pairs, self.singles, 0, random.Random(1))
+        self.assertEqual(result.winners, [])
+        self.assertEqual(len(result.loser_units), 8)
+
+
+class TestSeededRun(unittest.TestCase):
+    UNITS = [(1, 2), (3,), (5, 4), (6,), (7,), (8,), (9,)]
+
+    def test_result_depends_only_on_inputs(self):
+        seed = lottery.new_seed()
+        first = lottery.run(self.UNITS, 4, seed)
+        second = lottery.run(list(reversed(self.UNITS)), 4, seed)
+        self.assertEqual((first.winners, first.loser_units), (second.winners, second.loser_units))
+        self.assertIn((4, 5), first.pair_winners + first.loser_pairs)
+
+    def test_seeds_are_fresh(self):
+        self.assertNotEqual(lottery.new_seed(), lottery.new_seed())
+        self.assertEqual(len(lottery.new_seed()), 32)
+
+    def test_record_replays(self):
+        seed = lottery.new_seed()
+        audit = lottery.record(self.UNITS, 4, seed, lottery.run(self.UNITS, 4, seed))
+
+        _, matches = lottery.replay(audit)
+        self.assertTrue(matches)
+
+        audit['winners'] = list(reversed(audit['winners']))
+        _, matches = lottery.replay(audit)
+        self.assertFalse(matches)
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        # Like models.PooledConnection: uncommitted work is rolled back
+        if self.real_conn.in_transaction:
+            self.real_conn.rollback()
+
+
+class TestLotteryAudit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        db_path = os.path.join(self.tmp.name, 'bot.db')
+        with patch('models.DB_PATH', db_path):
+            models.init_db()
+        models.close_pool()
+
+        self.real_conn = sqlite3.connect(db_path)
+        self.real_conn.row_factory = sqlite3.Row
+        self.addCleanup(self.real_conn.close)
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (id, status, total_places, chat_id) VALUES (1, 'OPEN', 4, 999)")
+        for i in range(1, 11):
+            cursor.execute(
+                "INSERT INTO registrations (event_id, user_id, username, status) VALUES (1, ?, ?, 'REGISTERED')",
+                (100 + i, f'user{i}')
+            )
+        cursor.execute("UPDATE registrations SET partner_reg_id = 2 WHERE id = 1")
+        cursor.execute("UPDATE registrations SET partner_reg_id = 1 WHERE id = 2")
+        self.real_conn.commit()
+
+        self.app = MagicMock()
+        self.app.bot.send_message = AsyncMock()
+        for target, value in [
+            ('bot.get_db', lambda: MockConnection(self.real_conn)),
+            ('bot.action_log_writer', ActionLogWriter()),
+            ('bot.application', self.app),
+            ('bot.ADMIN_IDS', {1}),
+            ('bot.scheduler', MagicMock()),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def _replay(self):
+        update = MagicMock()
+        update.effective_user.id = 1
+        update.message.reply_text = AsyncMock()
+        await replay_lottery_command(update, MagicMock(args=['1']))
+        return update.message.reply_text.await_args.args[0]
+
+    async def test_close_records_seed_and_replay_matches(self):
+        await close_registration_job(1, 999)
+
+        seed = self.real_conn.execute("SELECT lottery_seed FROM events WHERE id = 1").fetchone()[0]
+        entry = analytics.event_timeline(self.real_conn.cursor(), 1, actions=['LOTTERY_COMPLETE'])[0]
+        audit = entry['payload']['draw']
+        self.assertEqual(audit['seed'], seed)
+        self.assertIn(seed, entry['details'])
+        accepted = [r[0] for r in self.real_conn.execute("SELECT id FROM registrations WHERE status = 'ACCEPTED'")]
+        self.assertEqual(sorted(audit['winners']), sorted(accepted))
+
+        reply = await self._replay()
+
+        self.assertEqual(reply, messages.REPLAY_LOTTERY_MATCH.format(event_id=1, seed=seed, winners=4, waitlist=6))
+
+    async def test_write_out_is_timed_and_verified(self):
+        await close_registration_job(1, 999)
+
+        entry = analytics.event_timeline(self.real_conn.cursor(), 1, actions=['LOTTERY_COMPLETE'])[0]
+        self.assertGreaterEqual(entry['payload']['write_ms'], 0)
+        self.assertIn('Write:', entry['details'])
+        waitlist = [list(r) for r in self.real_conn.execute(
+            "SELECT id, priority FROM registrations WHERE status = 'WAITLIST' ORDER BY priority, id")]
+        expected = sorted([reg_id, position] for position, unit in enumerate(entry['payload']['draw']['waitlist']) for reg_id in unit)
+        self.assertEqual(sorted(waitlist), expected)
+
+    async def test_mismatched_write_out_is_rolled_back(self):
+        # Something else rewrites a winner while the results are applied
+        self.real_conn.execute("""
+            CREATE TRIGGER undo_accept AFTER UPDATE OF status ON registrations
+            WHEN NEW.status = 'ACCEPTED' BEGIN
+                UPDATE registrations SET status = 'REGISTERED' WHERE id = NEW.id;
+            END
+        """)
+        self.real_conn.commit()
+
+        await close_registration_job(1, 999)
+
+        statuses = {r[0] for r in self.real_conn.execute("SELECT status FROM registrations")}
+        self.assertEqual(statuses, {'REGISTERED'})
+        event = self.real_conn.execute("SELECT status, lottery_seed FROM events WHERE id = 1").fetchone()
+        self.assertEqual(tuple(event), ('OPEN', None))
+        self.app.bot.send_message.assert_awaited_once()
+        self.assertEqual(self.app.bot.send_message.await_args.args[0], 999)
+
+    async def test_mismatched_write_out_schedules_another_close(self):
+        self.real_conn.execute("""
+            CREATE TRIGGER undo_accept AFTER UPDATE OF status ON registrations
+            WHEN NEW.status = 'ACCEPTED' BEGIN
+                UPDATE registrations SET status = 'REGISTERED' WHERE id = NEW.id;
+            END
+        """)
+        self.real_conn.commit()
+
+        with patch('bot.scheduler') as scheduler:
+            await close_registration_job(1, 999)
+
+        scheduler.add_job.assert_called_once()
+        kwargs = scheduler.add_job.call_args.kwargs
+        self.assertEqual((kwargs['id'], kwargs['args']), ('close_1', [1, 999]))
+        self.assertTrue(kwargs['replace_existing'])
+        self.assertGreater(kwargs['run_date'], get_now())
+
+    async def test_replay_detects_a_different_seed(self):
+        await close_registration_job(1, 999)
+        seed = self.real_conn.execute("SELECT lottery_seed FROM events WHERE id = 1").fetchone()[0]
+        self.real_conn.execute("UPDATE events SET lottery_seed = 'tampered' WHERE id = 1")
+        self.real_conn.commit()
+
+        reply = await self._replay()
+
+        self.assertEqual(reply, messages.REPLAY_LOTTERY_MISMATCH.format(event_id=1, seed=seed))
+
+    async def test_audit_is_kept_on_the_event(self):
+        await close_registration_job(1, 999)
+
+        audit = json.loads(self.real_conn.execute("SELECT lottery_audit FROM events WHERE id = 1").fetchone()[0])
+        entry = analytics.event_timeline(self.real_conn.cursor(), 1, actions=['LOTTERY_COMPLETE'])[0]
+        self.assertEqual(audit, entry['payload']['draw'])
+
+    async def test_replay_after_logs_are_archived(self):
+        await close_registration_job(1, 999)
+        self.real_conn.execute("UPDATE events SET status = 'CLOSED', event_start_time = '2026-01-01 18:00:00' WHERE id = 1")
+        self.real_conn.commit()
+        archive_path = os.path.join(self.tmp.name, 'archive.db')
+        log_archive.compact(self.real_conn, datetime(2026, 10, 1, tzinfo=ZoneInfo("UTC")), 30, archive_path)
+        self.assertEqual(analytics.event_timeline(self.real_conn.cursor(), 1, actions=['LOTTERY_COMPLETE']), [])
+
+        seed = self.real_conn.execute("SELECT lottery_seed FROM events WHERE id = 1").fetchone()[0]
+        match = messages.REPLAY_LOTTERY_MATCH.format(event_id=1, seed=seed, winners=4, waitlist=6)
+
+        self.assertEqual(await self._replay(), match)
+
+        # A draw from before events kept the audit record: found in the archive
+        self.real_conn.execute("UPDATE events SET lottery_audit = NULL WHERE id = 1")
+        self.real_conn.commit()
+        with patch('log_archive.ARCHIVE_PATH', archive_path):
+            self.assertEqual(await self._replay(), match)
+
+    async def test_replay_without_record(self):
+        reply = await self._replay()
+        self.assertEqual(reply, messages.REPLAY_LOTTERY_NO_RECORD.format(event_id=1))
+
+
+class TestSimulation(unittest.TestCase):
+    def test_python_engine_is_fair_for_a_realistic_pool(self):
+        # 1 pair + 8 singles for 5 seats: everybody should win half the time
+        r = lottery_sim.simulate_python(8, 1, 5, 4000, seed=7)
+        self.assertEqual(r.fair_rate, 0.5)
+        self.assertLess(abs(r.z_score), lottery_sim.Z_LIMIT)
+        self.assertAlmostEqual(r.pair_rate, 0.5, delta=0.05)
+        self.assertEqual(sum(r.wins), 5 * r.trials)
+
+    def test_skew_is_reported_when_rerolls_dominate(self):
+        # 20 pairs + 8 singles for 10 seats: conditioning on 2K <= M favours singles
+        r = lottery_sim.simulate_python(8, 20, 10, 2000, seed=7, algorithm=1)
+        self.assertGreater(r.rerolls, 0)
+        self.assertLess(r.z_score, -lottery_sim.Z_LIMIT)
+
+    def test_exact_draw_is_fair_where_rerolls_were_not(self):
+        r = lottery_sim.simulate_python(8, 20, 10, 4000, seed=7, algorithm=2)
+        self.assertEqual(r.rerolls, 0)
+        self.assertLess(abs(r.z_score), lottery_sim.Z_LIMIT)
+        self.assertAlmostEqual(r.pair_rate, r.fair_rate, delta=0.02)
+
+    def test_benchmark_times_every_algorithm(self):
+        timings = lottery_sim.benchmark(8, 20, 10, 5, seed=1)
+        self.assertEqual(sorted(timings), sorted(lottery.ALGORITHMS))
+
+    @unittest.skipUnless(numpy, "numpy not installed")
+    def test_numpy_engine_matches_python_engine(self):
+        for (singles, pairs, seats), algorithm in itertools.product([(8, 1, 5), (8, 20, 5), (3, 30, 3)], lottery.ALGORITHMS):
+            fast = lottery_sim.simulate_numpy(singles, pairs, seats, 20000, seed=3, algorithm=algorithm)
+            slow = lottery_sim.simulate_python(singles, pairs, seats, 4000, seed=3, algorithm=algorithm)
+            self.assertEqual(sum(fast.wins), min(seats, fast.pool_size) * fast.trials)
+            self.assertAlmostEqual(fast.pair_rate, slow.pair_rate, delta=0.03)
+            self.assertAlmostEqual(fast.single_rate, slow.single_rate, delta=0.03)
+            self.assertEqual(fast.fallbacks > 0, slow.fallbacks > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from unittest.mock import MagicMock, AsyncMock, patch
 import bot
 from bot import close_registration_job, send_invites, status, register, list_participants
+from models import create_outbox_table
 import messages
 
 # Use an in-memory database for testing
@@ -46,6 +47,7 @@ class TestLotteryReview(unittest.IsolatedAsyncioTestCase):
         cursor.execute("CREATE TABLE registrations (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, user_id INTEGER, chat_id INTEGER, username TEXT, first_name TEXT, status TEXT, signup_time DATETIME, priority INTEGER, notified_at DATETIME, expires_at DATETIME, guest_of_user_id INTEGER, partner_reg_id INTEGER)")
         cursor.execute("CREATE TABLE speakers (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, username TEXT)")
         cursor.execute("CREATE TABLE action_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, user_id INTEGER, username TEXT, first_name TEXT, action TEXT, details TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        create_outbox_table(cursor)
         self.conn.commit()
 
         # Admin IDs patch
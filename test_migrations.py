@@ -0,0 +1,131 @@
+"""
+models.init_db: versioned migrations and hot-path indexes.
+
+Real-conference risk: registrations and action_logs are never deleted, so
+without indexes every /register, /status and dashboard refresh gets slower as
+event history piles up.
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+import models
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'migrate.db')
+        patcher = patch('models.DB_PATH', self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        models.close_pool()
+        self.tmp.cleanup()
+
+    def _query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def test_fresh_db_reaches_latest_version(self):
+        models.init_db()
+        self.assertEqual(self._query("SELECT version FROM schema_version"), [(models.MIGRATIONS[-1][0],)])
+
+    def test_init_db_is_idempotent(self):
+        models.init_db()
+        models.init_db()
+        self.assertEqual(len(self._query("SELECT version FROM schema_version")), 1)
+
+    def test_legacy_db_gets_missing_columns(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE registrations (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, user_id INTEGER, "
+            "chat_id INTEGER, username TEXT, first_name TEXT, status TEXT, signup_time DATETIME, priority INTEGER, "
+            "notified_at DATETIME, expires_at DATETIME)"
+        )
+        conn.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (1, 2, 'REGISTERED')")
+        conn.commit()
+        conn.close()
+
+        models.init_db()
+
+        columns = {row[1] for row in self._query("PRAGMA table_info(registrations)")}
+        self.assertTrue({'guest_of_user_id', 'invite_token', 'partner_reg_id'} <= columns)
+        self.assertEqual(self._query("SELECT user_id FROM registrations"), [(2,)])
+
+    def test_duplicate_speakers_collapsed_before_unique_key(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE speakers (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, username TEXT, first_name TEXT)")
+        conn.executemany(
+            "INSERT INTO speakers (event_id, username) VALUES (?, ?)",
+            [(1, 'alice'), (1, 'alice'), (2, 'alice'), (1, 'bob')]
+        )
+        conn.commit()
+        conn.close()
+
+        models.init_db()
+
+        rows = self._query("SELECT event_id, username FROM speakers ORDER BY id")
+        self.assertEqual(rows, [(1, 'alice'), (2, 'alice'), (1, 'bob')])
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("INSERT INTO speakers (event_id, username) VALUES (1, 'bob')")
+            finally:
+                conn.close()
+
+    def test_legacy_action_logs_backfilled(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE registrations (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, user_id INTEGER, "
+            "chat_id INTEGER, username TEXT, first_name TEXT, status TEXT, signup_time DATETIME, priority INTEGER, "
+            "notified_at DATETIME, expires_at DATETIME)"
+        )
+        conn.execute(
+            "CREATE TABLE action_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, user_id INTEGER, "
+            "username TEXT, first_name TEXT, action TEXT, details TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.executemany("INSERT INTO registrations (event_id, user_id, status) VALUES (?, ?, ?)",
+                         [(1, 2, 'UNREGISTERED'), (1, 3, 'EXPIRED')])
+        conn.executemany("INSERT INTO action_logs (event_id, user_id, action, details) VALUES (?, ?, ?, ?)",
+                         [(1, 2, 'REGISTER', 'Status: REGISTERED'), (1, 2, 'UNREGISTER', 'Old status: ACCEPTED'),
+                          (1, 3, 'EXPIRE_INVITE', 'Waitlist invite expired'), (1, 9, 'UNREGISTER', '')])
+        conn.commit()
+        conn.close()
+
+        models.init_db()
+
+        rows = self._query("SELECT action, reg_id, new_status FROM action_logs ORDER BY id")
+        self.assertEqual(rows, [
+            ('REGISTER', 1, 'REGISTERED'), ('UNREGISTER', 1, 'UNREGISTERED'),
+            ('EXPIRE_INVITE', 2, 'EXPIRED'), ('UNREGISTER', None, 'UNREGISTERED'),
+        ])
+
+    def test_hot_queries_use_indexes(self):
+        models.init_db()
+        queries = [
+            ("SELECT * FROM registrations WHERE event_id = ? AND status = ?", (1, 'WAITLIST')),
+            ("SELECT * FROM registrations WHERE event_id = ? AND user_id = ?", (1, 2)),
+            ("SELECT * FROM registrations WHERE event_id = ? AND LOWER(username) = ?", (1, 'bob')),
+            ("SELECT * FROM registrations WHERE invite_token = ?", ('abc',)),
+            ("SELECT id FROM speakers WHERE event_id = ? AND username = ?", (1, 'bob')),
+            ("SELECT * FROM action_logs WHERE event_id = ? ORDER BY id DESC LIMIT 100", (1,)),
+            ("SELECT action, COUNT(*) FROM action_logs WHERE event_id = ? GROUP BY action", (1,)),
+            ("SELECT * FROM action_logs WHERE event_id = ? AND action IN (?, ?) ORDER BY id DESC LIMIT 100", (1, 'REGISTER', 'UNREGISTER')),
+            ("SELECT * FROM action_logs WHERE reg_id = ? ORDER BY id", (1,)),
+            ("SELECT * FROM registrations WHERE event_id = ? AND status = ? AND id > ? ORDER BY id LIMIT 100", (1, 'WAITLIST', 0)),
+            ("SELECT * FROM action_logs WHERE event_id = ? AND id > ? ORDER BY id LIMIT 100", (1, 0)),
+            ("SELECT * FROM events ORDER BY created_at DESC LIMIT 1", ()),
+        ]
+        for sql, params in queries:
+            plan = " ".join(row[3] for row in self._query("EXPLAIN QUERY PLAN " + sql, params))
+            self.assertIn("INDEX", plan, f"{sql!r} does a full scan: {plan}")
+
+
+if __name__ == '__main__':
+    unittest.main()
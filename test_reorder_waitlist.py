@@ -0,0 +1,127 @@
+"""
+reoder_waitlist: set-based compaction of waitlist priorities.
+
+Real-conference risk: a compaction bug silently reorders the waitlist, so
+someone further back gets invited first, or a pair is split across slots.
+Results are checked against the original row-by-row algorithm.
+"""
+import random
+import unittest
+import sqlite3
+from bot import reoder_waitlist
+
+
+def _reference_reorder(rows):
+    """Original per-row algorithm: rows are (id, priority, partner_reg_id) of WAITLIST members."""
+    ordered = sorted(rows, key=lambda r: (r[1] is not None, r[1] if r[1] is not None else 0, r[0]))
+    waitlist_ids = {r[0] for r in rows}
+    result = {}
+    seen = set()
+    slot = 1
+    for reg_id, _, partner in ordered:
+        if reg_id in seen:
+            continue
+        result[reg_id] = slot
+        seen.add(reg_id)
+        if partner:
+            if partner in waitlist_ids:
+                result[partner] = slot
+            seen.add(partner)
+        slot += 1
+    return result
+
+
+class TestReorderWaitlist(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('''CREATE TABLE registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER, user_id INTEGER, status TEXT,
+            priority INTEGER, partner_reg_id INTEGER
+        )''')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _insert(self, event_id, status, priority, partner=None):
+        cursor = self.conn.execute(
+            "INSERT INTO registrations (event_id, status, priority, partner_reg_id) VALUES (?, ?, ?, ?)",
+            (event_id, status, priority, partner)
+        )
+        return cursor.lastrowid
+
+    def _link(self, a, b):
+        self.conn.execute("UPDATE registrations SET partner_reg_id = ? WHERE id = ?", (b, a))
+        self.conn.execute("UPDATE registrations SET partner_reg_id = ? WHERE id = ?", (a, b))
+
+    def _priorities(self, event_id):
+        rows = self.conn.execute(
+            "SELECT id, priority FROM registrations WHERE event_id = ? AND status = 'WAITLIST'", (event_id,)
+        ).fetchall()
+        return {r['id']: r['priority'] for r in rows}
+
+    def test_pairs_share_slot_and_gaps_close(self):
+        a = self._insert(1, 'WAITLIST', 5)
+        b = self._insert(1, 'WAITLIST', 9)
+        c = self._insert(1, 'WAITLIST', 7)
+        d = self._insert(1, 'WAITLIST', 5)
+        self._link(a, d)
+
+        reoder_waitlist(1, self.conn.cursor())
+
+        self.assertEqual(self._priorities(1), {a: 1, d: 1, c: 2, b: 3})
+
+    def test_partner_not_on_waitlist_is_treated_as_single(self):
+        a = self._insert(1, 'WAITLIST', 3)
+        b = self._insert(1, 'ACCEPTED', None)
+        self._link(a, b)
+        c = self._insert(1, 'WAITLIST', 1)
+
+        reoder_waitlist(1, self.conn.cursor())
+
+        self.assertEqual(self._priorities(1), {c: 1, a: 2})
+        self.assertIsNone(self.conn.execute("SELECT priority FROM registrations WHERE id = ?", (b,)).fetchone()[0])
+
+    def test_other_events_untouched(self):
+        mine = self._insert(1, 'WAITLIST', 10)
+        other = self._insert(2, 'WAITLIST', 10)
+
+        reoder_waitlist(1, self.conn.cursor())
+
+        self.assertEqual(self._priorities(1), {mine: 1})
+        self.assertEqual(self._priorities(2), {other: 10})
+
+    def test_only_rows_behind_removed_slot_are_written(self):
+        ids = [self._insert(1, 'WAITLIST', slot) for slot in range(1, 11)]
+        self.conn.execute("UPDATE registrations SET status = 'INVITED' WHERE id = ?", (ids[6],))
+
+        before = self.conn.total_changes
+        reoder_waitlist(1, self.conn.cursor())
+
+        self.assertEqual(self.conn.total_changes - before, 3)
+        self.assertEqual(self._priorities(1), {reg_id: i + 1 for i, reg_id in enumerate(ids[:6] + ids[7:])})
+
+    def test_matches_reference_algorithm(self):
+        rng = random.Random(1234)
+        for trial in range(50):
+            event_id = 100 + trial
+            ids = [self._insert(event_id, 'WAITLIST', rng.choice([None, *range(20)])) for _ in range(rng.randint(1, 30))]
+            rng.shuffle(ids)
+            for a, b in zip(ids[0:10:2], ids[1:10:2]):
+                if rng.random() < 0.5:
+                    self._link(a, b)
+            rows = [
+                (r['id'], r['priority'], r['partner_reg_id'])
+                for r in self.conn.execute(
+                    "SELECT id, priority, partner_reg_id FROM registrations WHERE event_id = ?", (event_id,)
+                ).fetchall()
+            ]
+
+            reoder_waitlist(event_id, self.conn.cursor())
+
+            self.assertEqual(self._priorities(event_id), _reference_reorder(rows), f"trial {trial}")
+
+
+if __name__ == '__main__':
+    unittest.main()
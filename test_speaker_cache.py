@@ -0,0 +1,82 @@
+"""
+SpeakerMembershipCache: speakers-group checks served from memory.
+
+Real-conference risk: every /status, /register and /unregister used to ask
+Telegram whether the user is a speaker, so a burst of commands hit the bot
+API rate limit. A stale answer is just as bad: a speaker who left the group
+must stop counting as one as soon as Telegram tells us.
+"""
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+from bot import SpeakerMembershipCache, _is_speaker_user, chat_member_update
+
+
+def _member(status):
+    member = MagicMock()
+    member.status = status
+    return member
+
+
+class TestSpeakerMembershipCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = SpeakerMembershipCache()
+        self.cache.enabled = True
+        patcher = patch('bot.speaker_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.bot = MagicMock()
+        self.bot.get_chat_member = AsyncMock(return_value=_member("member"))
+
+    async def test_repeat_checks_hit_the_cache(self):
+        for _ in range(3):
+            self.assertTrue(await self.cache.is_member(self.bot, -100, 1))
+        self.assertEqual(self.bot.get_chat_member.await_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    async def test_keys_include_group(self):
+        await self.cache.is_member(self.bot, -100, 1)
+        await self.cache.is_member(self.bot, -200, 1)
+        self.assertEqual(self.bot.get_chat_member.await_count, 2)
+
+    async def test_negative_answers_expire_sooner(self):
+        self.bot.get_chat_member.return_value = _member("left")
+        with patch('bot.SPEAKER_CACHE_NEGATIVE_TTL_SECONDS', 0):
+            self.assertFalse(await self.cache.is_member(self.bot, -100, 1))
+            self.assertFalse(await self.cache.is_member(self.bot, -100, 1))
+        self.assertEqual(self.bot.get_chat_member.await_count, 2)
+
+    async def test_errors_are_not_cached(self):
+        self.bot.get_chat_member.side_effect = [Exception("timeout"), _member("creator")]
+        self.assertFalse(await self.cache.is_member(self.bot, -100, 1))
+        self.assertTrue(await self.cache.is_member(self.bot, -100, 1))
+
+    async def test_disabled_cache_always_asks(self):
+        self.cache.enabled = False
+        for _ in range(3):
+            await self.cache.is_member(self.bot, -100, 1)
+        self.assertEqual(self.bot.get_chat_member.await_count, 3)
+
+    async def test_chat_member_update_overrides_cached_answer(self):
+        await self.cache.is_member(self.bot, -100, 1)
+
+        update = MagicMock()
+        update.chat_member.chat.id = -100
+        update.chat_member.new_chat_member.user.id = 1
+        update.chat_member.new_chat_member.status = "left"
+        await chat_member_update(update, MagicMock())
+
+        self.assertFalse(await self.cache.is_member(self.bot, -100, 1))
+        self.assertEqual(self.bot.get_chat_member.await_count, 1)
+
+    async def test_is_speaker_user_uses_cache(self):
+        context = MagicMock()
+        context.bot = self.bot
+        event = {'id': 1, 'speakers_group_id': '-100'}
+        for _ in range(3):
+            self.assertTrue(await _is_speaker_user(event, 1, None, MagicMock(), context))
+        self.bot.get_chat_member.assert_awaited_once_with(-100, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
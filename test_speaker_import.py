@@ -0,0 +1,158 @@
+"""
+speaker_import: streaming, batched import of the speakers group.
+
+Real-conference risk: a speakers group of thousands imported row by row took
+long enough that /create looked hung, and re-running it created duplicate
+speakers. A failed import must not mark the event's list as complete.
+"""
+import asyncio
+import threading
+import unittest
+import sqlite3
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+import speaker_import
+from speaker_import import import_participants, SpeakerImporter, ImportNotConfigured
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT, speakers_synced_at DATETIME
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT, user_id INTEGER
+    )''')
+    cursor.execute("CREATE UNIQUE INDEX uq_speakers_event_username ON speakers (event_id, username)")
+    conn.commit()
+
+
+def _user(user_id, username=None, first_name="Sam", bot=False):
+    return SimpleNamespace(id=user_id, username=username, first_name=first_name, bot=bot)
+
+
+async def _stream(users):
+    for user in users:
+        yield user
+
+
+class TestImportParticipants(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+        self.conn = MockConnection(self.real_conn)
+        self.event_id = self.real_conn.execute("INSERT INTO events (id, status) VALUES (-3, 'PRE_OPEN')").lastrowid
+        self.real_conn.commit()
+
+        patcher = patch('speaker_import.BATCH_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _speakers(self):
+        return sorted(tuple(r) for r in self.real_conn.execute("SELECT username, first_name, user_id FROM speakers"))
+
+    async def test_streams_in_batches_and_skips_bots(self):
+        users = [_user(1, "Alice"), _user(2, None), _user(3, "helper_bot", bot=True), _user(4, "Bob"), _user(5, "carol")]
+        statements = []
+        self.real_conn.set_trace_callback(statements.append)
+
+        result = await import_participants(self.conn, self.event_id, _stream(users))
+
+        self.assertEqual((result.imported, result.skipped_bots), (4, 1))
+        self.assertEqual(self._speakers(), [("2", "Sam", 2), ("alice", "Sam", 1), ("bob", "Sam", 4), ("carol", "Sam", 5)])
+        self.assertLessEqual(len([s for s in statements if s.startswith("INSERT INTO speakers")]), 4)
+
+    async def test_reimport_updates_instead_of_duplicating(self):
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "alice", "Old")]))
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "Alice", "New")]))
+        self.assertEqual(self._speakers(), [("alice", "New", 1)])
+
+    async def test_marks_event_synced_only_when_complete(self):
+        async def broken():
+            yield _user(1, "alice")
+            raise ConnectionError("flood wait")
+
+        with self.assertRaises(ConnectionError):
+            await import_participants(self.conn, self.event_id, broken())
+        synced = self.real_conn.execute("SELECT speakers_synced_at FROM events").fetchone()[0]
+        self.assertIsNone(synced)
+
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "alice")]))
+        synced = self.real_conn.execute("SELECT speakers_synced_at FROM events").fetchone()[0]
+        self.assertIsNotNone(synced)
+
+    async def test_full_import_drops_members_who_left(self):
+        self.real_conn.execute("INSERT INTO speakers (event_id, username) VALUES (?, 'manual')", (self.event_id,))
+        self.real_conn.commit()
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "alice"), _user(2, "bob")]))
+
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "alice")]))
+
+        self.assertEqual(self._speakers(), [("alice", "Sam", 1), ("manual", None, None)])
+
+    async def test_unmarked_import_keeps_rows_and_sync_state(self):
+        await import_participants(self.conn, self.event_id, _stream([_user(1, "alice")]))
+        self.real_conn.execute("UPDATE events SET speakers_synced_at = NULL")
+        self.real_conn.commit()
+
+        await import_participants(self.conn, self.event_id, _stream([_user(2, "bob")]), mark_synced=False)
+
+        self.assertEqual(self._speakers(), [("alice", "Sam", 1), ("bob", "Sam", 2)])
+        self.assertIsNone(self.real_conn.execute("SELECT speakers_synced_at FROM events").fetchone()[0])
+
+    async def test_progress_reported(self):
+        progress = MagicMock()
+        with patch('speaker_import.PROGRESS_EVERY', 2):
+            await import_participants(self.conn, self.event_id, _stream([_user(i, f"user{i}") for i in range(5)]), progress)
+        self.assertEqual([c.args[0] for c in progress.call_args_list], [2, 4])
+
+
+class TestSpeakerImporter(unittest.IsolatedAsyncioTestCase):
+    async def test_unconfigured_importer_fails_fast(self):
+        importer = SpeakerImporter()
+        with patch('speaker_import.API_ID', 0):
+            with self.assertRaises(ImportNotConfigured):
+                await importer.run(-100, 1)
+        self.assertIsNone(importer._thread)
+
+    async def test_runs_on_its_own_loop(self):
+        importer = SpeakerImporter()
+        self.addCleanup(importer.stop)
+        seen = {}
+
+        async def fake_run(group_id, event_id, progress, mark_synced):
+            seen['thread'] = threading.current_thread().name
+            seen['loop'] = asyncio.get_running_loop()
+            return speaker_import.ImportResult(imported=3, skipped_bots=0)
+
+        with patch('speaker_import.API_ID', 1), patch('speaker_import.API_HASH', 'x'), \
+                patch.object(importer, '_run', side_effect=fake_run):
+            result = await importer.run(-100, 1)
+
+        self.assertEqual(result.imported, 3)
+        self.assertEqual(seen['thread'], 'speaker-import')
+        self.assertIsNot(seen['loop'], asyncio.get_running_loop())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import unittest
+import sqlite3
+from unittest.mock import MagicMock, AsyncMock, patch
+import bot
+from bot import close_registration_job
+
+TEST_DB_PATH = ":memory:"
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+class TestSpeakerResolution(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.patcher = patch('bot.get_db')
+        self.mock_get_db = self.patcher.start()
+
+        self.real_conn = sqlite3.connect(TEST_DB_PATH)
+        self.real_conn.row_factory = sqlite3.Row
+        self.mock_conn = MockConnection(self.real_conn)
+        self.mock_get_db.return_value = self.mock_conn
+
+        cursor = self.real_conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                status TEXT,
+                total_places INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                speakers_group_id TEXT,
+                waitlist_timeout_hours INTEGER,
+                end_time DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS registrations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id INTEGER,
+                user_id INTEGER,
+                chat_id INTEGER,
+                username TEXT,
+                first_name TEXT,
+                status TEXT,
+                signup_time DATETIME,
+                priority INTEGER,
+                notified_at DATETIME,
+                expires_at DATETIME,
+                guest_of_user_id INTEGER, partner_reg_id INTEGER,
+                invite_token TEXT,
+                FOREIGN KEY (event_id) REFERENCES events (id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS speakers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id INTEGER,
+                username TEXT,
+                FOREIGN KEY (event_id) REFERENCES events (id)
+            )
+        ''')
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS action_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id INTEGER,
+                user_id INTEGER,
+                username TEXT, first_name TEXT, action TEXT,
+                details TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (event_id) REFERENCES events (id)
+            )
+        """)
+        self.real_conn.commit()
+
+    def tearDown(self):
+        self.real_conn.close()
+        self.patcher.stop()
+
+    async def test_group_members_and_manual_speakers_skip_lottery(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places, speakers_group_id) VALUES (123, 'OPEN', 100, '-100500')")
+        event_id = cursor.lastrowid
+        # 1000-1004: regular users, 2000: group member, 3000: manual speaker (mixed-case username)
+        for uid in [1000, 1001, 1002, 1003, 1004, 2000]:
+            cursor.execute("INSERT INTO registrations (event_id, user_id, username, status) VALUES (?, ?, ?, 'REGISTERED')", (event_id, uid, f"user{uid}"))
+        cursor.execute("INSERT INTO registrations (event_id, user_id, username, status) VALUES (?, ?, ?, 'REGISTERED')", (event_id, 3000, "ManualSpeaker"))
+        cursor.execute("INSERT INTO speakers (event_id, username) VALUES (?, ?)", (event_id, "manualspeaker"))
+        self.real_conn.commit()
+
+        checked = []
+        async def mock_get_chat_member(chat_id, user_id):
+            checked.append(user_id)
+            member = MagicMock()
+            member.status = 'member' if user_id == 2000 else 'left'
+            return member
+
+        with patch('bot.application') as mock_app:
+            mock_app.bot.send_message = AsyncMock()
+            mock_app.bot.get_chat_member = AsyncMock(side_effect=mock_get_chat_member)
+            await close_registration_job(event_id, 123)
+
+        # Manual speakers are resolved from the DB without a Telegram round-trip
+        self.assertNotIn(3000, checked)
+        cursor.execute("SELECT user_id, status FROM registrations WHERE event_id = ?", (event_id,))
+        statuses = {row['user_id']: row['status'] for row in cursor.fetchall()}
+        self.assertEqual(statuses[2000], 'REGISTERED')
+        self.assertEqual(statuses[3000], 'REGISTERED')
+        for uid in range(1000, 1005):
+            self.assertEqual(statuses[uid], 'ACCEPTED')
+
+    async def test_membership_checks_run_concurrently_within_limit(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places, speakers_group_id) VALUES (123, 'OPEN', 10, '-100500')")
+        event_id = cursor.lastrowid
+        for i in range(40):
+            cursor.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (?, ?, 'REGISTERED')", (event_id, 1000 + i))
+        self.real_conn.commit()
+
+        in_flight = 0
+        max_in_flight = 0
+        async def slow_get_chat_member(chat_id, user_id):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            member = MagicMock()
+            member.status = 'left'
+            return member
+
+        with patch('bot.application') as mock_app, patch('bot.SPEAKER_CHECK_CONCURRENCY', 5):
+            mock_app.bot.send_message = AsyncMock()
+            mock_app.bot.get_chat_member = AsyncMock(side_effect=slow_get_chat_member)
+            await close_registration_job(event_id, 123)
+
+        self.assertGreater(max_in_flight, 1)
+        self.assertLessEqual(max_in_flight, 5)
+        cursor.execute("SELECT COUNT(*) as cnt FROM registrations WHERE event_id = ? AND status = 'ACCEPTED'", (event_id,))
+        self.assertEqual(cursor.fetchone()['cnt'], 10)
+
+    async def test_no_write_is_pending_while_members_are_checked(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places, speakers_group_id) VALUES (123, 'OPEN', 10, '-100500')")
+        event_id = cursor.lastrowid
+        for uid in [1000, 1001, 1002]:
+            cursor.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (?, ?, 'REGISTERED')", (event_id, uid))
+        self.real_conn.commit()
+
+        seen = []
+        async def get_chat_member(chat_id, user_id):
+            seen.append((self.real_conn.in_transaction,
+                         self.real_conn.execute("SELECT status FROM events WHERE id = ?", (event_id,)).fetchone()[0]))
+            if user_id == 1001:
+                # Another handler unregisters meanwhile, and must not be blocked
+                self.real_conn.execute("UPDATE registrations SET status = 'UNREGISTERED' WHERE user_id = 1001")
+                self.real_conn.commit()
+            member = MagicMock()
+            member.status = 'left'
+            return member
+
+        with patch('bot.application') as mock_app:
+            mock_app.bot.send_message = AsyncMock()
+            mock_app.bot.get_chat_member = AsyncMock(side_effect=get_chat_member)
+            await close_registration_job(event_id, 123)
+
+        self.assertEqual(seen, [(False, 'REVIEW')] * 3)
+        cursor.execute("SELECT user_id, status FROM registrations WHERE event_id = ?", (event_id,))
+        statuses = {row['user_id']: row['status'] for row in cursor.fetchall()}
+        self.assertEqual(statuses, {1000: 'ACCEPTED', 1001: 'UNREGISTERED', 1002: 'ACCEPTED'})
+
+    async def test_membership_errors_do_not_exclude_user(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places, speakers_group_id) VALUES (123, 'OPEN', 10, '-100500')")
+        event_id = cursor.lastrowid
+        cursor.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (?, ?, 'REGISTERED')", (event_id, 1000))
+        self.real_conn.commit()
+
+        with patch('bot.application') as mock_app:
+            mock_app.bot.send_message = AsyncMock()
+            mock_app.bot.get_chat_member = AsyncMock(side_effect=Exception("user not found"))
+            await close_registration_job(event_id, 123)
+
+        cursor.execute("SELECT status FROM registrations WHERE user_id = 1000")
+        self.assertEqual(cursor.fetchone()['status'], 'ACCEPTED')
+
+if __name__ == '__main__':
+    unittest.main()
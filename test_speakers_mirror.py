@@ -0,0 +1,182 @@
+"""
+Speakers mirror: the speakers table follows the speakers group via chat_member updates.
+
+Real-conference risk: a speaker who joins the group after /create would have
+to win the lottery like everyone else, and one who left would still be
+treated as a speaker. Once the mirror is synced, speaker checks must come
+from it and not from Telegram.
+"""
+import unittest
+import sqlite3
+from unittest.mock import patch, MagicMock, AsyncMock
+from bot import chat_member_update, _is_group_speaker, _resolve_speaker_reg_ids, EventCache
+
+GROUP_ID = -1001
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER, status TEXT, total_places INTEGER,
+        speakers_group_id TEXT, waitlist_timeout_hours INTEGER,
+        end_time DATETIME, event_start_time DATETIME,
+        registration_duration_hours INTEGER, speakers_synced_at DATETIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT, user_id INTEGER
+    )''')
+    cursor.execute("CREATE UNIQUE INDEX uq_speakers_event_username ON speakers (event_id, username)")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        reg_id INTEGER, old_status TEXT, new_status TEXT, count INTEGER, payload TEXT
+    )''')
+    conn.commit()
+
+
+def _member_update(user_id, status, username="Speaker", chat_id=GROUP_ID, is_bot=False):
+    update = MagicMock()
+    update.chat_member.chat.id = chat_id
+    new = update.chat_member.new_chat_member
+    new.status = status
+    new.user.id = user_id
+    new.user.username = username
+    new.user.first_name = "Sam"
+    new.user.is_bot = is_bot
+    return update
+
+
+class TestSpeakersMirror(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(":memory:")
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+
+        for target, value in [
+            ('bot.get_db', MagicMock(return_value=MockConnection(self.real_conn))),
+            ('bot.event_cache', EventCache()),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        cursor = self.real_conn.cursor()
+        cursor.execute(
+            "INSERT INTO events (chat_id, status, speakers_group_id, speakers_synced_at) VALUES (1, 'OPEN', ?, '2026-10-01')",
+            (str(GROUP_ID),)
+        )
+        self.event_id = cursor.lastrowid
+        self.real_conn.commit()
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def _speakers(self):
+        return [tuple(r) for r in self.real_conn.execute("SELECT username, user_id FROM speakers").fetchall()]
+
+    def _actions(self):
+        return [r[0] for r in self.real_conn.execute("SELECT action FROM action_logs ORDER BY id").fetchall()]
+
+    async def test_join_and_leave_update_the_mirror(self):
+        await chat_member_update(_member_update(7, "member"), MagicMock())
+        self.assertEqual(self._speakers(), [("speaker", 7)])
+
+        await chat_member_update(_member_update(7, "administrator"), MagicMock())
+        self.assertEqual(self._speakers(), [("speaker", 7)])
+
+        await chat_member_update(_member_update(7, "left"), MagicMock())
+        self.assertEqual(self._speakers(), [])
+        self.assertEqual(self._actions(), ['SPEAKER_JOINED', 'SPEAKER_LEFT'])
+
+    async def test_leave_matches_imported_row_without_user_id(self):
+        self.real_conn.execute("INSERT INTO speakers (event_id, username) VALUES (?, 'speaker')", (self.event_id,))
+        self.real_conn.commit()
+
+        await chat_member_update(_member_update(7, "kicked"), MagicMock())
+        self.assertEqual(self._speakers(), [])
+
+    async def test_join_claims_manual_row_with_same_username(self):
+        # Added by hand without a user_id, plus a mirrored row from before a rename
+        self.real_conn.execute("INSERT INTO speakers (event_id, username) VALUES (?, 'speaker')", (self.event_id,))
+        self.real_conn.execute("INSERT INTO speakers (event_id, username, user_id) VALUES (?, 'oldname', 7)", (self.event_id,))
+        self.real_conn.commit()
+
+        await chat_member_update(_member_update(7, "member"), MagicMock())
+
+        self.assertEqual(self._speakers(), [("speaker", 7)])
+        self.assertEqual(self._actions(), [])
+
+    async def test_member_without_username_uses_id(self):
+        await chat_member_update(_member_update(8, "member", username=None), MagicMock())
+        self.assertEqual(self._speakers(), [("8", 8)])
+
+    async def test_other_chats_and_bots_are_ignored(self):
+        await chat_member_update(_member_update(7, "member", chat_id=-2002), MagicMock())
+        await chat_member_update(_member_update(9, "member", is_bot=True), MagicMock())
+        self.assertEqual(self._speakers(), [])
+
+    async def test_synced_mirror_answers_yes_without_telegram(self):
+        self.real_conn.execute("INSERT INTO speakers (event_id, username, user_id) VALUES (?, 'speaker', 7)", (self.event_id,))
+        self.real_conn.commit()
+        event = self.real_conn.execute("SELECT * FROM events").fetchone()
+        tg_bot = MagicMock()
+        tg_bot.get_chat_member = AsyncMock()
+
+        self.assertTrue(await _is_group_speaker(tg_bot, event, 7, self.real_conn.cursor()))
+        tg_bot.get_chat_member.assert_not_awaited()
+
+    async def test_synced_mirror_confirms_no_with_telegram(self):
+        # E.g. joined while the bot had lost its admin rights, so no chat_member update came
+        event = self.real_conn.execute("SELECT * FROM events").fetchone()
+        tg_bot = MagicMock()
+        tg_bot.get_chat_member = AsyncMock(return_value=MagicMock(status="member"))
+
+        self.assertTrue(await _is_group_speaker(tg_bot, event, 8, self.real_conn.cursor()))
+        tg_bot.get_chat_member.assert_awaited_once()
+
+    async def test_unsynced_event_still_asks_telegram(self):
+        self.real_conn.execute("UPDATE events SET speakers_synced_at = NULL")
+        self.real_conn.commit()
+        event = self.real_conn.execute("SELECT * FROM events").fetchone()
+        tg_bot = MagicMock()
+        tg_bot.get_chat_member = AsyncMock(return_value=MagicMock(status="member"))
+
+        self.assertTrue(await _is_group_speaker(tg_bot, event, 7, self.real_conn.cursor()))
+        tg_bot.get_chat_member.assert_awaited_once()
+
+    async def test_lottery_resolution_uses_mirror(self):
+        self.real_conn.execute("INSERT INTO speakers (event_id, username, user_id) VALUES (?, 'renamed', 7)", (self.event_id,))
+        self.real_conn.commit()
+        regs = [{'id': 1, 'user_id': 7, 'username': 'new_name'}, {'id': 2, 'user_id': 8, 'username': 'guest'}]
+        tg_bot = MagicMock()
+        tg_bot.get_chat_member = AsyncMock()
+
+        ids = await _resolve_speaker_reg_ids(
+            self.event_id, str(GROUP_ID), regs, self.real_conn.cursor(), tg_bot, mirror_synced=True
+        )
+
+        self.assertEqual(ids, {1})
+        tg_bot.get_chat_member.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
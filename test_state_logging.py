@@ -72,6 +72,7 @@ class TestStateLogging(unittest.IsolatedAsyncioTestCase):
                 username TEXT, first_name TEXT, action TEXT,
                 details TEXT,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                reg_id INTEGER, old_status TEXT, new_status TEXT, count INTEGER, payload TEXT,
                 FOREIGN KEY (event_id) REFERENCES events (id)
             )
         ''')
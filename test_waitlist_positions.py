@@ -0,0 +1,129 @@
+"""
+Waitlist positions announced by /send_invites and shown by /status.
+
+Real-conference risk: a wrong position tells people how likely they are to
+get in. Pair members share a slot, so the person behind a pair is two places
+further back, and gaps left by unregistrations must not count.
+"""
+import unittest
+import sqlite3
+from unittest.mock import patch, MagicMock, AsyncMock
+from bot import send_invites, status, _waitlist_positions
+from models import create_outbox_table
+import messages
+
+TEST_DB_PATH = ":memory:"
+
+
+class MockConnection:
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+def _setup_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER, status TEXT, total_places INTEGER,
+        speakers_group_id TEXT, waitlist_timeout_hours INTEGER,
+        end_time DATETIME, event_start_time DATETIME,
+        registration_duration_hours INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, chat_id INTEGER,
+        username TEXT, first_name TEXT, status TEXT,
+        signup_time DATETIME, priority INTEGER, notified_at DATETIME,
+        expires_at DATETIME, guest_of_user_id INTEGER,
+        partner_reg_id INTEGER, invite_token TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS speakers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, username TEXT, first_name TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS action_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER, user_id INTEGER, username TEXT,
+        first_name TEXT, action TEXT, details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    create_outbox_table(cursor)
+    conn.commit()
+
+
+class TestWaitlistPositions(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.real_conn = sqlite3.connect(TEST_DB_PATH)
+        self.real_conn.row_factory = sqlite3.Row
+        _setup_schema(self.real_conn)
+
+        patcher = patch('bot.get_db', return_value=MockConnection(self.real_conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        cursor = self.real_conn.cursor()
+        cursor.execute("INSERT INTO events (chat_id, status, total_places) VALUES (123, 'REVIEW', 0)")
+        self.event_id = cursor.lastrowid
+        # user 1 (slot 0), pair 2+3 (slot 1), gap at slot 2, user 4 (slot 3), user 5 (slot 4)
+        for user_id, priority in [(1, 0), (2, 1), (3, 1), (4, 3), (5, 4)]:
+            cursor.execute(
+                "INSERT INTO registrations (event_id, user_id, status, priority) VALUES (?, ?, 'WAITLIST', ?)",
+                (self.event_id, user_id, priority)
+            )
+        self.real_conn.commit()
+
+    def tearDown(self):
+        self.real_conn.close()
+
+    def test_positions_in_one_pass(self):
+        cursor = self.real_conn.cursor()
+        positions = _waitlist_positions(self.event_id, cursor)
+        cursor.execute("SELECT id, user_id FROM registrations")
+        by_user = {row['user_id']: positions[row['id']] for row in cursor.fetchall()}
+        self.assertEqual(by_user, {1: 1, 2: 2, 3: 2, 4: 4, 5: 5})
+
+    async def test_send_invites_announces_positions(self):
+        update = MagicMock()
+        update.effective_user.id = 999
+        update.message.reply_text = AsyncMock()
+        context = MagicMock()
+        context.bot.send_message = AsyncMock()
+
+        with patch('bot.ADMIN_IDS', {999}), patch('bot.invite_next', new_callable=AsyncMock):
+            await send_invites(update, context)
+
+        sent = {c.args[0]: c.args[1] for c in context.bot.send_message.call_args_list}
+        for user_id, position in {1: 1, 2: 2, 3: 2, 4: 4, 5: 5}.items():
+            self.assertEqual(sent[user_id], messages.WAITLIST_NOTIFICATION.format(position=position))
+
+    async def test_status_shows_position(self):
+        cursor = self.real_conn.cursor()
+        cursor.execute("UPDATE events SET status = 'CLOSED' WHERE id = ?", (self.event_id,))
+        self.real_conn.commit()
+
+        update = MagicMock()
+        update.effective_user.id = 4
+        update.effective_user.username = None
+        update.effective_chat.type = "private"
+        update.message.reply_text = AsyncMock()
+        context = MagicMock()
+
+        await status(update, context)
+
+        update.message.reply_text.assert_called_once_with(
+            messages.STATUS_MSG.format(status=messages.STATUS_WAITLIST) + messages.WAITLIST_POSITION.format(position=4)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
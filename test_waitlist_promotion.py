@@ -2,6 +2,7 @@ import unittest
 import sqlite3
 from unittest.mock import MagicMock, AsyncMock, patch
 from bot import close_registration_job, invite_next, send_invites
+from models import create_outbox_table
 import messages
 
 # Use an in-memory database for testing
@@ -81,6 +82,7 @@ class TestWaitlistPromotion(unittest.IsolatedAsyncioTestCase):
                 FOREIGN KEY (event_id) REFERENCES events (id)
             )
         """)
+        create_outbox_table(cursor)
 
         self.real_conn.commit()
 
@@ -12,6 +12,7 @@ class TestWebDashboard(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         self.client = app.test_client()
+        web.render_cache.clear()
         
         # Setup DB
         self.patcher = patch('web.get_db')
@@ -25,7 +26,7 @@ class TestWebDashboard(unittest.TestCase):
         cursor.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, status TEXT, total_places INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
         cursor.execute("CREATE TABLE speakers (id INTEGER PRIMARY KEY, event_id INTEGER, username TEXT, first_name TEXT)")
         cursor.execute("CREATE TABLE registrations (id INTEGER PRIMARY KEY, event_id INTEGER, user_id INTEGER, username TEXT, first_name TEXT, status TEXT, guest_of_user_id INTEGER, partner_reg_id INTEGER, signup_time DATETIME, priority INTEGER)")
-        cursor.execute("CREATE TABLE action_logs (id INTEGER PRIMARY KEY, event_id INTEGER, timestamp DATETIME, username TEXT, first_name TEXT, user_id INTEGER, action TEXT, details TEXT)")
+        cursor.execute("CREATE TABLE action_logs (id INTEGER PRIMARY KEY, event_id INTEGER, timestamp DATETIME, username TEXT, first_name TEXT, user_id INTEGER, action TEXT, details TEXT, reg_id INTEGER, old_status TEXT, new_status TEXT, count INTEGER, payload TEXT)")
         
         # Insert test data
         cursor.execute("INSERT INTO events (status, total_places, created_at) VALUES ('OPEN', 10, CURRENT_TIMESTAMP)")
@@ -140,6 +141,236 @@ class TestWebDashboard(unittest.TestCase):
         # 10:00 UTC -> 11:00 Zurich
         self.assertIn("2024-03-09 11:00:00", html)
 
+class KeepOpenConnection:
+    """The API closes its connection after every call; keep the in-memory DB across requests."""
+    def __init__(self, real_conn):
+        self.real_conn = real_conn
+
+    def cursor(self):
+        return self.real_conn.cursor()
+
+    def commit(self):
+        self.real_conn.commit()
+
+    def close(self):
+        pass
+
+
+class ApiFixture:
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        web.render_cache.clear()
+
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        patcher = patch('web.get_db', return_value=KeepOpenConnection(self.conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.conn.close)
+
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, status TEXT, total_places INTEGER, end_time DATETIME, event_start_time DATETIME, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        cursor.execute("CREATE TABLE speakers (id INTEGER PRIMARY KEY, event_id INTEGER, username TEXT, first_name TEXT, user_id INTEGER)")
+        cursor.execute("CREATE TABLE registrations (id INTEGER PRIMARY KEY, event_id INTEGER, user_id INTEGER, username TEXT, first_name TEXT, status TEXT, guest_of_user_id INTEGER, partner_reg_id INTEGER, signup_time DATETIME, priority INTEGER)")
+        cursor.execute("CREATE TABLE action_logs (id INTEGER PRIMARY KEY, event_id INTEGER, timestamp DATETIME, username TEXT, first_name TEXT, user_id INTEGER, action TEXT, details TEXT, reg_id INTEGER, old_status TEXT, new_status TEXT, count INTEGER, payload TEXT)")
+        cursor.execute("INSERT INTO events (id, status, total_places) VALUES (1, 'REVIEW', 10)")
+        cursor.execute("INSERT INTO speakers (event_id, username, user_id) VALUES (1, 'speaker', 50)")
+        registrations = [
+            (1, 'ACCEPTED', None), (2, 'ACCEPTED', None), (3, 'ACCEPTED', 50), (4, 'WAITLIST', None),
+            (5, 'WAITLIST', None), (6, 'UNREGISTERED', None), (7, 'EXPIRED', None), (8, 'INVITED', None),
+        ]
+        cursor.executemany(
+            "INSERT INTO registrations (event_id, user_id, username, status, guest_of_user_id) VALUES (1, ?, 'u', ?, ?)",
+            registrations
+        )
+        for i in range(5):
+            cursor.execute("INSERT INTO action_logs (event_id, action, payload) VALUES (1, ?, ?)", (f"ACTION_{i}", '{"n": %d}' % i))
+        cursor.execute("INSERT INTO action_logs (event_id, action) VALUES (2, 'OTHER_EVENT')")
+        self.conn.commit()
+
+
+class TestJsonApi(ApiFixture, unittest.TestCase):
+    def test_summary_counts_every_panel(self):
+        data = self.client.get('/api/events/1/summary').get_json()
+        self.assertEqual(data['event']['status'], 'REVIEW')
+        self.assertEqual(data['counts'], {
+            'registered': 0, 'admitted': 2, 'invitees': 1, 'invited': 1,
+            'waitlist': 2, 'unregistered': 2, 'speakers': 1,
+        })
+        self.assertEqual(data['last_log_id'], 5)
+
+    def test_unknown_event_is_404(self):
+        self.assertEqual(self.client.get('/api/events/99/summary').status_code, 404)
+
+    def test_registrations_paged_by_status(self):
+        first = self.client.get('/api/events/1/registrations?status=accepted,waitlist&limit=3').get_json()
+        self.assertEqual([r['user_id'] for r in first['registrations']], [1, 2, 3])
+        self.assertEqual(first['registrations'][2]['speaker_username'], 'speaker')
+        self.assertTrue(first['has_more'])
+
+        rest = self.client.get(f"/api/events/1/registrations?status=ACCEPTED,WAITLIST&limit=3&after_id={first['next_after_id']}").get_json()
+        self.assertEqual([r['user_id'] for r in rest['registrations']], [4, 5])
+        self.assertFalse(rest['has_more'])
+
+    def test_registrations_one_row_each_whatever_the_speakers_table_holds(self):
+        # A second mirrored row for the same speaker, and a guest of a speaker added by hand
+        self.conn.execute("INSERT INTO speakers (event_id, username, user_id) VALUES (1, 'speaker_old', 50)")
+        self.conn.execute("INSERT INTO registrations (event_id, user_id, username, status) VALUES (1, 60, 'manual_speaker', 'UNREGISTERED')")
+        self.conn.execute("INSERT INTO registrations (event_id, user_id, username, status, guest_of_user_id) VALUES (1, 61, 'u', 'ACCEPTED', 60)")
+        self.conn.commit()
+
+        data = self.client.get('/api/events/1/registrations?status=ACCEPTED').get_json()
+
+        self.assertEqual([r['user_id'] for r in data['registrations']], [1, 2, 3, 61])
+        self.assertEqual(data['registrations'][3]['speaker_username'], 'manual_speaker')
+
+    def test_registrations_reject_bad_arguments(self):
+        self.assertEqual(self.client.get('/api/events/1/registrations?status=WINNER').status_code, 400)
+        self.assertEqual(self.client.get('/api/events/1/registrations?limit=abc').status_code, 400)
+
+    def test_logs_tail_after_id(self):
+        latest = self.client.get('/api/events/1/logs?limit=2').get_json()
+        self.assertEqual([l['action'] for l in latest['logs']], ['ACTION_3', 'ACTION_4'])
+        self.assertEqual(latest['logs'][0]['payload'], {'n': 3})
+
+        self.assertEqual(self.client.get(f"/api/events/1/logs?after_id={latest['next_after_id']}").get_json()['logs'], [])
+        self.conn.execute("INSERT INTO action_logs (event_id, action) VALUES (1, 'NEW')")
+        self.conn.commit()
+        new = self.client.get(f"/api/events/1/logs?after_id={latest['next_after_id']}").get_json()
+        self.assertEqual([l['action'] for l in new['logs']], ['NEW'])
+        self.assertEqual(new['next_after_id'], 7)
+
+
+class TestLiveFeed(ApiFixture, unittest.TestCase):
+    def _messages(self, feed):
+        return [m for m in feed if m.startswith('event:')]
+
+    def test_feed_pushes_new_rows_and_changed_counters_only(self):
+        now = [0]
+
+        def sleep(seconds):
+            now[0] += 1
+            if now[0] == 2:
+                self.conn.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (1, 9, 'WAITLIST')")
+                self.conn.execute("INSERT INTO action_logs (event_id, action) VALUES (1, 'REGISTER')")
+                self.conn.commit()
+
+        with patch('web.SSE_MAX_SECONDS', 3), patch('web.SSE_KEEPALIVE_SECONDS', 100):
+            messages = self._messages(web.event_feed(1, 5, clock=lambda: now[0], sleep=sleep))
+
+        self.assertEqual([m.split('\n')[0] for m in messages], ['event: summary', 'event: logs', 'event: summary'])
+        self.assertIn('id: 7', messages[1])
+        self.assertIn('"action": "REGISTER"', messages[1])
+        self.assertIn('"waitlist": 3', messages[2])
+
+    def test_feed_notices_changes_without_log_entries(self):
+        now = [0]
+
+        def sleep(seconds):
+            now[0] += 1
+            if now[0] == 1:
+                # E.g. /send_invites closing registration writes no action_logs row
+                self.conn.execute("INSERT INTO registrations (event_id, user_id, status) VALUES (1, 9, 'WAITLIST')")
+                self.conn.commit()
+
+        with patch('web.SSE_MAX_SECONDS', 4), patch('web.SSE_KEEPALIVE_SECONDS', 100), \
+                patch('web.SSE_SUMMARY_REFRESH_POLLS', 2):
+            messages = self._messages(web.event_feed(1, 5, clock=lambda: now[0], sleep=sleep))
+
+        self.assertEqual([m.split('\n')[0] for m in messages], ['event: summary', 'event: summary'])
+        self.assertIn('"waitlist": 3', messages[1])
+
+    def test_stream_endpoint_resumes_from_last_event_id(self):
+        with patch('web.SSE_MAX_SECONDS', 0):
+            response = self.client.get('/api/events/1/stream', headers={'Last-Event-ID': '3'})
+            body = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn('"action": "ACTION_3"', body)
+        self.assertNotIn('"action": "ACTION_2"', body)
+
+    def test_unknown_event_ends_stream(self):
+        body = self.client.get('/api/events/99/stream').get_data(as_text=True)
+        self.assertIn('event: error', body)
+
+    def test_dashboard_subscribes_to_feed(self):
+        html = self.client.get('/?event_id=1').data.decode()
+        self.assertIn('data-event-id="1"', html)
+        self.assertIn('data-last-log-id="5"', html)
+        self.assertIn('new EventSource', html)
+
+
+class TestDashboardCaching(ApiFixture, unittest.TestCase):
+    def _statements(self):
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        self.addCleanup(self.conn.set_trace_callback, None)
+        return statements
+
+    def test_unchanged_page_answers_304(self):
+        first = self.client.get('/?event_id=1')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+
+        again = self.client.get('/?event_id=1', headers={'If-None-Match': etag})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+    def test_render_cache_skips_panel_queries(self):
+        first = self.client.get('/?event_id=1').data
+        statements = self._statements()
+
+        second = self.client.get('/?event_id=1').data
+
+        self.assertEqual(first, second)
+        self.assertFalse([s for s in statements if s.startswith('SELECT * FROM registrations') or 'FROM action_logs WHERE event_id = ? ORDER BY id DESC' in s])
+
+    def test_new_log_entry_changes_etag(self):
+        etag = self.client.get('/?event_id=1').headers['ETag']
+        self.conn.execute("INSERT INTO action_logs (event_id, action) VALUES (1, 'FRESH_ACTION')")
+        self.conn.commit()
+
+        response = self.client.get('/?event_id=1', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('FRESH_ACTION', response.data.decode())
+
+    def test_status_change_changes_etag(self):
+        etag = self.client.get('/?event_id=1').headers['ETag']
+        self.conn.execute("UPDATE registrations SET status = 'ACCEPTED' WHERE status = 'INVITED'")
+        self.conn.commit()
+        self.assertEqual(self.client.get('/?event_id=1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_changes_without_log_entries_change_etag(self):
+        changes = [
+            # Pair linked
+            "UPDATE registrations SET partner_reg_id = 5 WHERE id = 4",
+            # Waitlist reordered
+            "UPDATE registrations SET priority = 1 WHERE id = 5",
+            # Guest link claimed by its recipient
+            "UPDATE registrations SET user_id = 77 WHERE id = 3",
+        ]
+        for sql in changes:
+            with self.subTest(sql=sql):
+                etag = self.client.get('/?event_id=1').headers['ETag']
+                self.conn.execute(sql)
+                self.conn.commit()
+                self.assertEqual(self.client.get('/?event_id=1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_change_to_another_event_changes_etag(self):
+        self.conn.execute("CREATE TABLE events_version (version INTEGER NOT NULL)")
+        self.conn.execute("INSERT INTO events_version VALUES (0)")
+        self.conn.commit()
+        etag = self.client.get('/?event_id=1').headers['ETag']
+
+        self.conn.execute("UPDATE events_version SET version = version + 1")
+        self.conn.commit()
+
+        self.assertEqual(self.client.get('/?event_id=1', headers={'If-None-Match': etag}).status_code, 200)
+
+
 class TestDashboardAuth(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = False
@@ -0,0 +1,73 @@
+"""
+Webhook mode and the offline update replayer.
+
+Real-conference risk: a webhook started without its secret would accept forged
+updates from anyone who finds the URL, and a misconfigured path silently stops
+all /register traffic on launch day.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+import httpx
+from bot import run_application
+from replay_updates import load_updates, renumber, replay, SECRET_HEADER
+
+
+class TestRunApplication(unittest.TestCase):
+    def test_polling_by_default(self):
+        app = MagicMock()
+        with patch('bot.WEBHOOK_URL', None):
+            run_application(app)
+        app.run_polling.assert_called_once()
+        app.run_webhook.assert_not_called()
+
+    def test_webhook_uses_secret_and_path(self):
+        app = MagicMock()
+        with patch('bot.WEBHOOK_URL', 'https://conf.example.org/'), \
+                patch('bot.WEBHOOK_SECRET', 's3cret'), \
+                patch('bot.WEBHOOK_PATH', 'tg'):
+            run_application(app)
+        kwargs = app.run_webhook.call_args.kwargs
+        self.assertEqual(kwargs['webhook_url'], 'https://conf.example.org/tg')
+        self.assertEqual(kwargs['url_path'], 'tg')
+        self.assertEqual(kwargs['secret_token'], 's3cret')
+        self.assertFalse(kwargs['drop_pending_updates'])
+        app.run_polling.assert_not_called()
+
+    def test_webhook_requires_secret(self):
+        with patch('bot.WEBHOOK_URL', 'https://conf.example.org'), patch('bot.WEBHOOK_SECRET', None):
+            with self.assertRaises(ValueError):
+                run_application(MagicMock())
+
+
+class TestReplay(unittest.IsolatedAsyncioTestCase):
+    def test_load_and_renumber(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'updates.jsonl')
+            with open(path, 'w') as f:
+                f.write(json.dumps({"update_id": 7, "message": {"text": "/register"}}) + "\n\n")
+                f.write(json.dumps({"update_id": 7, "message": {"text": "/status"}}) + "\n")
+            updates = renumber(load_updates(path) * 2, start=100)
+        self.assertEqual([u["update_id"] for u in updates], [100, 101, 102, 103])
+        self.assertEqual(updates[3]["message"]["text"], "/status")
+
+    async def test_replay_posts_with_secret_and_counts_errors(self):
+        received = []
+
+        def handler(request):
+            received.append(request.headers[SECRET_HEADER])
+            body = json.loads(request.content)
+            return httpx.Response(403 if body["update_id"] == 2 else 200)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            stats = await replay(renumber([{}] * 5), "http://bot/telegram", "s3cret", concurrency=2, client=client)
+
+        self.assertEqual(received, ["s3cret"] * 5)
+        self.assertEqual((stats["updates"], stats["errors"]), (5, 1))
+        self.assertGreater(stats["per_second"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
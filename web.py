@@ -1,12 +1,18 @@
+import hashlib
 import hmac
+import json
 import os
 import sqlite3
-from flask import Flask, Response, render_template_string, request
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Response, jsonify, request
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from models import get_db
+import analytics
 
 app = Flask(__name__)
-DB_PATH = os.getenv("DB_PATH", "bot_data.db")
 WEB_USER = os.getenv("WEB_USER", "admin")
 WEB_PASSWORD = os.getenv("WEB_PASSWORD", "")
 
@@ -38,11 +44,6 @@ def format_tz(ts):
     except:
         return ts
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def format_name(user):
     if user['username']:
         return f"@{user['username']}"
@@ -100,17 +101,54 @@ TEMPLATE = """
                 location.reload();
             }, 5000);
         }
+        // Live updates: new log rows are added in place and counters updated; the
+        // participant panels are re-rendered (at most every 5 s) only when a counter moved.
+        let reloadPending = false;
+        function scheduleReload() {
+            if (!reloadPending) { reloadPending = true; reloadData(); }
+        }
+        function addLogRows(entries) {
+            const table = document.getElementById('logs-table');
+            for (const entry of entries) {
+                const tr = document.createElement('tr');
+                for (const key of ['time', 'user', 'action', 'details']) {
+                    const td = document.createElement('td');
+                    if (key === 'action') { const b = document.createElement('b'); b.textContent = entry[key]; td.appendChild(b); }
+                    else { td.textContent = entry[key] || ''; }
+                    if (key === 'time') td.style.whiteSpace = 'nowrap';
+                    tr.appendChild(td);
+                }
+                table.rows[0].insertAdjacentElement('afterend', tr);
+            }
+            while (table.rows.length > 101) table.deleteRow(-1);
+        }
+        function applySummary(summary) {
+            let changed = summary.event.status !== document.body.dataset.status;
+            for (const [key, value] of Object.entries(summary.counts)) {
+                const el = document.getElementById('count-' + key);
+                if (el && el.textContent !== String(value)) { el.textContent = value; changed = true; }
+            }
+            if (changed) scheduleReload();
+        }
+        function startFeed() {
+            const eventId = document.body.dataset.eventId;
+            if (!eventId || !window.EventSource) { reloadData(); return; }
+            const source = new EventSource(`/api/events/${eventId}/stream?after_id=${document.body.dataset.lastLogId}`);
+            source.addEventListener('logs', (e) => addLogRows(JSON.parse(e.data)));
+            source.addEventListener('summary', (e) => applySummary(JSON.parse(e.data)));
+            source.addEventListener('error', (e) => { if (e.data) source.close(); });
+        }
         function restoreScroll() {
             const scrollPos = localStorage.getItem('scrollPosition');
             if (scrollPos) { window.scrollTo(0, parseInt(scrollPos)); localStorage.removeItem('scrollPosition'); }
             const scrolls = JSON.parse(localStorage.getItem('containerScrolls') || '{}');
             for (const id in scrolls) { const el = document.getElementById(id); if (el) el.scrollTop = scrolls[id]; }
             localStorage.removeItem('containerScrolls');
-            reloadData();
+            startFeed();
         }
     </script>
 </head>
-<body onload="restoreScroll()">
+<body onload="restoreScroll()"{% if event and event.status != 'CANCELLED' %} data-event-id="{{ event.id }}" data-status="{{ event.status }}" data-last-log-id="{{ logs[0]['id'] if logs else 0 }}"{% endif %}>
 
     <div class="topbar">
         <h1>Homeconf Admin {{ '· TEST EVENT' if event and event.id < 0 else '' }}</h1>
@@ -147,11 +185,11 @@ TEMPLATE = """
             <div class="stat-card"><div class="label">Event</div><div class="value">#{{ event.id }}</div></div>
             <div class="stat-card"><div class="label">Status</div><div class="value"><span class="status-badge status-{{ event.status|lower }}">{{ event.status }}</span></div></div>
             <div class="stat-card"><div class="label">Places</div><div class="value">{{ event.total_places or '—' }}</div></div>
-            <div class="stat-card"><div class="label">Admitted</div><div class="value">{{ admitted|length }}</div></div>
-            <div class="stat-card"><div class="label">Guests</div><div class="value">{{ invitees|length }}</div></div>
-            <div class="stat-card"><div class="label">Registered</div><div class="value">{{ registered|length }}</div></div>
-            <div class="stat-card"><div class="label">Waitlist</div><div class="value">{{ waitlist|length }}</div></div>
-            <div class="stat-card"><div class="label">Speakers</div><div class="value">{{ speakers|length }}</div></div>
+            <div class="stat-card"><div class="label">Admitted</div><div class="value" id="count-admitted">{{ admitted|length }}</div></div>
+            <div class="stat-card"><div class="label">Guests</div><div class="value" id="count-invitees">{{ invitees|length }}</div></div>
+            <div class="stat-card"><div class="label">Registered</div><div class="value" id="count-registered">{{ registered|length }}</div></div>
+            <div class="stat-card"><div class="label">Waitlist</div><div class="value" id="count-waitlist">{{ waitlist|length }}</div></div>
+            <div class="stat-card"><div class="label">Speakers</div><div class="value" id="count-speakers">{{ speakers|length }}</div></div>
         </div>
 
         <div class="grid">
@@ -259,7 +297,7 @@ TEMPLATE = """
             <div class="panel-logs" style="grid-column: 4;">
                 <h2>Action Logs · Zurich</h2>
                 <div class="table-wrap" id="logs-wrap-event" style="max-height: calc(100vh - 120px);">
-                    <table>
+                    <table id="logs-table">
                         <tr><th>Time</th><th>User</th><th>Action</th><th>Details</th></tr>
                         {% for log in logs %}
                         <tr>
@@ -279,6 +317,85 @@ TEMPLATE = """
 </html>
 """
 
+# Compiled once; filters are registered above
+DASHBOARD_TEMPLATE = app.jinja_env.from_string(TEMPLATE)
+# Part of every ETag, so pages cached by browsers expire when the template changes
+TEMPLATE_VERSION = hashlib.sha1(TEMPLATE.encode()).hexdigest()[:12]
+RENDER_CACHE_SIZE = 16
+
+
+class RenderCache:
+    """Rendered dashboard pages by ETag; least recently used pages are evicted."""
+
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.size = size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            html = self._pages.get(etag)
+            if html is not None:
+                self._pages.move_to_end(etag)
+            return html
+
+    def put(self, etag, html):
+        with self._lock:
+            self._pages[etag] = html
+            self._pages.move_to_end(etag)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+render_cache = RenderCache()
+
+
+def _events_version(cursor):
+    """The events_version counter (see models.py), or None on a database without it."""
+    try:
+        cursor.execute("SELECT version FROM events_version")
+    except sqlite3.OperationalError:
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _dashboard_etag(cursor, event, latest_test):
+    """Fingerprint of everything the page shows: the events (via events_version and
+    the row), per-status counts, the registrations' order and pairs, speakers and
+    the newest log entry. Changes that write no log entry (guest-link claims, pair
+    links, /send_invites) still move one of these."""
+    if event:
+        cursor.execute(
+            """
+            SELECT (SELECT MAX(id) FROM action_logs WHERE event_id = :e),
+                   (SELECT COUNT(*) || '/' || IFNULL(MAX(id), 0) FROM speakers WHERE event_id = :e),
+                   (SELECT group_concat(status || '=' || n) FROM
+                       (SELECT status, COUNT(*) AS n FROM registrations WHERE event_id = :e GROUP BY status)),
+                   (SELECT MAX(id) || '/' || TOTAL(priority) || '/' || TOTAL(partner_reg_id) || '/' || TOTAL(user_id)
+                       FROM registrations WHERE event_id = :e)
+            """,
+            {'e': event['id']}
+        )
+        state = (tuple(event), tuple(cursor.fetchone()))
+    else:
+        cursor.execute("SELECT MAX(id) FROM action_logs")
+        state = (None, cursor.fetchone()[0])
+    state += (_events_version(cursor), latest_test['id'] if latest_test else None, TEMPLATE_VERSION)
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+def _page_response(html, etag):
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    # Browsers revalidate on every load and get a 304 while nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/')
 def dashboard():
     conn = get_db()
@@ -286,7 +403,8 @@ def dashboard():
     
     cursor.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='events'")
     if cursor.fetchone()[0] == 0:
-        return render_template_string(TEMPLATE, event=None)
+        conn.close()
+        return DASHBOARD_TEMPLATE.render(event=None)
 
     # Get requested event_id from query param
     event_id_param = request.args.get('event_id')
@@ -306,6 +424,15 @@ def dashboard():
     # Get latest test event for linking
     cursor.execute("SELECT * FROM events WHERE id < 0 ORDER BY created_at DESC LIMIT 1")
     latest_test = cursor.fetchone()
+
+    etag = _dashboard_etag(cursor, event, latest_test)
+    if etag in request.if_none_match:
+        conn.close()
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+    html = render_cache.get(etag)
+    if html is not None:
+        conn.close()
+        return _page_response(html, etag)
     
     speakers = []
     invitees = []
@@ -341,14 +468,7 @@ def dashboard():
             cursor.execute("SELECT * FROM registrations WHERE event_id = ? AND status = 'WAITLIST' ORDER BY priority ASC", (event['id'],))
             waitlist = cursor.fetchall()
             
-            cursor.execute("""
-                SELECT r.*,
-                       (SELECT timestamp FROM action_logs WHERE user_id = r.user_id AND event_id = r.event_id AND action IN ('UNREGISTER', 'CALLBACK_DECLINE', 'EXPIRED') ORDER BY id DESC LIMIT 1) as unreg_time
-                FROM registrations r 
-                WHERE event_id = ? AND status IN ('UNREGISTERED', 'EXPIRED') 
-                ORDER BY unreg_time DESC
-            """, (event['id'],))
-            unregistered = cursor.fetchall()
+            unregistered = analytics.unregistered_with_times(cursor, event['id'])
             
         cursor.execute("SELECT * FROM action_logs WHERE event_id = ? ORDER BY id DESC LIMIT 100", (event['id'],))
         logs = cursor.fetchall()
@@ -358,8 +478,7 @@ def dashboard():
         logs = cursor.fetchall()
 
     conn.close()
-    return render_template_string(
-        TEMPLATE, 
+    html = DASHBOARD_TEMPLATE.render(
         event=event, 
         latest_test=latest_test,
         speakers=speakers,
@@ -370,8 +489,253 @@ def dashboard():
         unregistered=unregistered,
         logs=logs
     )
+    render_cache.put(etag, html)
+    return _page_response(html, etag)
+
+# --- JSON API: one indexed query per call, paged by id so clients fetch only what changed ---
+
+REGISTRATION_STATUSES = ('REGISTERED', 'WAITLIST', 'INVITED', 'ACCEPTED', 'UNREGISTERED', 'EXPIRED')
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
+SUMMARY_SQL = """
+    SELECT e.id, e.status, e.total_places, e.end_time, e.event_start_time, e.created_at,
+           COALESCE(SUM(r.status = 'REGISTERED'), 0) AS registered,
+           COALESCE(SUM(r.status = 'ACCEPTED' AND r.guest_of_user_id IS NULL), 0) AS admitted,
+           COALESCE(SUM(r.status IN ('ACCEPTED', 'INVITED') AND r.guest_of_user_id IS NOT NULL), 0) AS invitees,
+           COALESCE(SUM(r.status = 'INVITED' AND r.guest_of_user_id IS NULL), 0) AS invited,
+           COALESCE(SUM(r.status = 'WAITLIST'), 0) AS waitlist,
+           COALESCE(SUM(r.status IN ('UNREGISTERED', 'EXPIRED')), 0) AS unregistered,
+           (SELECT COUNT(*) FROM speakers WHERE event_id = e.id) AS speakers,
+           (SELECT MAX(id) FROM action_logs WHERE event_id = e.id) AS last_log_id
+    FROM events e LEFT JOIN registrations r ON r.event_id = e.id
+    WHERE e.id = ?
+    GROUP BY e.id
+"""
+
+COUNTER_KEYS = ('registered', 'admitted', 'invitees', 'invited', 'waitlist', 'unregistered', 'speakers')
+
+
+def event_summary(cursor, event_id):
+    """Event fields, per-panel counters and the newest log id, or None for an unknown event."""
+    cursor.execute(SUMMARY_SQL, (event_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    row = dict(row)
+    return {
+        'event': {k: row[k] for k in ('id', 'status', 'total_places', 'end_time', 'event_start_time', 'created_at')},
+        'counts': {k: row[k] for k in COUNTER_KEYS},
+        'last_log_id': row['last_log_id'],
+    }
+
+
+def _page_args():
+    """(after_id, limit) from the query string, or None if either is malformed."""
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return after_id, min(limit, API_MAX_PAGE_SIZE)
+
+
+def _page(key, rows, after_id, limit):
+    """rows plus the after_id to ask for next; has_more is false once a short page came back."""
+    rows = [analytics.decode_payload(row) for row in rows]
+    return jsonify({
+        key: rows,
+        'next_after_id': rows[-1]['id'] if rows else after_id,
+        'has_more': len(rows) == limit,
+    })
+
+
+def _api_error(message, status):
+    return jsonify({'error': message}), status
+
+
+@app.route('/api/events/<int:event_id>/summary')
+def api_event_summary(event_id):
+    conn = get_db()
+    try:
+        summary = event_summary(conn.cursor(), event_id)
+    finally:
+        conn.close()
+    if summary is None:
+        return _api_error('event not found', 404)
+    return jsonify(summary)
+
+
+@app.route('/api/events/<int:event_id>/registrations')
+def api_event_registrations(event_id):
+    """?status=WAITLIST,INVITED (optional), ?after_id=<last id seen>, ?limit=."""
+    page = _page_args()
+    if page is None:
+        return _api_error('after_id and limit must be integers, limit >= 1', 400)
+    after_id, limit = page
+    statuses = [s for s in request.args.get('status', '').upper().split(',') if s]
+    unknown = set(statuses) - set(REGISTRATION_STATUSES)
+    if unknown:
+        return _api_error(f"unknown status: {', '.join(sorted(unknown))}", 400)
+
+    # Scalar subqueries, not a join: one row per registration keeps keyset paging
+    # intact, and speakers added by hand have no user_id to join on
+    sql = """
+        SELECT r.id, r.user_id, r.username, r.first_name, r.status, r.priority, r.signup_time,
+               r.guest_of_user_id, r.partner_reg_id,
+               CASE WHEN r.guest_of_user_id IS NOT NULL THEN COALESCE(
+                   (SELECT username FROM speakers WHERE event_id = r.event_id AND user_id = r.guest_of_user_id LIMIT 1),
+                   (SELECT username FROM registrations WHERE user_id = r.guest_of_user_id AND username IS NOT NULL LIMIT 1)
+               ) END AS speaker_username
+        FROM registrations r
+        WHERE r.event_id = ? AND r.id > ?
+    """
+    params = [event_id, after_id]
+    if statuses:
+        sql += f" AND r.status IN ({', '.join('?' * len(statuses))})"
+        params.extend(statuses)
+    sql += " ORDER BY r.id LIMIT ?"
+    params.append(limit)
+
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return _page('registrations', rows, after_id, limit)
+
+
+@app.route('/api/events/<int:event_id>/logs')
+def api_event_logs(event_id):
+    """Log entries with id > ?after_id, oldest first; without after_id, the newest ?limit."""
+    page = _page_args()
+    if page is None:
+        return _api_error('after_id and limit must be integers, limit >= 1', 400)
+    after_id, limit = page
+
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        if 'after_id' in request.args:
+            cursor.execute(
+                "SELECT * FROM action_logs WHERE event_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (event_id, after_id, limit)
+            )
+            rows = cursor.fetchall()
+        else:
+            cursor.execute(
+                "SELECT * FROM action_logs WHERE event_id = ? ORDER BY id DESC LIMIT ?",
+                (event_id, limit)
+            )
+            rows = cursor.fetchall()[::-1]
+    finally:
+        conn.close()
+    return _page('logs', rows, after_id, limit)
+
+
+# --- Live feed: tails action_logs and pushes new rows and changed counters over SSE ---
+
+SSE_POLL_SECONDS = 1.0
+SSE_KEEPALIVE_SECONDS = 15
+# Streams are recycled so a forgotten tab doesn't hold a server thread forever;
+# EventSource reconnects on its own and resumes from Last-Event-ID.
+SSE_MAX_SECONDS = 300
+SSE_RETRY_MS = 3000
+SSE_BATCH = 500
+# Some changes (invites sent, guest links claimed, pairs linked) write no log
+# entry, so counters are also re-read after this many polls without one.
+SSE_SUMMARY_REFRESH_POLLS = 5
+
+
+def _log_entry(row):
+    """A log row as the dashboard shows it."""
+    return {
+        'id': row['id'],
+        'time': format_tz(row['timestamp']),
+        'user': format_name(row) if row['username'] or row['first_name'] else 'System',
+        'action': row['action'],
+        'details': row['details'],
+    }
+
+
+def _sse(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _poll_feed(event_id, after_id, with_summary):
+    """(log rows after after_id, event summary if there were any or with_summary)."""
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM action_logs WHERE event_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (event_id, after_id, SSE_BATCH)
+        )
+        rows = cursor.fetchall()
+        summary = event_summary(cursor, event_id) if rows or with_summary else None
+        return rows, summary
+    finally:
+        conn.close()
+
+
+def event_feed(event_id, after_id, clock=time.monotonic, sleep=time.sleep):
+    """Yield SSE messages: 'logs' with rows newer than after_id, 'summary' when the
+    event's status or counters change. Most idle polls are one empty index probe;
+    every SSE_SUMMARY_REFRESH_POLLS-th also re-reads the counters."""
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    started = last_sent = clock()
+    last_state = None
+    idle_polls = 0
+    while True:
+        # New log entries and the first poll re-read the counters, plus a periodic refresh
+        refresh = last_state is None or idle_polls >= SSE_SUMMARY_REFRESH_POLLS
+        rows, summary = _poll_feed(event_id, after_id, with_summary=refresh)
+        idle_polls = 0 if summary is not None else idle_polls + 1
+        if summary is None and last_state is None:
+            yield _sse('error', {'error': 'event not found'})
+            return
+        if rows:
+            after_id = rows[-1]['id']
+            yield _sse('logs', [_log_entry(row) for row in rows], after_id)
+            last_sent = clock()
+        if summary is not None:
+            state = (summary['event']['status'], summary['counts'])
+            if state != last_state:
+                last_state = state
+                yield _sse('summary', summary)
+                last_sent = clock()
+        if clock() - started >= SSE_MAX_SECONDS:
+            return
+        if clock() - last_sent >= SSE_KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent = clock()
+        sleep(SSE_POLL_SECONDS)
+
+
+@app.route('/api/events/<int:event_id>/stream')
+def api_event_stream(event_id):
+    """Server-Sent Events feed; resumes after Last-Event-ID (or ?after_id=)."""
+    try:
+        after_id = int(request.headers.get('Last-Event-ID') or request.args.get('after_id', 0))
+    except ValueError:
+        return _api_error('after_id must be an integer', 400)
+    return Response(
+        event_feed(event_id, after_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 
 if __name__ == '__main__':
     if not WEB_PASSWORD:
         raise SystemExit("WEB_PASSWORD environment variable must be set to run the dashboard.")
-    app.run(host='0.0.0.0', port=5000)
+    # threaded: each open live feed holds a worker thread
+    app.run(host='0.0.0.0', port=5000, threaded=True)